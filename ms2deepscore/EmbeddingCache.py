@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Sequence, Union
+import numpy as np
+from matchms import Spectrum
+
+
+class EmbeddingCache:
+    """Bounded, content-addressed cache for spectrum embeddings with LRU eviction.
+
+    Embeddings are stored under a key that identifies the spectrum peaks, the metadata
+    used as additional model input, and the model (see :func:`spectrum_embedding_key`).
+    When the cache grows beyond `max_entries` or `max_bytes`, the least recently used
+    embeddings are evicted. Optionally, all embeddings are also written to
+    `cache_directory`, which acts as a second (persistent) tier.
+
+    For example:
+
+    .. code-block:: python
+
+        from ms2deepscore import EmbeddingCache, MS2DeepScore
+
+        cache = EmbeddingCache(max_entries=100_000)
+        similarity_measure = MS2DeepScore(model, embedding_cache=cache)
+        scores = similarity_measure.matrix(references, queries)
+        print(cache.hits, cache.misses)
+
+    """
+    def __init__(self, max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None,
+                 cache_directory: Optional[Union[str, Path]] = None):
+        """
+
+        Parameters
+        ----------
+        max_entries
+            Maximum number of embeddings kept in memory. Default is None (no limit).
+        max_bytes
+            Maximum total size (in bytes) of the embeddings kept in memory.
+            Default is None (no limit).
+        cache_directory
+            Optional directory to persist all cached embeddings in. Embeddings evicted
+            from memory are then re-loaded from disk when needed. Default is None.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_directory = cache_directory
+        if cache_directory is not None:
+            os.makedirs(cache_directory, exist_ok=True)
+        self._embeddings = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._embeddings)
+
+    def __contains__(self, key: str):
+        return key in self._embeddings
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Return embedding stored under key (or None if not cached) and update counters."""
+        embedding = self._embeddings.get(key)
+        if embedding is not None:
+            self._embeddings.move_to_end(key)
+        elif self.cache_directory is not None and os.path.exists(self._filename(key)):
+            embedding = np.load(self._filename(key))
+            self._add(key, embedding)
+        if embedding is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return embedding
+
+    def put(self, key: str, embedding: np.ndarray):
+        """Store embedding under key."""
+        if self.cache_directory is not None:
+            np.save(self._filename(key), embedding)
+        self._add(key, embedding)
+
+    def clear(self):
+        """Remove all embeddings from memory (the disk tier is kept) and reset counters."""
+        self._embeddings.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _add(self, key: str, embedding: np.ndarray):
+        if key in self._embeddings:
+            self.nbytes -= self._embeddings.pop(key).nbytes
+        self._embeddings[key] = embedding
+        self.nbytes += embedding.nbytes
+        while self._embeddings and self._is_full():
+            _, evicted_embedding = self._embeddings.popitem(last=False)
+            self.nbytes -= evicted_embedding.nbytes
+
+    def _is_full(self) -> bool:
+        return (self.max_entries is not None and len(self._embeddings) > self.max_entries) \
+            or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+
+    def _filename(self, key: str) -> str:
+        return os.path.join(self.cache_directory, key + ".npy")
+
+
+def spectrum_embedding_key(spectrum: Spectrum, model_fingerprint: str,
+                           metadata_fields: Sequence[str] = ()) -> str:
+    """Return hash of the spectrum peaks, the given metadata fields and the model.
+
+    Parameters
+    ----------
+    spectrum
+        Input spectrum.
+    model_fingerprint
+        Fingerprint of the model, see :func:`~ms2deepscore.utils.get_model_fingerprint`.
+    metadata_fields
+        Metadata fields that are used as additional model inputs.
+    """
+    key = hashlib.sha256(model_fingerprint.encode())
+    key.update(np.ascontiguousarray(spectrum.peaks.mz, dtype=np.float64).tobytes())
+    key.update(np.ascontiguousarray(spectrum.peaks.intensities, dtype=np.float64).tobytes())
+    key.update(json.dumps([spectrum.get(field) for field in metadata_fields], default=str).encode())
+    return key.hexdigest()
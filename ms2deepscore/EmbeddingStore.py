@@ -0,0 +1,162 @@
+import json
+from pathlib import Path
+from typing import List, Union
+import numpy as np
+from matchms import Spectrum
+from .utils import get_spectrum_ids
+
+
+class EmbeddingStore:
+    """Persistent, memory-mapped store of MS2DeepScore spectrum embeddings.
+
+    The store is a single file holding a small json header (spectrum IDs location,
+    model fingerprint, dtype and shape) followed by the raw embedding array. Opening
+    a store only reads the header and memory-maps the embeddings, which makes it cheap
+    to reuse the embeddings of a large reference library across many runs.
+    An EmbeddingStore can be passed to :class:`~ms2deepscore.MS2DeepScore` methods in
+    place of a list of reference spectrums.
+
+    For example:
+
+    .. code-block:: python
+
+        from ms2deepscore import EmbeddingStore, MS2DeepScore
+        from ms2deepscore.models import load_model
+
+        model = load_model("model_file_123.hdf5")
+        similarity_measure = MS2DeepScore(model)
+
+        # Embed the library once
+        EmbeddingStore.from_spectrums("library.ms2ds", similarity_measure, references)
+
+        # ... and reuse it later
+        library = EmbeddingStore("library.ms2ds")
+        scores = similarity_measure.matrix(library, queries)
+
+    """
+    _magic = b"MS2DSEMB"
+    _alignment = 64
+
+    def __init__(self, filename: Union[str, Path]):
+        """
+
+        Parameters
+        ----------
+        filename
+            Filename of an existing embedding store.
+        """
+        self.filename = filename
+        with open(filename, "rb") as f:
+            assert f.read(len(self._magic)) == self._magic, "File is not a MS2DeepScore embedding store."
+            header_length = int(np.frombuffer(f.read(8), dtype="<u8")[0])
+            self.header = json.loads(f.read(header_length).decode())
+        self.model_fingerprint = self.header["model_fingerprint"]
+        self.embeddings = np.memmap(filename, dtype=np.dtype(self.header["dtype"]), mode="r",
+                                    offset=self.header["data_offset"],
+                                    shape=tuple(self.header["shape"]))
+        self._spectrum_ids = None
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    @property
+    def spectrum_ids(self) -> List[str]:
+        """Spectrum IDs of all stored embeddings (loaded on first access)."""
+        if self._spectrum_ids is None:
+            with open(self.filename, "rb") as f:
+                f.seek(self.header["ids_offset"])
+                self._spectrum_ids = json.loads(f.read(self.header["ids_length"]).decode())
+        return self._spectrum_ids
+
+    def check_model(self, model_fingerprint: str):
+        """Assert that the embeddings were created with the model with the given fingerprint."""
+        assert model_fingerprint == self.model_fingerprint, \
+            "Embeddings in store were created with a different model or spectrum binner."
+
+    @classmethod
+    def write(cls, filename: Union[str, Path], embeddings: np.ndarray,
+              spectrum_ids: List[str], model_fingerprint: str,
+              dtype=np.float32) -> "EmbeddingStore":
+        """Write embeddings to a new embedding store file.
+
+        Parameters
+        ----------
+        filename
+            Filename of the embedding store to create.
+        embeddings
+            Array of embeddings (n_spectrums, embedding dimension).
+        spectrum_ids
+            List of IDs of the spectrums in the same order as the embeddings.
+        model_fingerprint
+            Fingerprint of the model used to create the embeddings,
+            see :func:`~ms2deepscore.utils.get_model_fingerprint`.
+        dtype
+            Data type used to store the embeddings. Default is np.float32.
+        """
+        stored_embeddings = cls._create(filename, embeddings.shape, spectrum_ids, model_fingerprint, dtype)
+        stored_embeddings[:] = embeddings
+        stored_embeddings.flush()
+        return cls(filename)
+
+    @classmethod
+    def from_spectrums(cls, filename: Union[str, Path], similarity_measure,
+                       spectrums: List[Spectrum], id_field: str = "spectrum_id",
+                       dtype=np.float32, chunk_size: int = 10_000) -> "EmbeddingStore":
+        """Embed spectrums and write them to a new embedding store file.
+
+        Embeddings are computed and written chunk by chunk. For
+        :class:`~ms2deepscore.MS2DeepScoreMonteCarlo` (with a random_seed) all
+        ensemble embeddings of a spectrum are stored as one row.
+
+        Parameters
+        ----------
+        filename
+            Filename of the embedding store to create.
+        similarity_measure
+            MS2DeepScore (or MS2DeepScoreMonteCarlo) instance used to compute the embeddings.
+        spectrums
+            List of spectrums to embed.
+        id_field
+            Metadata field used as spectrum ID. Default is "spectrum_id".
+        dtype
+            Data type used to store the embeddings. Default is np.float32.
+        chunk_size
+            Number of spectrums embedded before writing to the file. Default is 10000.
+        """
+        # pylint: disable=too-many-arguments
+        n_ensembles = getattr(similarity_measure, "n_ensembles", 1)
+        shape = (len(spectrums), similarity_measure.output_vector_dim * n_ensembles)
+        stored_embeddings = cls._create(filename, shape, get_spectrum_ids(spectrums, id_field),
+                                        similarity_measure.model_fingerprint, dtype)
+        for i in range(0, len(spectrums), chunk_size):
+            chunk = spectrums[i:i + chunk_size]
+            stored_embeddings[i:i + chunk_size] = \
+                similarity_measure.calculate_vectors(chunk).reshape(len(chunk), shape[1])
+        stored_embeddings.flush()
+        return cls(filename)
+
+    @classmethod
+    def _create(cls, filename, shape, spectrum_ids, model_fingerprint, dtype) -> np.memmap:
+        """Write file header and spectrum IDs and return writable memmap for the embeddings."""
+        assert len(spectrum_ids) == shape[0], "Expected one spectrum ID per embedding."
+        dtype = np.dtype(dtype)
+        header = {"model_fingerprint": model_fingerprint,
+                  "dtype": dtype.str,
+                  "shape": list(shape),
+                  "data_offset": 0, "ids_offset": 0, "ids_length": 0}
+        ids_bytes = json.dumps(list(spectrum_ids)).encode()
+        # Offsets are written with fixed width to allow computing the header length first
+        header["data_offset"] = header["ids_offset"] = header["ids_length"] = 10**15
+        header_length = len(json.dumps(header).encode())
+        data_offset = cls._alignment * int(np.ceil((len(cls._magic) + 8 + header_length) / cls._alignment))
+        header["data_offset"] = data_offset
+        header["ids_offset"] = data_offset + int(np.prod(shape)) * dtype.itemsize
+        header["ids_length"] = len(ids_bytes)
+        header_bytes = json.dumps(header).encode().ljust(header_length)
+        with open(filename, "wb") as f:
+            f.write(cls._magic)
+            f.write(np.array([header_length], dtype="<u8").tobytes())
+            f.write(header_bytes)
+            f.seek(header["ids_offset"])
+            f.write(ids_bytes)
+        return np.memmap(filename, dtype=dtype, mode="r+", offset=data_offset, shape=tuple(shape))
@@ -0,0 +1,180 @@
+from pathlib import Path
+from typing import Optional, Tuple, Union
+import numpy as np
+from scipy.sparse import csr_matrix
+from .vector_operations import normalize_vectors
+
+
+class IVFIndex:
+    """Approximate nearest neighbour index (inverted file index) for cosine similarity
+    search over MS2DeepScore embeddings.
+
+    The embeddings are clustered by spherical k-means into `n_clusters` coarse clusters.
+    A query is only compared to the embeddings of the `n_probe` clusters with the most
+    similar centroids, which makes the search sublinear in the number of references.
+    With n_probe == n_clusters the search is exact.
+
+    For example:
+
+    .. code-block:: python
+
+        from ms2deepscore import EmbeddingStore, IVFIndex
+
+        library = EmbeddingStore("library.ms2ds")
+        index = IVFIndex.build(library.embeddings, n_clusters=1000)
+        index.save("library_index.npz")
+
+        index = IVFIndex.load("library_index.npz")
+        query_vectors = similarity_measure.calculate_vectors(queries)
+        indices, scores = index.query(query_vectors, k=50, n_probe=20)
+
+    """
+    def __init__(self, centroids: np.ndarray, vectors: np.ndarray,
+                 vector_ids: np.ndarray, cluster_offsets: np.ndarray):
+        """
+
+        Parameters
+        ----------
+        centroids
+            Normalized cluster centroids (n_clusters, vector dimension).
+        vectors
+            Normalized vectors sorted by cluster (n_vectors, vector dimension).
+        vector_ids
+            Original (row) index of every vector in `vectors`.
+        cluster_offsets
+            Vectors of cluster i are vectors[cluster_offsets[i]:cluster_offsets[i+1]].
+        """
+        self.centroids = centroids
+        self.vectors = vectors
+        self.vector_ids = vector_ids
+        self.cluster_offsets = cluster_offsets
+
+    @property
+    def n_clusters(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, n_clusters: int,
+              n_iterations: int = 20, sample_size: Optional[int] = 100_000,
+              random_seed: int = 0, dtype=np.float32) -> "IVFIndex":
+        """Build index from embeddings.
+
+        Parameters
+        ----------
+        embeddings
+            Array of embeddings (n_vectors, vector dimension).
+        n_clusters
+            Number of coarse clusters. A common choice is around sqrt(n_vectors).
+        n_iterations
+            Number of k-means iterations. Default is 20.
+        sample_size
+            Number of randomly sampled embeddings used to train the centroids.
+            Set to None to use all embeddings. Default is 100000.
+        random_seed
+            Seed for centroid initialization and sampling. Default is 0.
+        dtype
+            Data type used to store the vectors in the index. Default is np.float32.
+        """
+        # pylint: disable=too-many-arguments
+        assert 0 < n_clusters <= embeddings.shape[0], "Expected 0 < n_clusters <= number of embeddings."
+        rng = np.random.default_rng(random_seed)
+        vectors = normalize_vectors(embeddings, dtype)
+        training_vectors = vectors
+        if sample_size is not None and sample_size < vectors.shape[0]:
+            training_vectors = vectors[rng.choice(vectors.shape[0], max(sample_size, n_clusters), replace=False)]
+        centroids = _spherical_kmeans(training_vectors, n_clusters, n_iterations, rng)
+
+        assignments = _assign_to_centroids(vectors, centroids)
+        order = np.argsort(assignments, kind="stable")
+        cluster_offsets = np.zeros(n_clusters + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_clusters), out=cluster_offsets[1:])
+        return cls(centroids, vectors[order], order, cluster_offsets)
+
+    def query(self, query_vectors: np.ndarray, k: int,
+              n_probe: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+        """Find approximate top-k most similar indexed vectors for every query vector.
+
+        Parameters
+        ----------
+        query_vectors
+            Array of query vectors (n_queries, vector dimension).
+        k
+            Number of neighbours to return per query.
+        n_probe
+            Number of clusters to search per query. Default is 10.
+
+        Returns
+        -------
+        indices, scores
+            Arrays of shape (n_queries, k) with the indices of the found vectors (as in the
+            embeddings the index was built from) and their cosine scores, sorted from highest
+            to lowest score. If fewer than k candidates are found, the remaining entries
+            have index -1 and score -inf.
+        """
+        n_probe = min(n_probe, self.n_clusters)
+        query_vectors = normalize_vectors(query_vectors, self.vectors.dtype)
+        indices = np.full((query_vectors.shape[0], k), -1, dtype=np.int64)
+        scores = np.full((query_vectors.shape[0], k), -np.inf, dtype=self.vectors.dtype)
+        centroid_scores = np.dot(query_vectors, self.centroids.T)
+        probed_clusters = np.argpartition(-centroid_scores, n_probe - 1, axis=1)[:, :n_probe]
+        for i, query_vector in enumerate(query_vectors):
+            candidates = np.concatenate([np.arange(self.cluster_offsets[c], self.cluster_offsets[c + 1])
+                                         for c in probed_clusters[i]])
+            candidate_scores = np.dot(self.vectors[candidates], query_vector)
+            n_found = min(k, candidates.shape[0])
+            if n_found == 0:
+                continue
+            selected = np.argpartition(-candidate_scores, n_found - 1)[:n_found]
+            selected = selected[np.argsort(-candidate_scores[selected], kind="stable")]
+            indices[i, :n_found] = self.vector_ids[candidates[selected]]
+            scores[i, :n_found] = candidate_scores[selected]
+        return indices, scores
+
+    def save(self, filename: Union[str, Path]):
+        """Save index to (numpy .npz) file.
+
+        Parameters
+        ----------
+        filename
+            Filename to specify where to store the index.
+        """
+        np.savez(filename, centroids=self.centroids, vectors=self.vectors,
+                 vector_ids=self.vector_ids, cluster_offsets=self.cluster_offsets)
+
+    @classmethod
+    def load(cls, filename: Union[str, Path]) -> "IVFIndex":
+        """Load index from file created by :meth:`save`.
+
+        Parameters
+        ----------
+        filename
+            Filename of the stored index.
+        """
+        with np.load(filename) as data:
+            return cls(data["centroids"], data["vectors"], data["vector_ids"], data["cluster_offsets"])
+
+
+def _spherical_kmeans(vectors: np.ndarray, n_clusters: int, n_iterations: int,
+                      rng: np.random.Generator) -> np.ndarray:
+    """K-means clustering of normalized vectors using cosine similarity."""
+    centroids = vectors[rng.choice(vectors.shape[0], n_clusters, replace=False)].copy()
+    for _ in range(n_iterations):
+        assignments = _assign_to_centroids(vectors, centroids)
+        membership = csr_matrix((np.ones(vectors.shape[0], dtype=vectors.dtype),
+                                 (assignments, np.arange(vectors.shape[0]))),
+                                shape=(n_clusters, vectors.shape[0]))
+        new_centroids = np.asarray(membership @ vectors)
+        empty_clusters = np.where(np.bincount(assignments, minlength=n_clusters) == 0)[0]
+        # Re-seed empty clusters with random vectors
+        new_centroids[empty_clusters] = vectors[rng.choice(vectors.shape[0], len(empty_clusters))]
+        centroids = normalize_vectors(new_centroids, vectors.dtype)
+    return centroids
+
+
+def _assign_to_centroids(vectors: np.ndarray, centroids: np.ndarray,
+                         block_size: int = 10_000) -> np.ndarray:
+    """Return index of most similar centroid for every vector."""
+    assignments = np.empty(vectors.shape[0], dtype=np.int64)
+    for i in range(0, vectors.shape[0], block_size):
+        assignments[i:i + block_size] = np.argmax(np.dot(vectors[i:i + block_size], centroids.T), axis=1)
+    return assignments
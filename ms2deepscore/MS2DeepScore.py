@@ -1,10 +1,38 @@
-from typing import List
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
 import numpy as np
 from matchms import Spectrum
 from matchms.similarity.BaseSimilarity import BaseSimilarity
+from sparsestack import StackedSparseArray
 from tqdm import tqdm
+from .EmbeddingCache import EmbeddingCache, spectrum_embedding_key
+from .EmbeddingStore import EmbeddingStore
+from .input_matrices import create_input_matrix, create_metadata_matrix
+from .precursor_mz_windows import get_precursor_mz, precursor_mz_candidates
+from .ScoringPool import ScoringPool
 from .typing import BinnedSpectrumType
-from .vector_operations import cosine_similarity, cosine_similarity_matrix
+from .utils import get_model_fingerprint, get_spectrum_ids
+from .vector_operations import (cosine_similarity,
+                                cosine_similarity_matrix_parallel,
+                                cosine_similarity_matrix_symmetric,
+                                cosine_similarity_matrix_tiled,
+                                cosine_similarity_sparse,
+                                cosine_similarity_sparse_symmetric,
+                                pairs_from_embeddings, top_k_cosine_similarity)
+
+
+def assert_identical_spectrums(references, queries):
+    """Check that references and queries are the same spectrums (for is_symmetric=True).
+
+    Spectrums are compared by identity and only if they are not the same objects
+    by their hash, instead of comparing them element by element."""
+    if references is queries:
+        return
+    identical = not isinstance(references, EmbeddingStore) and not isinstance(queries, EmbeddingStore) \
+        and len(references) == len(queries) \
+        and all(reference is query or hash(reference) == hash(query)
+                for reference, query in zip(references, queries))
+    assert identical, "Expected references to be equal to queries for is_symmetric=True"
 
 
 class MS2DeepScore(BaseSimilarity):
@@ -38,7 +66,9 @@ class MS2DeepScore(BaseSimilarity):
 
     """
 
-    def __init__(self, model, progress_bar: bool = True):
+    def __init__(self, model, progress_bar: bool = True, batch_size: int = 1000,
+                 embedding_cache: Optional[EmbeddingCache] = None,
+                 n_jobs: int = 1):
         """
 
         Parameters
@@ -50,6 +80,18 @@ class MS2DeepScore(BaseSimilarity):
         progress_bar:
             Set to True to monitor the embedding creating with a progress bar.
             Default is False.
+        batch_size:
+            Number of spectra that are embedded together in one forward pass of
+            the base network. Default is 1000.
+        embedding_cache:
+            Optional EmbeddingCache. When given, embeddings of spectra that were
+            embedded before (same peaks, additional input metadata and model) are taken
+            from the cache instead of being binned and computed again. Default is None.
+        n_jobs:
+            Number of worker processes used by :meth:`matrix` and :meth:`search`. For
+            n_jobs > 1, a persistent pool of workers (each loading the model once) is
+            started on first use, and queries are sharded over the workers. Call
+            :meth:`close` to stop the workers. Default is 1 (no parallelization).
         """
         self.model = model
         self.multi_inputs = (model.nr_of_additional_inputs > 0)
@@ -59,22 +101,42 @@ class MS2DeepScore(BaseSimilarity):
             self.input_vector_dim = self.model.base.input_shape[1]
         self.output_vector_dim = self.model.base.output_shape[1]
         self.progress_bar = progress_bar
+        self.batch_size = batch_size
+        self.embedding_cache = embedding_cache
+        self.n_jobs = n_jobs
+        self._scoring_pool = None
+        self._model_fingerprint = None
+
+    @property
+    def model_fingerprint(self) -> str:
+        """Hash of the model weights and spectrum binner settings."""
+        if self._model_fingerprint is None:
+            self._model_fingerprint = get_model_fingerprint(self.model)
+        return self._model_fingerprint
+
+    @property
+    def scoring_pool(self) -> ScoringPool:
+        """Persistent pool of worker processes (started on first access)."""
+        if self._scoring_pool is None:
+            self._scoring_pool = ScoringPool(self.model, self.n_jobs, batch_size=self.batch_size)
+        return self._scoring_pool
+
+    def close(self):
+        """Stop the worker processes (if any were started)."""
+        if self._scoring_pool is not None:
+            self._scoring_pool.close()
+            self._scoring_pool = None
 
     def _create_input_vector(self, binned_spectrum: BinnedSpectrumType):
         """Creates input vector for model.base based on binned peaks and intensities"""
-        if self.multi_inputs:
-            X = [np.zeros((1, i[1])) for i in self.model.base.input_shape]
-            idx = np.array([int(x) for x in binned_spectrum.binned_peaks.keys()])
-            values = np.array(list(binned_spectrum.binned_peaks.values()))
+        return self._create_input_vectors([binned_spectrum])
 
-            X[0][0, idx] = values
-            X[1] = np.array([[float(value) for key, value in binned_spectrum.metadata.items() if (key != "inchikey")]])
-        else:
-            X = np.zeros((1, self.input_vector_dim))
-            idx = np.array([int(x) for x in binned_spectrum.binned_peaks.keys()])
-            values = np.array(list(binned_spectrum.binned_peaks.values()))
-            X[0, idx] = values
-        return X
+    def _create_input_vectors(self, binned_spectrums: List[BinnedSpectrumType]):
+        """Creates input block for model.base for a batch of binned spectrums"""
+        if self.multi_inputs:
+            return [create_input_matrix(binned_spectrums, self.input_vector_dim[0]),
+                    create_metadata_matrix(binned_spectrums)]
+        return create_input_matrix(binned_spectrums, self.input_vector_dim)
 
     def pair(self, reference: Spectrum, query: Spectrum) -> float:
         """Calculate the MS2DeepScore similaritiy between a reference and a query spectrum.
@@ -91,64 +153,412 @@ class MS2DeepScore(BaseSimilarity):
         ms2ds_similarity
             MS2DeepScore similarity score.
         """
-        binned_reference = self.model.spectrum_binner.transform([reference])[0]
-        binned_query = self.model.spectrum_binner.transform([query])[0]
-        reference_vector = self.model.base.predict(self._create_input_vector(binned_reference))
-        query_vector = self.model.base.predict(self._create_input_vector(binned_query))
+        vectors = self.calculate_vectors([reference, query])
+        return cosine_similarity(vectors[0, :], vectors[1, :])
+
+    def pairs(self, spectrum_pairs: Iterable[Tuple[Spectrum, Spectrum]]) -> np.ndarray:
+        """Calculate the MS2DeepScore similarities for a list of (reference, query) pairs.
+
+        Every unique spectrum (object) is embedded only once, after which all pairs are
+        scored together.
 
-        return cosine_similarity(reference_vector[0, :], query_vector[0, :])
+        Parameters
+        ----------
+        spectrum_pairs:
+            Iterable of (reference, query) spectrum pairs.
+
+        Returns
+        -------
+        Array with one MS2DeepScore similarity per pair.
+        """
+        spectrum_indices = {}
+        unique_spectrums = []
+        pair_indices = []
+        for reference, query in spectrum_pairs:
+            for spectrum in (reference, query):
+                if id(spectrum) not in spectrum_indices:
+                    spectrum_indices[id(spectrum)] = len(unique_spectrums)
+                    unique_spectrums.append(spectrum)
+            pair_indices.append((spectrum_indices[id(reference)], spectrum_indices[id(query)]))
+        if not pair_indices:
+            return np.zeros(0, dtype=self.score_datatype)
+        vectors = self.calculate_vectors(unique_spectrums)
+        rows, cols = np.array(pair_indices, dtype=np.int64).T
+        return pairs_from_embeddings(vectors, vectors, rows, cols).astype(self.score_datatype)
+
+    def sparse_array(self, references: List[Spectrum], queries: List[Spectrum],
+                     idx_row, idx_col, is_symmetric: bool = False) -> np.ndarray:
+        """Calculate the MS2DeepScore similarities for the pairs (references[idx_row[i]],
+        queries[idx_col[i]]).
+
+        Only references and queries that occur in a pair are embedded (each of them once).
+
+        Parameters
+        ----------
+        references:
+            List of reference spectrums.
+        queries:
+            List of query spectrums.
+        idx_row:
+            Array of reference indices.
+        idx_col:
+            Array of query indices.
+        is_symmetric:
+            Set to True if references == queries to embed every spectrum only once.
+        """
+        # pylint: disable=too-many-arguments
+        idx_row = np.asarray(idx_row, dtype=np.int64)
+        idx_col = np.asarray(idx_col, dtype=np.int64)
+        assert idx_row.shape == idx_col.shape, "col and row indices must be of same shape"
+        if idx_row.shape[0] == 0:
+            return np.zeros(0, dtype=self.score_datatype)
+        if is_symmetric:
+            assert_identical_spectrums(references, queries)
+            used, inverse = np.unique(np.concatenate([idx_row, idx_col]), return_inverse=True)
+            vectors = self.calculate_vectors([references[i] for i in used])
+            return pairs_from_embeddings(vectors, vectors, inverse[:len(idx_row)],
+                                         inverse[len(idx_row):]).astype(self.score_datatype)
+        used_rows, rows = np.unique(idx_row, return_inverse=True)
+        used_cols, cols = np.unique(idx_col, return_inverse=True)
+        reference_vectors = self.calculate_vectors([references[i] for i in used_rows])
+        query_vectors = self.calculate_vectors([queries[i] for i in used_cols])
+        return pairs_from_embeddings(reference_vectors, query_vectors, rows, cols).astype(self.score_datatype)
 
-    def matrix(self, references: List[Spectrum], queries: List[Spectrum],
+    def matrix(self, references: Union[List[Spectrum], EmbeddingStore], queries: List[Spectrum],
                array_type: str = "numpy",
-               is_symmetric: bool = False) -> np.ndarray:
+               is_symmetric: bool = False,
+               out: Optional[np.ndarray] = None,
+               block_size: int = 10_000,
+               score_threshold: Optional[float] = None,
+               max_per_row: Optional[int] = None) -> Union[np.ndarray, StackedSparseArray]:
         """Calculate the MS2DeepScore similarities between all references and queries.
 
         Parameters
         ----------
         references:
-            Reference spectrum.
+            Reference spectrum. Can also be an EmbeddingStore with precomputed
+            embeddings of the reference spectrums.
         queries:
             Query spectrum.
         array_type
             Specify the output array type. Can be "numpy" or "sparse".
-            Currently, only "numpy" is supported and will return a numpy array.
-            Future versions will include "sparse" as option to return a COO-sparse array.
+            "numpy" will return a numpy array. "sparse" will return a COO-sparse
+            StackedSparseArray (as used by matchms) which only contains the scores
+            selected by `score_threshold` and `max_per_row`. Sparse scores are computed
+            block by block, so that the dense score matrix never exists.
         is_symmetric:
             Set to True if references == queries to speed up calculation about 2x.
-            Uses the fact that in this case score[i, j] = score[j, i]. Default is False.
+            Uses the fact that in this case score[i, j] = score[j, i]: only the upper
+            triangle blocks are computed and then mirrored. Default is False.
+        out:
+            Optional preallocated array (e.g. a disk-backed np.memmap) of shape
+            (len(references), len(queries)) into which the scores are written block by
+            block. Scores are then computed in the dtype of `out`. Default is None.
+        block_size:
+            Number of spectra per block when writing into `out` or when computing
+            sparse scores. Default is 10000.
+        score_threshold:
+            Only used for array_type="sparse". Only scores >= score_threshold are
+            kept. Default is None (keep all scores).
+        max_per_row:
+            Only used for array_type="sparse". Keep only the max_per_row highest
+            scores per reference. Default is None (no limit).
 
         Returns
         -------
         ms2ds_similarity
             Array of MS2DeepScore similarity scores.
         """
-        reference_vectors = self.calculate_vectors(references)
+        # pylint: disable=too-many-arguments
+        if array_type not in ["numpy", "sparse"]:
+            raise ValueError("array_type must be 'numpy' or 'sparse'.")
         if is_symmetric:
-            assert np.all(references == queries), \
-                "Expected references to be equal to queries for is_symmetric=True"
-            query_vectors = reference_vectors
-        else:
-            query_vectors = self.calculate_vectors(queries)
+            assert_identical_spectrums(references, queries)
+            reference_vectors = self.get_embedding_array(references)
+            return self._symmetric_matrix(reference_vectors, array_type, out, block_size,
+                                          score_threshold, max_per_row)
+        if self.n_jobs > 1:
+            store = self.scoring_pool.create_embedding_store(references, self.model_fingerprint)
+            try:
+                store.check_model(self.model_fingerprint)
+                scores = self.scoring_pool.matrix(store, queries, array_type=array_type, out=out,
+                                                  score_threshold=score_threshold, max_per_row=max_per_row,
+                                                  block_size=block_size)
+                n_references = len(store)
+            finally:
+                self.scoring_pool.release_embedding_store(store)
+            if array_type == "sparse":
+                return self._to_sparse_array(*scores, n_references, len(queries))
+            return scores
+        reference_vectors = self.get_embedding_array(references)
+        query_vectors = self.calculate_vectors(queries)
+
+        if array_type == "sparse":
+            row, col, scores = cosine_similarity_sparse(reference_vectors, query_vectors,
+                                                        score_threshold=score_threshold,
+                                                        max_per_row=max_per_row,
+                                                        block_size=block_size)
+            return self._to_sparse_array(row, col, scores, reference_vectors.shape[0], query_vectors.shape[0])
+        if out is not None:
+            return cosine_similarity_matrix_tiled(reference_vectors, query_vectors,
+                                                  block_size=block_size, out=out)
+        return cosine_similarity_matrix_parallel(reference_vectors, query_vectors, dtype=np.float64)
 
-        ms2ds_similarity = cosine_similarity_matrix(reference_vectors, query_vectors)
+    def _symmetric_matrix(self, vectors, array_type, out, block_size, score_threshold, max_per_row):
+        """All-vs-all scores computing only the upper triangle blocks."""
+        # pylint: disable=too-many-arguments
+        if array_type == "sparse":
+            row, col, scores = cosine_similarity_sparse_symmetric(vectors, score_threshold=score_threshold,
+                                                                  max_per_row=max_per_row,
+                                                                  block_size=block_size)
+            return self._to_sparse_array(row, col, scores, vectors.shape[0], vectors.shape[0])
+        return cosine_similarity_matrix_symmetric(vectors, block_size=block_size, out=out,
+                                                  dtype=self.score_datatype)
+
+    def _to_sparse_array(self, row, col, scores, n_rows, n_cols) -> StackedSparseArray:
+        # pylint: disable=too-many-arguments
+        ms2ds_similarity = StackedSparseArray(n_rows, n_cols)
+        ms2ds_similarity.add_sparse_data(row, col, scores.astype(self.score_datatype), "")
         return ms2ds_similarity
 
+    def search(self, references: Union[List[Spectrum], EmbeddingStore], queries: List[Spectrum],
+               k: int = 50, block_size: int = 10_000) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the k highest scoring references for every query.
+
+        In contrast to :meth:`matrix`, the scores are computed block by block and only
+        the top-k per query are kept, which keeps the memory footprint small for
+        large reference libraries.
+
+        Parameters
+        ----------
+        references:
+            Reference spectrum. Can also be an EmbeddingStore with precomputed
+            embeddings of the reference spectrums.
+        queries:
+            Query spectrum.
+        k:
+            Number of best matching references to return per query. Default is 50.
+        block_size:
+            Number of spectra per block. Default is 10000.
+
+        Returns
+        -------
+        indices, scores
+            Arrays of shape (len(queries), k) with the indices of the best matching
+            references and their MS2DeepScore similarities, sorted from highest to
+            lowest score.
+        """
+        if k < 1:
+            raise ValueError(f"Expected k >= 1, got k={k}.")
+        if self.n_jobs > 1:
+            store = self.scoring_pool.create_embedding_store(references, self.model_fingerprint)
+            try:
+                store.check_model(self.model_fingerprint)
+                return self.scoring_pool.search(store, queries, k, block_size=block_size)
+            finally:
+                self.scoring_pool.release_embedding_store(store)
+        reference_vectors = self.get_embedding_array(references)
+        query_vectors = self.calculate_vectors(queries)
+        return top_k_cosine_similarity(reference_vectors, query_vectors, k, block_size=block_size)
+
+    def precursor_window_matrix(self, references: List[Spectrum], queries: List[Spectrum],
+                                tolerance: float = 0.1, tolerance_type: str = "Dalton",
+                                mass_shift_range: Tuple[float, float] = (0.0, 0.0),
+                                score_threshold: Optional[float] = None) -> StackedSparseArray:
+        """Calculate MS2DeepScore similarities only for pairs with matching precursor m/z.
+
+        References are sorted by precursor m/z and the candidates of every query are found
+        by binary search, see :func:`~ms2deepscore.precursor_mz_windows.precursor_mz_candidates`.
+        Only spectra that are part of at least one candidate pair are embedded (using the
+        embedding_cache, if given) and only candidate pairs are scored.
+
+        Parameters
+        ----------
+        references:
+            List of reference spectrums.
+        queries:
+            List of query spectrums.
+        tolerance:
+            Tolerance around the (shifted) query precursor m/z. Default is 0.1.
+        tolerance_type:
+            "Dalton" or "ppm". Default is "Dalton".
+        mass_shift_range:
+            Range (lower, upper) of allowed precursor m/z differences reference - query,
+            e.g. (-100, 100) for analog search. Default is (0.0, 0.0).
+        score_threshold:
+            Only keep scores >= score_threshold. Default is None.
+
+        Returns
+        -------
+        Sparse (COO) StackedSparseArray of shape (len(references), len(queries)).
+        """
+        # pylint: disable=too-many-arguments
+        rows, cols, scores = self._precursor_window_scores(references, queries, tolerance,
+                                                           tolerance_type, mass_shift_range)
+        if score_threshold is not None:
+            selected = scores >= score_threshold
+            rows, cols, scores = rows[selected], cols[selected], scores[selected]
+        order = np.lexsort((cols, rows))
+        return self._to_sparse_array(rows[order], cols[order], scores[order], len(references), len(queries))
+
+    def precursor_window_search(self, references: List[Spectrum], queries: List[Spectrum],
+                                k: int = 50, tolerance: float = 0.1, tolerance_type: str = "Dalton",
+                                mass_shift_range: Tuple[float, float] = (0.0, 0.0)
+                                ) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the k highest scoring references for every query among the references
+        with matching precursor m/z (see :meth:`precursor_window_matrix`).
+
+        Parameters
+        ----------
+        references:
+            List of reference spectrums.
+        queries:
+            List of query spectrums.
+        k:
+            Number of best matching references to return per query. Default is 50.
+        tolerance:
+            Tolerance around the (shifted) query precursor m/z. Default is 0.1.
+        tolerance_type:
+            "Dalton" or "ppm". Default is "Dalton".
+        mass_shift_range:
+            Range (lower, upper) of allowed precursor m/z differences reference - query.
+            Default is (0.0, 0.0).
+
+        Returns
+        -------
+        indices, scores
+            Arrays of shape (len(queries), k) with the indices of the best matching
+            references and their MS2DeepScore similarities, sorted from highest to
+            lowest score. If fewer than k references are in the window of a query, the
+            remaining entries have index -1 and score -inf.
+        """
+        # pylint: disable=too-many-arguments
+        rows, cols, scores = self._precursor_window_scores(references, queries, tolerance,
+                                                           tolerance_type, mass_shift_range)
+        order = np.lexsort((-scores, cols))
+        rows, cols, scores = rows[order], cols[order], scores[order]
+        counts = np.bincount(cols, minlength=len(queries))
+        ranks = np.arange(cols.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)
+        selected = ranks < k
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        top_scores = np.full((len(queries), k), -np.inf, dtype=scores.dtype)
+        indices[cols[selected], ranks[selected]] = rows[selected]
+        top_scores[cols[selected], ranks[selected]] = scores[selected]
+        return indices, top_scores
+
+    def _precursor_window_scores(self, references, queries, tolerance, tolerance_type, mass_shift_range):
+        """Return rows, cols and scores of all pairs with matching precursor m/z."""
+        # pylint: disable=too-many-arguments
+        rows, cols = precursor_mz_candidates(get_precursor_mz(references), get_precursor_mz(queries),
+                                             tolerance, tolerance_type, mass_shift_range)
+        if rows.shape[0] == 0:
+            return rows, cols, np.zeros(0, dtype=np.float32)
+        used_rows, row_positions = np.unique(rows, return_inverse=True)
+        used_cols, col_positions = np.unique(cols, return_inverse=True)
+        reference_vectors = self.calculate_vectors([references[i] for i in used_rows])
+        query_vectors = self.calculate_vectors([queries[i] for i in used_cols])
+        return rows, cols, pairs_from_embeddings(reference_vectors, query_vectors, row_positions, col_positions)
+
+    def get_embedding_array(self, spectrums: Union[List[Spectrum], EmbeddingStore]) -> np.ndarray:
+        """Returns embeddings of spectrums, either read from an EmbeddingStore (after
+        checking that it was created with the same model) or computed using
+        :meth:`calculate_vectors`.
+
+        parameters
+        ----------
+        spectrums:
+            List of spectra or EmbeddingStore.
+        """
+        if isinstance(spectrums, EmbeddingStore):
+            spectrums.check_model(self.model_fingerprint)
+            return np.asarray(spectrums.embeddings)
+        return self.calculate_vectors(spectrums)
+
     def calculate_vectors(self, spectrum_list: List[Spectrum]) -> np.ndarray:
         """Returns a list of vectors for all spectra
 
         parameters
         ----------
         spectrum_list:
-            List of spectra for which the vector should be calculated
+            List of spectra for which the vector should be calculated.
+            Spectra are embedded in batches of size `batch_size`. If an embedding_cache
+            is used, only spectra which are not found in the cache are embedded.
         """
+        if self.embedding_cache is None:
+            return self._calculate_vectors(spectrum_list)
+
+        metadata_fields = [feature_generator.metadata_field
+                           for feature_generator in self.model.spectrum_binner.additional_metadata]
+        keys = [spectrum_embedding_key(spectrum, self.model_fingerprint, metadata_fields)
+                for spectrum in spectrum_list]
+        reference_vectors = np.empty((len(spectrum_list), self.output_vector_dim), dtype="float")
+        missing = {}
+        for i, key in enumerate(keys):
+            embedding = None if key in missing else self.embedding_cache.get(key)
+            if embedding is None:
+                missing.setdefault(key, []).append(i)
+            else:
+                reference_vectors[i] = embedding
+        if missing:
+            new_vectors = self._calculate_vectors([spectrum_list[indices[0]] for indices in missing.values()])
+            for (key, indices), vector in zip(missing.items(), new_vectors):
+                reference_vectors[indices] = vector
+                self.embedding_cache.put(key, vector.copy())
+        return reference_vectors
+
+    def iter_vectors(self, spectrums: Iterable[Spectrum], chunk_size: int = 10_000,
+                     id_field: str = "spectrum_id") -> Iterator[Tuple[List[str], np.ndarray]]:
+        """Lazily embed spectra from any iterable (e.g. a matchms file reader) chunk by chunk.
+
+        Only one chunk of spectra is held in memory at a time, which allows embedding
+        spectrum files of arbitrary size.
+
+        For example:
+
+        .. code-block:: python
+
+            from matchms.importing import load_from_mgf
+
+            for spectrum_ids, embeddings in similarity_measure.iter_vectors(load_from_mgf("large.mgf")):
+                ...
+
+        parameters
+        ----------
+        spectrums:
+            Iterable of spectra (is consumed only once).
+        chunk_size:
+            Number of spectra binned and embedded together. Default is 10000.
+        id_field:
+            Metadata field used as spectrum ID. Spectra without this field get their
+            running index as ID. Default is "spectrum_id".
+
+        Yields
+        ------
+        spectrum_ids, embeddings
+            List of IDs and array of embeddings (chunk_size, output_vector_dim) for
+            every chunk (the last chunk can be smaller).
+        """
+        assert chunk_size > 0, "Expected chunk_size > 0."
+        spectrums = iter(spectrums)
+        n_processed = 0
+        while True:
+            chunk = list(islice(spectrums, chunk_size))
+            if not chunk:
+                return
+            yield get_spectrum_ids(chunk, id_field, start=n_processed), self.calculate_vectors(chunk)
+            n_processed += len(chunk)
+
+    def _calculate_vectors(self, spectrum_list: List[Spectrum]) -> np.ndarray:
+        """Bin and embed all spectra (without using the embedding cache)."""
         n_rows = len(spectrum_list)
         reference_vectors = np.empty(
             (n_rows, self.output_vector_dim), dtype="float")
         binned_spectrums = self.model.spectrum_binner.transform(spectrum_list, progress_bar=self.progress_bar)
-        for index_reference, reference in enumerate(
-                tqdm(binned_spectrums,
-                     desc='Calculating vectors of reference spectrums',
-                     disable=(not self.progress_bar))):
-            reference_vectors[index_reference, 0:self.output_vector_dim] = \
-                self.model.base.predict(self._create_input_vector(reference), verbose=0)
+        for batch_start in tqdm(range(0, n_rows, self.batch_size),
+                                desc='Calculating vectors of reference spectrums',
+                                disable=(not self.progress_bar)):
+            batch_end = min(batch_start + self.batch_size, n_rows)
+            input_vectors = self._create_input_vectors(binned_spectrums[batch_start:batch_end])
+            reference_vectors[batch_start:batch_end, 0:self.output_vector_dim] = \
+                self.model.base.predict(input_vectors, batch_size=self.batch_size, verbose=0)
         return reference_vectors
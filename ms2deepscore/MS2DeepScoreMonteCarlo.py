@@ -1,11 +1,23 @@
-from typing import List, Tuple
+import hashlib
+from typing import List, Optional, Tuple, Union
 import numpy as np
 from matchms import Spectrum
 from matchms.similarity.BaseSimilarity import BaseSimilarity
+from sparsestack import StackedSparseArray
 from tqdm import tqdm
+from .EmbeddingStore import EmbeddingStore
+from .input_matrices import create_input_matrix, create_metadata_matrix
+from .models.InferenceModel import DenseEmbeddingNetwork, InferenceModel
+from .MS2DeepScore import assert_identical_spectrums
 from .typing import BinnedSpectrumType
-from .vector_operations import (cosine_similarity_matrix, iqr_pooling,
-                                mean_pooling, median_pooling, std_pooling)
+from .utils import get_model_fingerprint
+from .vector_operations import (adaptive_ensemble_cosine_similarity_pooled,
+                                cosine_similarity_sparse,
+                                ensemble_cosine_similarity_pairs,
+                                ensemble_cosine_similarity_pooled,
+                                mirror_upper_triangle, select_entries,
+                                symmetric_block_size, top_entries_per_row,
+                                top_k_cosine_similarity)
 
 
 class MS2DeepScoreMonteCarlo(BaseSimilarity):
@@ -38,6 +50,18 @@ class MS2DeepScoreMonteCarlo(BaseSimilarity):
         # Calculate scores and get matchms.Scores object
         scores = calculate_scores(references, queries, similarity_measure)
 
+    With a `random_seed`, a fixed set of n_ensembles dropout masks is used, so that the
+    ensemble embeddings are reproducible. The ensemble embeddings of a reference library
+    can then be computed once and stored in an :class:`~ms2deepscore.EmbeddingStore`:
+
+    .. code-block:: python
+
+        from ms2deepscore import EmbeddingStore
+
+        similarity_measure = MS2DeepScoreMonteCarlo(model, n_ensembles=10, random_seed=42)
+        library = EmbeddingStore.from_spectrums("library_mc.ms2ds", similarity_measure, references)
+        scores = similarity_measure.matrix(library, queries)
+
 
     """
     # Set key characteristics as class attributes
@@ -46,7 +70,9 @@ class MS2DeepScoreMonteCarlo(BaseSimilarity):
     score_datatype = [("score", np.float64), ("uncertainty", np.float64)]
 
     def __init__(self, model, n_ensembles: int = 10, average_type: str = "median",
-                 progress_bar: bool = True):
+                 progress_bar: bool = True, batch_size: int = 100,
+                 random_seed: Optional[int] = None,
+                 adaptive_tolerance: Optional[float] = None, min_ensembles: int = 2):
         """
 
         Parameters
@@ -67,7 +93,27 @@ class MS2DeepScoreMonteCarlo(BaseSimilarity):
         progress_bar:
             Set to True to monitor the embedding creating with a progress bar.
             Default is False.
+        batch_size:
+            Number of spectra that are embedded together. Every forward pass of the
+            base network processes batch_size x n_ensembles rows. Default is 100.
+        random_seed:
+            Seed for drawing a fixed set of n_ensembles dropout masks, which are then applied
+            deterministically (ensemble member i always uses mask i). This makes the ensemble
+            embeddings reproducible, so that they can be cached or stored. Default is None,
+            in which case Keras draws new dropout masks for every forward pass. For an
+            :class:`~ms2deepscore.models.InferenceModel` fixed masks are always used (drawn
+            once per instance if random_seed is None).
+        adaptive_tolerance:
+            Set to a float to use an adaptive ensemble size per pair: all pairs are first
+            scored with min_ensembles ensemble embeddings per spectrum, and the ensemble
+            size is doubled (up to n_ensembles) only for pairs whose estimated standard
+            error of the score is above adaptive_tolerance, see
+            :func:`~ms2deepscore.vector_operations.adaptive_ensemble_cosine_similarity_pooled`.
+            Default is None (always use n_ensembles).
+        min_ensembles:
+            Ensemble size used for all pairs in the adaptive mode. Default is 2.
         """
+        # pylint: disable=too-many-arguments
         self.model = model
         self.multi_inputs = (model.nr_of_additional_inputs > 0)
         self.n_ensembles = n_ensembles
@@ -80,16 +126,42 @@ class MS2DeepScoreMonteCarlo(BaseSimilarity):
             self.input_vector_dim = self.model.base.input_shape[1]
         self.output_vector_dim = self.model.base.output_shape[1]
         self.progress_bar = progress_bar
-        self.partial_model = self._create_monte_carlo_base()
+        self.batch_size = batch_size
+        self.random_seed = random_seed
+        assert 1 <= min_ensembles <= n_ensembles, "Expected 1 <= min_ensembles <= n_ensembles."
+        self.adaptive_tolerance = adaptive_tolerance
+        self.min_ensembles = min_ensembles
+        self._model_fingerprint = None
+        if random_seed is None and not isinstance(model, InferenceModel):
+            self.partial_model = self._create_monte_carlo_base()
+            self.shared_model, self.ensemble_model = self._split_monte_carlo_base(self.partial_model)
+            self.dropout_masks = None
+        else:
+            self.partial_model = model.base if isinstance(model.base, DenseEmbeddingNetwork) \
+                else DenseEmbeddingNetwork.from_keras(model.base)
+            self.dropout_masks = self.partial_model.create_dropout_masks(n_ensembles, random_seed)
+
+    @property
+    def model_fingerprint(self) -> str:
+        """Hash identifying the model, n_ensembles and random_seed, which together
+        define the (reproducible) ensemble embeddings."""
+        assert self.random_seed is not None, "Ensemble embeddings are only reproducible with a random_seed."
+        if self._model_fingerprint is None:
+            fingerprint = hashlib.sha256(get_model_fingerprint(self.model).encode())
+            fingerprint.update(f"monte_carlo_dropout:{self.n_ensembles}:{self.random_seed}".encode())
+            self._model_fingerprint = fingerprint.hexdigest()
+        return self._model_fingerprint
 
     def _create_input_vector(self, binned_spectrum: BinnedSpectrumType):
         """Creates input vector for model.base based on binned peaks and intensities"""
-        X = np.zeros((1, self.input_vector_dim))
+        return self._create_input_vectors([binned_spectrum])
 
-        idx = np.array([int(x) for x in binned_spectrum.binned_peaks.keys()])
-        values = np.array(list(binned_spectrum.binned_peaks.values()))
-        X[0, idx] = values
-        return X
+    def _create_input_vectors(self, binned_spectrums: List[BinnedSpectrumType]):
+        """Creates input block for model.base for a batch of binned spectrums"""
+        if self.multi_inputs:
+            return [create_input_matrix(binned_spectrums, self.input_vector_dim[0]),
+                    create_metadata_matrix(binned_spectrums)]
+        return create_input_matrix(binned_spectrums, self.input_vector_dim)
 
     def _create_monte_carlo_base(self):
         """Rebuild base network with training=True"""
@@ -104,7 +176,7 @@ class MS2DeepScoreMonteCarlo(BaseSimilarity):
             print(f"Found multiple different dropout rates. Selected 1st dropout rate: {dropout_rates[0]}")
         dropout_rate = dropout_rates[0]
 
-        dropout_in_first_layer = ('dropout' in self.model.base.layers[3].name)
+        dropout_in_first_layer = any(layer.name == "dropout1" for layer in self.model.base.layers)
 
         # re-build base network with dropout layers always on
         base = self.model.get_base_model(base_dims=base_dims, embedding_dim=self.output_vector_dim, dropout_rate=dropout_rate,
@@ -112,6 +184,24 @@ class MS2DeepScoreMonteCarlo(BaseSimilarity):
         base.set_weights(self.model.base.get_weights())
         return base
 
+    @staticmethod
+    def _split_monte_carlo_base(base):
+        """Split Monte Carlo base network into the deterministic first Dense and
+        BatchNormalization layers (computed once per spectrum) and the remaining
+        layers including all dropout layers (computed for every ensemble member)."""
+        # pylint: disable=import-outside-toplevel
+        from tensorflow import keras
+        shared_layer = base.get_layer("normalization1")
+        shared_model = keras.Model(inputs=base.inputs, outputs=shared_layer.output)
+        ensemble_input = keras.layers.Input(shape=shared_layer.output.shape[1:])
+        model_layer = ensemble_input
+        for layer in base.layers[base.layers.index(shared_layer) + 1:]:
+            if isinstance(layer, keras.layers.Dropout):
+                model_layer = layer(model_layer, training=True)
+            else:
+                model_layer = layer(model_layer)
+        return shared_model, keras.Model(inputs=ensemble_input, outputs=model_layer)
+
     def pair(self, reference: Spectrum, query: Spectrum) -> Tuple[float, float]:
         """Calculate the MS2DeepScoreMonteCarlo similaritiy between a reference
         and a query spectrum.
@@ -128,87 +218,280 @@ class MS2DeepScoreMonteCarlo(BaseSimilarity):
         ms2ds_ensemble_similarity, ms2ds_ensemble_uncertainty
             Tuple of MS2DeepScore similarity score and uncertainty measure (STD/IQR).
         """
-        binned_reference = self.model.spectrum_binner.transform([reference])[0]
-        binned_query = self.model.spectrum_binner.transform([query])[0]
-        reference_vectors = self.get_embedding_ensemble(binned_reference)
-        query_vectors = self.get_embedding_ensemble(binned_query)
-        scores_ensemble = cosine_similarity_matrix(reference_vectors, query_vectors)
-        if self.average_type == "median":
-            average_similarity = np.median(scores_ensemble)
-            uncertainty = iqr_pooling(scores_ensemble, self.n_ensembles)[0, 0]
-        elif self.average_type == "mean":
-            average_similarity = np.mean(scores_ensemble)
-            uncertainty = scores_ensemble.std()
+        vectors = self.calculate_vectors([reference, query])
+        reference_vectors, query_vectors = vectors[:self.n_ensembles], vectors[self.n_ensembles:]
+        average_similarities, uncertainties = self._pooled_scores(reference_vectors, query_vectors)
+        average_similarity, uncertainty = average_similarities[0, 0], uncertainties[0, 0]
         return np.asarray((average_similarity, uncertainty),
                           dtype=self.score_datatype)
 
-    def matrix(self, references: List[Spectrum], queries: List[Spectrum],
+    def matrix(self, references: Union[List[Spectrum], EmbeddingStore], queries: List[Spectrum],
                array_type: str = "numpy",
-               is_symmetric: bool = False) -> np.ndarray:
+               is_symmetric: bool = False,
+               score_threshold: Optional[float] = None,
+               max_per_row: Optional[int] = None,
+               block_size: int = 1000) -> Union[np.ndarray, StackedSparseArray]:
         """Calculate the MS2DeepScoreMonteCarlo similarities between all references and queries.
 
         Parameters
         ----------
         references:
-            Reference spectrum.
+            Reference spectrum. Can also be an EmbeddingStore with precomputed
+            ensemble embeddings of the reference spectrums (requires a random_seed).
         queries:
             Query spectrum.
         array_type
             Specify the output array type. Can be "numpy" or "sparse".
-            Currently, only "numpy" is supported and will return a numpy array.
-            Future versions will include "sparse" as option to return a COO-sparse array.
+            "numpy" will return a numpy array. "sparse" will return a COO-sparse
+            StackedSparseArray (as used by matchms) with fields "score" and "uncertainty"
+            which only contains the scores selected by `score_threshold` and `max_per_row`.
+            Sparse scores are computed block by block, so that the dense score matrix
+            never exists.
         is_symmetric:
             Set to True if references == queries to speed up calculation about 2x.
-            Uses the fact that in this case score[i, j] = score[j, i]. Default is False.
+            Uses the fact that in this case score[i, j] = score[j, i]: only the upper
+            triangle blocks are computed and then mirrored. Default is False.
+        score_threshold:
+            Only used for array_type="sparse". Only scores >= score_threshold are
+            kept. Default is None (keep all scores).
+        max_per_row:
+            Only used for array_type="sparse". Keep only the max_per_row highest
+            scores per reference. Default is None (no limit).
+        block_size:
+            Number of spectra per block when computing sparse or symmetric scores.
+            For symmetric scores this is the maximum, the block size is reduced so that
+            only about half of all pairs are scored. Default is 1000.
 
         Returns
         -------
         ms2ds_ensemble_similarity, ms2ds_ensemble_uncertainties
             Array of Tuples of MS2DeepScore similarity score and uncertainty measure (STD/IQR).
         """
-        reference_vectors = self.calculate_vectors(references)
+        # pylint: disable=too-many-arguments
+        if array_type not in ["numpy", "sparse"]:
+            raise ValueError("array_type must be 'numpy' or 'sparse'.")
+        # Vectors are cast once to the float32 used for scoring (instead of once per block)
         if is_symmetric:
-            assert np.all(references == queries), \
-                "Expected references to be equal to queries for is_symmetric=True"
+            assert_identical_spectrums(references, queries)
+            reference_vectors = self.get_embedding_array(references).astype(np.float32, copy=False)
             query_vectors = reference_vectors
         else:
-            query_vectors = self.calculate_vectors(queries)
-
-        ms2ds_similarity = cosine_similarity_matrix(reference_vectors, query_vectors)
-        if self.average_type == "median":
-            average_similarities = median_pooling(ms2ds_similarity, self.n_ensembles)
-            uncertainties = iqr_pooling(ms2ds_similarity, self.n_ensembles)
-        elif self.average_type == "mean":
-            average_similarities = mean_pooling(ms2ds_similarity, self.n_ensembles)
-            uncertainties = std_pooling(ms2ds_similarity, self.n_ensembles)
-
-        similarities=np.empty((average_similarities.shape[0],
-                              average_similarities.shape[1]), dtype=self.score_datatype)
-        similarities['score'] = average_similarities
-        similarities['uncertainty'] = uncertainties
+            reference_vectors = self.get_embedding_array(references).astype(np.float32, copy=False)
+            query_vectors = self.calculate_vectors(queries).astype(np.float32)
+
+        if array_type == "sparse":
+            return self._sparse_matrix(reference_vectors, query_vectors,
+                                       score_threshold, max_per_row, block_size, is_symmetric)
+        if is_symmetric:
+            return self._symmetric_matrix(reference_vectors, block_size)
+        similarities = np.empty((reference_vectors.shape[0] // self.n_ensembles, len(queries)),
+                                dtype=self.score_datatype)
+        self._pooled_scores(reference_vectors, query_vectors,
+                            out=(similarities["score"], similarities["uncertainty"]))
+        return similarities
+
+    def _symmetric_matrix(self, vectors: np.ndarray, block_size: int) -> np.ndarray:
+        """All-vs-all ensemble scores computing only the upper triangle blocks."""
+        n_ens = self.n_ensembles
+        n_spectrums = vectors.shape[0] // n_ens
+        similarities = np.empty((n_spectrums, n_spectrums), dtype=self.score_datatype)
+        block_size = symmetric_block_size(n_spectrums, block_size, min_block_size=32)
+        for i in range(0, n_spectrums, block_size):
+            for j in range(i, n_spectrums, block_size):
+                average_similarities, uncertainties = self._pooled_scores(
+                    vectors[i * n_ens:(i + block_size) * n_ens],
+                    vectors[j * n_ens:(j + block_size) * n_ens])
+                for name, scores in [("score", average_similarities), ("uncertainty", uncertainties)]:
+                    similarities[name][i:i + block_size, j:j + block_size] = scores
+                    similarities[name][j:j + block_size, i:i + block_size] = scores.T
+        return similarities
+
+    def _pooled_scores(self, reference_vectors: np.ndarray, query_vectors: np.ndarray,
+                       out: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Compute ensemble similarity scores and uncertainties between ensemble embeddings.
+        Ensemble scores are computed and pooled tile by tile, so the memory footprint is
+        that of the pooled output."""
+        if self.adaptive_tolerance is not None:
+            average_similarities, uncertainties, _ = adaptive_ensemble_cosine_similarity_pooled(
+                reference_vectors, query_vectors, self.n_ensembles, self.adaptive_tolerance,
+                self.min_ensembles, use_median=(self.average_type == "median"), out=out)
+            return average_similarities, uncertainties
+        return ensemble_cosine_similarity_pooled(reference_vectors, query_vectors, self.n_ensembles,
+                                                 use_median=(self.average_type == "median"), out=out)
+
+    def _sparse_matrix(self, reference_vectors, query_vectors,
+                       score_threshold, max_per_row, block_size,
+                       is_symmetric=False) -> StackedSparseArray:
+        """Compute ensemble scores block by block and only keep selected entries.
+        For is_symmetric=True only upper triangle blocks are computed and mirrored."""
+        # pylint: disable=too-many-arguments, too-many-locals
+        n_ens = self.n_ensembles
+        n_references = reference_vectors.shape[0] // n_ens
+        n_queries = query_vectors.shape[0] // n_ens
+        if is_symmetric:
+            block_size = symmetric_block_size(n_references, block_size, min_block_size=32)
+        rows, cols, data = [], [], []
+        for i in range(0, n_references, block_size):
+            block_rows, block_cols, block_data = [], [], []
+            for j in range(i if is_symmetric else 0, n_queries, block_size):
+                average_similarities, uncertainties = self._pooled_scores(
+                    reference_vectors[i * n_ens:(i + block_size) * n_ens],
+                    query_vectors[j * n_ens:(j + block_size) * n_ens])
+                row, col = select_entries(average_similarities, score_threshold)
+                if is_symmetric:
+                    upper = (col + j) >= (row + i)
+                    row, col = row[upper], col[upper]
+                scores = np.empty(len(row), dtype=self.score_datatype)
+                scores["score"] = average_similarities[row, col]
+                scores["uncertainty"] = uncertainties[row, col]
+                block_rows.append(row + i)
+                block_cols.append(col + j)
+                block_data.append(scores)
+            row, col, scores = np.concatenate(block_rows), np.concatenate(block_cols), np.concatenate(block_data)
+            if not is_symmetric:
+                row, col, scores = self._select_per_row(row, col, scores, max_per_row)
+            rows.append(row)
+            cols.append(col)
+            data.append(scores)
+        row, col, scores = np.concatenate(rows), np.concatenate(cols), np.concatenate(data)
+        if is_symmetric:
+            row, col, scores = mirror_upper_triangle(row, col, scores)
+            row, col, scores = self._select_per_row(row, col, scores, max_per_row)
+        similarities = StackedSparseArray(n_references, n_queries)
+        similarities.add_sparse_data(row, col, scores, "")
+        return similarities
+
+    @staticmethod
+    def _select_per_row(row, col, scores, max_per_row):
+        """Sort entries by row and column and keep max_per_row highest scores per row."""
+        selected = np.lexsort((col, row))
+        if max_per_row is not None:
+            selected = selected[top_entries_per_row(row[selected], scores["score"][selected], max_per_row)]
+        return row[selected], col[selected], scores[selected]
+
+    def screen_and_rescore(self, references: List[Spectrum], queries: List[Spectrum],
+                           k: Optional[int] = 10,
+                           score_threshold: Optional[float] = None) -> StackedSparseArray:
+        """Two-stage search: screen all pairs with deterministic MS2DeepScore scores and
+        compute Monte-Carlo scores and uncertainties only for the surviving candidates.
+
+        Spectrums are binned once. The screening uses the deterministic embeddings (dropout
+        inactive) of all spectrums, ensemble embeddings are only computed for spectrums
+        that are part of at least one candidate pair. This is much cheaper than
+        :meth:`matrix` when only the uncertainty of the best hits is needed.
+
+        parameters
+        ----------
+        references:
+            Reference spectrums.
+        queries:
+            Query spectrums.
+        k:
+            Keep the k highest screening scores per query. Default is 10. Set to None to
+            only select by score_threshold.
+        score_threshold:
+            Only keep pairs with screening score >= score_threshold. Default is None.
+
+        Returns
+        -------
+        COO-sparse StackedSparseArray (references x queries) with fields "score" and
+        "uncertainty" for all candidate pairs.
+        """
+        # pylint: disable=too-many-locals
+        if k is None and score_threshold is None:
+            raise ValueError("Expected k and/or score_threshold to select candidates.")
+        binned_references = self.model.spectrum_binner.transform(references, progress_bar=self.progress_bar)
+        binned_queries = self.model.spectrum_binner.transform(queries, progress_bar=self.progress_bar)
+        reference_vectors = self._calculate_deterministic_vectors(binned_references)
+        query_vectors = self._calculate_deterministic_vectors(binned_queries)
+        if k is not None:
+            indices, screening_scores = top_k_cosine_similarity(reference_vectors, query_vectors, k)
+            row = indices.ravel()
+            col = np.repeat(np.arange(len(queries)), indices.shape[1])
+            if score_threshold is not None:
+                selected = screening_scores.ravel() >= score_threshold
+                row, col = row[selected], col[selected]
+        else:
+            row, col, _ = cosine_similarity_sparse(reference_vectors, query_vectors, score_threshold)
+
+        reference_ids, row_inverse = np.unique(row, return_inverse=True)
+        query_ids, col_inverse = np.unique(col, return_inverse=True)
+        average_similarities, uncertainties = ensemble_cosine_similarity_pairs(
+            self._calculate_ensembles([binned_references[i] for i in reference_ids]),
+            self._calculate_ensembles([binned_queries[i] for i in query_ids]),
+            row_inverse.ravel(), col_inverse.ravel(), self.n_ensembles,
+            use_median=(self.average_type == "median"))
+        scores = np.empty(len(row), dtype=self.score_datatype)
+        scores["score"] = average_similarities
+        scores["uncertainty"] = uncertainties
+        row, col, scores = self._select_per_row(row, col, scores, None)
+        similarities = StackedSparseArray(len(references), len(queries))
+        similarities.add_sparse_data(row, col, scores, "")
         return similarities
 
-    def calculate_vectors(self, spectrum_list: List[Spectrum]) -> Tuple[np.ndarray, np.ndarray]:
-        """Returns a list of vectors for all spectra
+    def _calculate_deterministic_vectors(self, binned_spectrums: List[BinnedSpectrumType]) -> np.ndarray:
+        """Embed binned spectrums once with the base network (dropout inactive)."""
+        vectors = np.empty((len(binned_spectrums), self.output_vector_dim), dtype=np.float32)
+        for i in range(0, len(binned_spectrums), self.batch_size):
+            input_vectors = self._create_input_vectors(binned_spectrums[i:i + self.batch_size])
+            if self.dropout_masks is not None:
+                vectors[i:i + self.batch_size] = self.partial_model.predict(input_vectors)
+            else:
+                vectors[i:i + self.batch_size] = self.model.base.predict(input_vectors, verbose=0)
+        return vectors
+
+    def get_embedding_array(self, spectrums: Union[List[Spectrum], EmbeddingStore]) -> np.ndarray:
+        """Returns ensemble embeddings of spectrums (n_spectrums * n_ensembles rows), either
+        read from an EmbeddingStore (after checking that it was created with the same model,
+        n_ensembles and random_seed) or computed using :meth:`calculate_vectors`.
+
+        parameters
+        ----------
+        spectrums:
+            List of spectra or EmbeddingStore.
+        """
+        if isinstance(spectrums, EmbeddingStore):
+            spectrums.check_model(self.model_fingerprint)
+            return np.asarray(spectrums.embeddings).reshape(-1, self.output_vector_dim)
+        return self.calculate_vectors(spectrums)
+
+    def calculate_vectors(self, spectrum_list: List[Spectrum]) -> np.ndarray:
+        """Returns n_ensembles vectors for every spectrum (all ensemble vectors of a
+        spectrum are consecutive rows).
 
         parameters
         ----------
         spectrum_list:
-            List of spectra for which the vector should be calculated
+            List of spectra for which the vector should be calculated.
+            Spectra are embedded in batches of size `batch_size`.
         """
-        n_rows = len(spectrum_list) * self.n_ensembles
-        reference_vectors = np.empty((n_rows, self.output_vector_dim), dtype="float")
         binned_spectrums = self.model.spectrum_binner.transform(spectrum_list,
                                                                 progress_bar=self.progress_bar)
-        for index_ref, reference in enumerate(
-                tqdm(binned_spectrums,
-                     desc='Calculating vectors of reference spectrums',
-                     disable=(not self.progress_bar))):
-            embeddings = self.get_embedding_ensemble(reference)
-            reference_vectors[index_ref * self.n_ensembles:(index_ref + 1) * self.n_ensembles,
-                              0:self.output_vector_dim] = embeddings
+        return self._calculate_ensembles(binned_spectrums)
+
+    def _calculate_ensembles(self, binned_spectrums: List[BinnedSpectrumType]) -> np.ndarray:
+        """Returns n_ensembles vectors for every binned spectrum, embedded in batches."""
+        n_rows = len(binned_spectrums) * self.n_ensembles
+        reference_vectors = np.empty((n_rows, self.output_vector_dim), dtype="float")
+        for batch_start in tqdm(range(0, len(binned_spectrums), self.batch_size),
+                                desc='Calculating vectors of reference spectrums',
+                                disable=(not self.progress_bar)):
+            batch = binned_spectrums[batch_start:batch_start + self.batch_size]
+            reference_vectors[batch_start * self.n_ensembles:(batch_start + len(batch)) * self.n_ensembles] = \
+                self._get_embedding_ensembles(batch)
         return reference_vectors
 
     def get_embedding_ensemble(self, spectrum_binned):
-        input_vector_array = np.tile(self._create_input_vector(spectrum_binned), (self.n_ensembles, 1))
-        return self.partial_model.predict(input_vector_array)
+        """Returns n_ensembles embeddings of one binned spectrum."""
+        return self._get_embedding_ensembles([spectrum_binned])
+
+    def _get_embedding_ensembles(self, binned_spectrums: List[BinnedSpectrumType]) -> np.ndarray:
+        """Embed every binned spectrum n_ensembles times in one forward pass.
+        The deterministic first layer is computed only once per spectrum and shared by
+        all ensemble members."""
+        input_vectors = self._create_input_vectors(binned_spectrums)
+        if self.dropout_masks is not None:
+            return self.partial_model.predict_ensemble(input_vectors, self.dropout_masks)
+        shared_output = self.shared_model.predict(input_vectors, batch_size=len(binned_spectrums), verbose=0)
+        return self.ensemble_model.predict(np.repeat(shared_output, self.n_ensembles, axis=0),
+                                           batch_size=len(binned_spectrums) * self.n_ensembles, verbose=0)
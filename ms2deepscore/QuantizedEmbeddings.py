@@ -0,0 +1,172 @@
+from pathlib import Path
+from typing import Optional, Tuple, Union
+import numpy as np
+from .vector_operations import (float16_dot_product_matrix,
+                                int8_dot_product_matrix, normalize_vectors,
+                                quantize_vectors, sort_top_k, update_top_k)
+
+
+class QuantizedEmbeddings:
+    """Reduced precision (float16 or int8) copy of reference embeddings for fast
+    library search with exact re-ranking.
+
+    A first pass scans all quantized embeddings (2x or 4x less memory than float32)
+    to select the `n_candidates` most similar references per query. Those candidates
+    are then re-scored exactly with the full precision reference embeddings (which can
+    be a memory-mapped :class:`~ms2deepscore.EmbeddingStore`, only candidate rows are
+    read), so that the reported top-k is the same as for an exact search as long as all
+    true top-k references are among the candidates.
+
+    For example:
+
+    .. code-block:: python
+
+        from ms2deepscore import EmbeddingStore, QuantizedEmbeddings
+
+        library = EmbeddingStore("library.ms2ds")
+        quantized = QuantizedEmbeddings.from_embeddings(library.embeddings, dtype=np.int8)
+        quantized.save("library_int8.npz")
+
+        query_vectors = similarity_measure.calculate_vectors(queries)
+        indices, scores = quantized.search(query_vectors, k=10, reference_vectors=library.embeddings)
+
+    """
+    def __init__(self, vectors: np.ndarray, scales: np.ndarray):
+        """
+
+        Parameters
+        ----------
+        vectors
+            Quantized normalized vectors (n_vectors, vector dimension) of dtype int8 or float16.
+        scales
+            Per-vector scales to map the quantized values back to the normalized vectors.
+        """
+        assert vectors.dtype in (np.int8, np.float16), "Expected int8 or float16 vectors."
+        assert vectors.shape[0] == scales.shape[0], "Expected one scale per vector."
+        self.vectors = vectors
+        self.scales = scales
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes + self.scales.nbytes
+
+    @classmethod
+    def from_embeddings(cls, embeddings: np.ndarray, dtype=np.int8,
+                        block_size: int = 100_000) -> "QuantizedEmbeddings":
+        """Quantize embeddings.
+
+        Parameters
+        ----------
+        embeddings
+            Array of embeddings (n_vectors, vector dimension).
+        dtype
+            np.int8 (per-vector scaled) or np.float16. Default is np.int8.
+        block_size
+            Number of embeddings quantized at once. Default is 100000.
+        """
+        vectors = np.empty(embeddings.shape, dtype=dtype)
+        scales = np.empty(embeddings.shape[0], dtype=np.float32)
+        for i in range(0, embeddings.shape[0], block_size):
+            vectors[i:i + block_size], scales[i:i + block_size] = quantize_vectors(embeddings[i:i + block_size],
+                                                                                   dtype)
+        return cls(vectors, scales)
+
+    def approximate_scores(self, query_vectors: np.ndarray, start: int = 0,
+                           end: Optional[int] = None) -> np.ndarray:
+        """Approximate cosine scores (n_queries, end - start) between query vectors and
+        the quantized vectors[start:end]."""
+        return self._approximate_scores(*self._quantize_queries(query_vectors), start, end)
+
+    def _quantize_queries(self, query_vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Queries as int8 (with scales) for int8 vectors, or as normalized float32 for float16 vectors."""
+        if self.vectors.dtype == np.int8:
+            return quantize_vectors(query_vectors, np.int8)
+        return normalize_vectors(query_vectors, np.float32), np.ones(query_vectors.shape[0], dtype=np.float32)
+
+    def _approximate_scores(self, queries: np.ndarray, query_scales: np.ndarray,
+                            start: int, end: Optional[int]) -> np.ndarray:
+        if self.vectors.dtype == np.float16:
+            return float16_dot_product_matrix(queries, self.vectors[start:end])
+        scores = int8_dot_product_matrix(queries, self.vectors[start:end]).astype(np.float32)
+        scores *= query_scales[:, np.newaxis]
+        scores *= self.scales[np.newaxis, start:end]
+        return scores
+
+    def search(self, query_vectors: np.ndarray, k: int,
+               reference_vectors: Optional[np.ndarray] = None,
+               n_candidates: Optional[int] = None,
+               block_size: int = 10_000) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the top-k most similar references for every query vector.
+
+        Parameters
+        ----------
+        query_vectors
+            Array of query vectors (n_queries, vector dimension).
+        k
+            Number of references to return per query.
+        reference_vectors
+            Full precision reference embeddings used to re-score the candidates exactly.
+            Default is None, in which case the approximate scores are returned.
+        n_candidates
+            Number of candidates per query selected in the first (quantized) pass.
+            Default is None, which uses 4 * k.
+        block_size
+            Number of references scored at once in the first pass. Default is 10000.
+
+        Returns
+        -------
+        indices, scores
+            Arrays of shape (n_queries, k) with the reference indices and their cosine
+            scores, sorted from highest to lowest score.
+        """
+        # pylint: disable=too-many-arguments
+        n_references = len(self)
+        k = min(k, n_references)
+        n_candidates = min(max(k, 4 * k if n_candidates is None else n_candidates), n_references)
+        n_queries = query_vectors.shape[0]
+        candidate_indices = np.zeros((n_queries, n_candidates), dtype=np.int64)
+        candidate_scores = np.full((n_queries, n_candidates), -np.inf, dtype=np.float32)
+        queries, query_scales = self._quantize_queries(query_vectors)
+        for i in range(0, n_references, block_size):
+            block_scores = self._approximate_scores(queries, query_scales, i, i + block_size)
+            update_top_k(candidate_indices, candidate_scores, block_scores, i)
+        if reference_vectors is None:
+            indices, scores = sort_top_k(candidate_indices, candidate_scores)
+            return indices[:, :k], scores[:, :k]
+
+        assert reference_vectors.shape == self.vectors.shape, \
+            "Expected reference vectors matching the quantized vectors."
+        query_vectors = normalize_vectors(query_vectors, np.float32)
+        exact_scores = np.empty_like(candidate_scores)
+        for j in range(n_queries):
+            candidates = candidate_indices[j]
+            order = np.argsort(candidates)  # read reference vectors in storage order
+            candidate_vectors = normalize_vectors(reference_vectors[candidates[order]], np.float32)
+            exact_scores[j, order] = np.dot(candidate_vectors, query_vectors[j])
+        indices, scores = sort_top_k(candidate_indices, exact_scores)
+        return indices[:, :k], scores[:, :k]
+
+    def save(self, filename: Union[str, Path]):
+        """Save quantized embeddings to (numpy .npz) file.
+
+        Parameters
+        ----------
+        filename
+            Filename to specify where to store the quantized embeddings.
+        """
+        np.savez(filename, vectors=self.vectors, scales=self.scales)
+
+    @classmethod
+    def load(cls, filename: Union[str, Path]) -> "QuantizedEmbeddings":
+        """Load quantized embeddings from file created by :meth:`save`.
+
+        Parameters
+        ----------
+        filename
+            Filename of the stored quantized embeddings.
+        """
+        with np.load(filename) as data:
+            return cls(data["vectors"], data["scales"])
@@ -0,0 +1,207 @@
+import itertools
+import mmap
+import os
+import shutil
+import tempfile
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import List, Optional, Tuple, Union
+import numpy as np
+from matchms import Spectrum
+from .EmbeddingStore import EmbeddingStore
+from .models.InferenceModel import InferenceModel
+from .vector_operations import (cosine_similarity_matrix_tiled,
+                                cosine_similarity_sparse, top_entries_per_row,
+                                top_k_cosine_similarity)
+
+
+class ScoringPool:
+    """Persistent pool of worker processes for sharded MS2DeepScore scoring.
+
+    Every worker loads the model once (when the pool is started) as a TensorFlow-free
+    :class:`~ms2deepscore.models.InferenceModel`. Query spectrums are
+    split into shards, which are binned, embedded and scored by the workers in
+    parallel. Reference embeddings are shared with all workers read-only through a
+    memory-mapped :class:`~ms2deepscore.EmbeddingStore`, dense outputs are written by
+    the workers directly into a shared np.memmap. Temporary stores created for a list
+    of reference spectrums are deleted after the call (see :meth:`release_embedding_store`)
+    and the temporary directory is removed by :meth:`close`, or at the latest when the
+    pool is garbage collected or the interpreter exits.
+
+    Usually this class is not used directly, but via ``MS2DeepScore(model, n_jobs=...)``.
+    Since worker processes are started with the "spawn" method, scripts using the pool
+    should guard their entry point with ``if __name__ == "__main__":``.
+    """
+    def __init__(self, model, n_jobs: int, batch_size: int = 1000):
+        """
+
+        Parameters
+        ----------
+        model
+            SiameseModel or InferenceModel to load in every worker.
+        n_jobs
+            Number of worker processes.
+        batch_size
+            Number of spectra embedded together in one forward pass in the workers.
+        """
+        self.n_jobs = n_jobs
+        self.temp_dir = tempfile.mkdtemp(prefix="ms2deepscore_")
+        model_filename = os.path.join(self.temp_dir, "model.npz")
+        if not isinstance(model, InferenceModel):
+            model = InferenceModel.from_siamese_model(model)
+        model.save(model_filename)
+        self._executor = ProcessPoolExecutor(max_workers=n_jobs, mp_context=get_context("spawn"),
+                                             initializer=_initialize_worker,
+                                             initargs=(model_filename, batch_size))
+        self._file_ids = itertools.count(1)  # unique names for temporary files
+        self._finalizer = weakref.finalize(self, _shutdown_pool, self._executor, self.temp_dir)
+
+    def close(self):
+        """Shut down worker processes and remove temporary files."""
+        self._finalizer()
+
+    def _get_shard_size(self, n_spectrums: int, shard_size: Optional[int]) -> int:
+        """Shard size to use: by default spread the spectrums evenly over all workers
+        with at most 1000 spectrums per shard."""
+        if shard_size is not None:
+            return shard_size
+        return max(1, min(1000, int(np.ceil(n_spectrums / self.n_jobs))))
+
+    def calculate_vectors(self, spectrums: List[Spectrum], shard_size: Optional[int] = None) -> np.ndarray:
+        """Embed spectrums in parallel (shard by shard)."""
+        shard_size = self._get_shard_size(len(spectrums), shard_size)
+        shards = [spectrums[i:i + shard_size] for i in range(0, len(spectrums), shard_size)]
+        return np.vstack(list(self._executor.map(_embed_shard, shards)))
+
+    def create_embedding_store(self, references: Union[List[Spectrum], EmbeddingStore],
+                               model_fingerprint: str, shard_size: Optional[int] = None) -> EmbeddingStore:
+        """Return references as EmbeddingStore that can be opened by the workers."""
+        if isinstance(references, EmbeddingStore):
+            return references
+        filename = os.path.join(self.temp_dir, f"references_{next(self._file_ids)}.ms2ds")
+        return EmbeddingStore.write(filename, self.calculate_vectors(references, shard_size),
+                                    [str(i) for i in range(len(references))], model_fingerprint)
+
+    def release_embedding_store(self, store: EmbeddingStore):
+        """Delete store if it is a temporary store created by :meth:`create_embedding_store`.
+        Workers drop stores whose file was deleted from their cache on their next task."""
+        if os.path.dirname(os.path.abspath(store.filename)) != os.path.abspath(self.temp_dir):
+            return
+        del store.embeddings
+        try:
+            os.remove(store.filename)
+        except OSError:
+            pass
+
+    def matrix(self, store: EmbeddingStore, queries: List[Spectrum],
+               array_type: str = "numpy", out: Optional[np.ndarray] = None,
+               score_threshold: Optional[float] = None, max_per_row: Optional[int] = None,
+               shard_size: Optional[int] = None, dtype=np.float64, block_size: int = 10_000):
+        """Score all queries against the stored references, sharding the queries over
+        the workers. Returns a dense array (or `out`) for array_type="numpy" and
+        (row, col, scores) arrays for array_type="sparse"."""
+        # pylint: disable=too-many-arguments, too-many-locals
+        shape = (len(store), len(queries))
+        assert out is None or out.shape == shape, f"Expected out array of shape {shape}."
+        shard_size = self._get_shard_size(len(queries), shard_size)
+        starts = list(range(0, len(queries), shard_size))
+        shards = [queries[i:i + shard_size] for i in starts]
+        if array_type == "sparse":
+            results = list(self._executor.map(_score_shard_sparse, [store.filename] * len(shards),
+                                              shards, starts, [(score_threshold, block_size)] * len(shards)))
+            row, col, scores = [np.concatenate(x) for x in zip(*results)] if results else \
+                (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))
+            selected = np.lexsort((col, row))
+            if max_per_row is not None:
+                selected = selected[top_entries_per_row(row[selected], scores[selected], max_per_row)]
+            return row[selected], col[selected], scores[selected]
+
+        if _is_whole_file_memmap(out):
+            scores = out
+            out.flush()
+        else:
+            scores = np.memmap(os.path.join(self.temp_dir, f"scores_{next(self._file_ids)}.dat"), mode="w+",
+                               shape=shape, dtype=dtype if out is None else out.dtype)
+        list(self._executor.map(_score_shard_dense, [store.filename] * len(shards), shards, starts,
+                                [(scores.filename, scores.dtype.str, shape, block_size)] * len(shards)))
+        if scores is out:
+            return out
+        if out is None:
+            out = np.empty(shape, dtype=scores.dtype)
+        out[:] = scores
+        scores_filename = scores.filename
+        del scores
+        os.remove(scores_filename)
+        return out
+
+    def search(self, store: EmbeddingStore, queries: List[Spectrum], k: int,
+               shard_size: Optional[int] = None, block_size: int = 10_000) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k search of all queries against the stored references, sharding the
+        queries over the workers."""
+        shard_size = self._get_shard_size(len(queries), shard_size)
+        shards = [queries[i:i + shard_size] for i in range(0, len(queries), shard_size)]
+        results = list(self._executor.map(_search_shard, [store.filename] * len(shards),
+                                          shards, [(k, block_size)] * len(shards)))
+        return np.vstack([r[0] for r in results]), np.vstack([r[1] for r in results])
+
+
+def _is_whole_file_memmap(array) -> bool:
+    """True if array is a C-contiguous np.memmap covering its whole file, so that the
+    workers can reopen the file (at offset 0) with the shape of the array. Slices and
+    views of a memmap are excluded (they share the filename but not the layout)."""
+    return isinstance(array, np.memmap) and isinstance(array.base, mmap.mmap) \
+        and array.filename is not None and array.offset == 0 and array.flags.c_contiguous \
+        and os.path.getsize(array.filename) == array.nbytes
+
+
+def _shutdown_pool(executor: ProcessPoolExecutor, temp_dir: str):
+    executor.shutdown()
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+# Worker state and functions (executed in the worker processes)
+_worker = {}
+
+
+def _initialize_worker(model_filename: str, batch_size: int):
+    # pylint: disable=import-outside-toplevel
+    from .models import load_model
+    from .MS2DeepScore import MS2DeepScore
+    _worker["similarity_measure"] = MS2DeepScore(load_model(model_filename), progress_bar=False,
+                                                 batch_size=batch_size)
+    _worker["stores"] = {}
+
+
+def _get_reference_vectors(store_filename: str) -> np.ndarray:
+    # Drop stores which were deleted by the parent process (temporary stores)
+    for filename in [filename for filename in _worker["stores"] if not os.path.exists(filename)]:
+        del _worker["stores"][filename]
+    if store_filename not in _worker["stores"]:
+        _worker["stores"][store_filename] = EmbeddingStore(store_filename)
+    return np.asarray(_worker["stores"][store_filename].embeddings)
+
+
+def _embed_shard(spectrums):
+    return _worker["similarity_measure"].calculate_vectors(spectrums)
+
+
+def _score_shard_dense(store_filename, queries, start, output_settings):
+    filename, dtype, shape, block_size = output_settings
+    scores = np.memmap(filename, dtype=np.dtype(dtype), mode="r+", shape=shape)
+    cosine_similarity_matrix_tiled(_get_reference_vectors(store_filename), _embed_shard(queries),
+                                   block_size=block_size, out=scores[:, start:start + len(queries)])
+    scores.flush()
+
+
+def _score_shard_sparse(store_filename, queries, start, sparse_settings):
+    score_threshold, block_size = sparse_settings
+    row, col, scores = cosine_similarity_sparse(_get_reference_vectors(store_filename), _embed_shard(queries),
+                                                score_threshold=score_threshold, block_size=block_size)
+    return row, col + start, scores
+
+
+def _search_shard(store_filename, queries, search_settings):
+    k, block_size = search_settings
+    return top_k_cosine_similarity(_get_reference_vectors(store_filename), _embed_shard(queries), k,
+                                   block_size=block_size)
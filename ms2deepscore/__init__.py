@@ -2,8 +2,12 @@ import logging
 from . import models
 from .__version__ import __version__
 from .BinnedSpectrum import BinnedSpectrum
+from .EmbeddingCache import EmbeddingCache
+from .EmbeddingStore import EmbeddingStore
+from .IVFIndex import IVFIndex
 from .MS2DeepScore import MS2DeepScore
 from .MS2DeepScoreMonteCarlo import MS2DeepScoreMonteCarlo
+from .QuantizedEmbeddings import QuantizedEmbeddings
 from .SpectrumBinner import SpectrumBinner
 
 
@@ -14,7 +18,11 @@ __all__ = [
     "models",
     "__version__",
     "BinnedSpectrum",
+    "EmbeddingCache",
+    "EmbeddingStore",
+    "IVFIndex",
     "MS2DeepScore",
     "MS2DeepScoreMonteCarlo",
+    "QuantizedEmbeddings",
     "SpectrumBinner",
 ]
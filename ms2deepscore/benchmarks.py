@@ -0,0 +1,203 @@
+"""Functions to benchmark the speed (and accuracy) of MS2DeepScore search strategies."""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence, Union
+import numpy as np
+from .IVFIndex import IVFIndex
+from .QuantizedEmbeddings import QuantizedEmbeddings
+from .vector_operations import top_k_cosine_similarity
+
+
+def benchmark_ivf_index(index: IVFIndex, reference_vectors: np.ndarray,
+                        query_vectors: np.ndarray, k: int = 10,
+                        n_probes: Sequence[int] = (1, 2, 5, 10, 20, 50)) -> List[dict]:
+    """Measure recall and latency of an IVFIndex compared to exact top-k search.
+
+    For example:
+
+    .. code-block:: python
+
+        import pandas as pd
+        from ms2deepscore import IVFIndex
+        from ms2deepscore.benchmarks import benchmark_ivf_index
+
+        index = IVFIndex.build(reference_vectors, n_clusters=500)
+        results = pd.DataFrame(benchmark_ivf_index(index, reference_vectors, query_vectors))
+
+    Parameters
+    ----------
+    index
+        IVFIndex built from reference_vectors.
+    reference_vectors
+        Array of the indexed reference vectors.
+    query_vectors
+        Array of query vectors.
+    k
+        Number of neighbours to search for. Default is 10.
+    n_probes
+        Values for n_probe to benchmark.
+
+    Returns
+    -------
+    List of dictionaries with "n_probe", "recall" (fraction of the exact top-k found),
+    "time_per_query" and "exact_time_per_query" (both in seconds).
+    """
+    n_queries = query_vectors.shape[0]
+    start = time.perf_counter()
+    exact_indices, _ = top_k_cosine_similarity(reference_vectors, query_vectors, k)
+    exact_time = (time.perf_counter() - start) / n_queries
+
+    results = []
+    for n_probe in n_probes:
+        start = time.perf_counter()
+        indices, _ = index.query(query_vectors, k, n_probe=n_probe)
+        query_time = (time.perf_counter() - start) / n_queries
+        n_found = sum(len(np.intersect1d(indices[i], exact_indices[i])) for i in range(n_queries))
+        results.append({"n_probe": n_probe,
+                        "recall": n_found / exact_indices.size,
+                        "time_per_query": query_time,
+                        "exact_time_per_query": exact_time})
+    return results
+
+
+def benchmark_quantized_search(reference_vectors: np.ndarray, query_vectors: np.ndarray,
+                               k: int = 10, dtypes: Sequence = (np.int8, np.float16),
+                               n_candidates: Optional[int] = None,
+                               n_repeats: int = 3) -> List[dict]:
+    """Measure recall and latency of QuantizedEmbeddings.search compared to exact
+    (float32) top-k search.
+
+    The quantized search includes the exact re-ranking of the candidates with the
+    float32 reference_vectors. Timings are the best of n_repeats (after one warm-up
+    run, so numba compilation is not included).
+
+    For example:
+
+    .. code-block:: python
+
+        import pandas as pd
+        from ms2deepscore.benchmarks import benchmark_quantized_search
+
+        results = pd.DataFrame(benchmark_quantized_search(reference_vectors, query_vectors))
+
+    Parameters
+    ----------
+    reference_vectors
+        Array of reference vectors.
+    query_vectors
+        Array of query vectors.
+    k
+        Number of neighbours to search for. Default is 10.
+    dtypes
+        Quantized dtypes to benchmark. Default is (np.int8, np.float16).
+    n_candidates
+        Number of candidates per query of the quantized search. Default is None (4 * k).
+    n_repeats
+        Number of timed repeats. Default is 3.
+
+    Returns
+    -------
+    List of dictionaries with "dtype", "recall" (fraction of the exact top-k found),
+    "time_per_query", "exact_time_per_query" (both in seconds) and "speedup".
+    """
+    # pylint: disable=too-many-arguments
+    n_queries = query_vectors.shape[0]
+    reference_vectors = np.asarray(reference_vectors, dtype=np.float32)
+    exact_indices, _ = top_k_cosine_similarity(reference_vectors, query_vectors, k)
+    exact_time = _best_time(lambda: top_k_cosine_similarity(reference_vectors, query_vectors, k),
+                            n_repeats) / n_queries
+
+    results = []
+    for dtype in dtypes:
+        quantized = QuantizedEmbeddings.from_embeddings(reference_vectors, dtype=dtype)
+        indices, _ = quantized.search(query_vectors, k, reference_vectors=reference_vectors,
+                                      n_candidates=n_candidates)
+        query_time = _best_time(lambda q=quantized: q.search(query_vectors, k, reference_vectors=reference_vectors,
+                                                             n_candidates=n_candidates), n_repeats) / n_queries
+        n_found = sum(len(np.intersect1d(indices[i], exact_indices[i])) for i in range(n_queries))
+        results.append({"dtype": np.dtype(dtype).name,
+                        "recall": n_found / exact_indices.size,
+                        "time_per_query": query_time,
+                        "exact_time_per_query": exact_time,
+                        "speedup": exact_time / query_time})
+    return results
+
+
+def _best_time(function, n_repeats: int) -> float:
+    times = []
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+_STARTUP_SCRIPT = """
+import json, sys, time
+from itertools import islice
+start = time.perf_counter()
+import ms2deepscore
+from matchms.importing import load_spectra
+from ms2deepscore.models import load_model
+import_time = time.perf_counter() - start
+start = time.perf_counter()
+model = load_model(sys.argv[1])
+load_time = time.perf_counter() - start
+spectrums = list(islice(load_spectra(sys.argv[2]), 2))
+start = time.perf_counter()
+similarity_measure = ms2deepscore.MS2DeepScore(model, progress_bar=False)
+similarity_measure.matrix(spectrums, spectrums)
+first_score_time = time.perf_counter() - start
+print(json.dumps({"import_time": import_time, "model_load_time": load_time,
+                  "first_score_time": first_score_time}))
+"""
+
+
+def benchmark_startup(model_filename: Union[str, Path],
+                      spectrums_filename: Union[str, Path],
+                      n_repeats: int = 3) -> List[dict]:
+    """Measure the cold-start cost of a short-lived scoring job.
+
+    Every repeat runs in a fresh Python process and measures the time to import
+    ms2deepscore, the time to load the model, and the time to compute the first
+    (2x2) score matrix, which includes compiling (or loading cached) numba functions.
+    The first repeat uses an empty numba cache directory (NUMBA_CACHE_DIR) and thus
+    shows the cost of compiling all numba functions. Later repeats use the regular numba
+    cache, which is filled by then (at the latest by the second repeat).
+
+    For example:
+
+    .. code-block:: python
+
+        from ms2deepscore.benchmarks import benchmark_startup
+
+        results = benchmark_startup("model_file_123.hdf5", "spectrums.mgf")
+
+    Parameters
+    ----------
+    model_filename
+        Filename of the model to load with :func:`~ms2deepscore.models.load_model`.
+    spectrums_filename
+        File with (at least two) spectrums that can be read by matchms.importing.load_spectra.
+    n_repeats
+        Number of fresh processes to measure. Default is 3.
+
+    Returns
+    -------
+    List of dictionaries with "import_time", "model_load_time" and "first_score_time"
+    (all in seconds).
+    """
+    results = []
+    for i in range(n_repeats):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            env = dict(os.environ, NUMBA_CACHE_DIR=cache_dir) if i == 0 else None
+            output = subprocess.run([sys.executable, "-c", _STARTUP_SCRIPT, str(model_filename),
+                                     str(spectrums_filename)],
+                                    capture_output=True, text=True, check=True, env=env).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
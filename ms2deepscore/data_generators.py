@@ -1,10 +1,11 @@
 """ Data generators for training/inference with siamese Keras model.
 """
 import warnings
-from typing import Iterator, List, NamedTuple, Optional
+from typing import Iterator, List, NamedTuple, Optional, Tuple
 import numpy as np
 import pandas as pd
 from tensorflow.keras.utils import Sequence  # pylint: disable=import-error
+from ms2deepscore.input_matrices import create_metadata_matrix, peaks_to_matrix
 from ms2deepscore.spectrum_pair_selection import SelectedCompoundPairs
 from ms2deepscore.SpectrumBinner import SpectrumBinner
 from .typing import BinnedSpectrumType
@@ -270,38 +271,26 @@ class DataGeneratorBase(Sequence):
 
     def _data_generation(self, spectrum_pairs: Iterator[SpectrumPair]):
         """Generates data containing batch_size samples"""
-        container_list = []
+        spectrums_left = []
+        spectrums_right = []
+        peaks_left = []
+        peaks_right = []
+        y = []
         for pair in spectrum_pairs:
-            container_list.append(Container(pair,
-                                            self.dim,
-                                            self._data_augmentation,
-                                            self.additional_metadata))
-
+            spectrums_left.append(pair.spectrum1)
+            spectrums_right.append(pair.spectrum2)
+            peaks_left.append(self._data_augmentation(pair.spectrum1.binned_peaks))
+            peaks_right.append(self._data_augmentation(pair.spectrum2.binned_peaks))
+            y.append(pair.score)
+
+        X = [_augmented_peaks_to_matrix(peaks_left, self.dim),
+             _augmented_peaks_to_matrix(peaks_right, self.dim)]
         # multi input
         if len(self.additional_metadata) > 0:
-            X = [[], [], [], []]
-            y = []
-            for container in container_list:
-                X[0].append(container.spectrum_values_left)
-                # Using ravel instead of squeeze, since squeeze returns 0D arrays.
-                # This can give unexpected behaviour, when only one extra feature is given.
-                X[1].append(np.array(np.ravel(container.additional_inputs_left)))
-                X[2].append(container.spectrum_values_right)
-                X[3].append(np.array(np.ravel(container.additional_inputs_right)))
-
-                y.append(container.tanimoto_score)
-
             # important to return lists of arrays
-            return [np.array(X[0]), np.array(X[1]), np.array(X[2]), np.array(X[3])], np.asarray(y).astype('float32')
-
-        # else
-        X = [[], []]
-        y = []
-        for container in container_list:
-            X[0].append(container.spectrum_values_left)
-            X[1].append(container.spectrum_values_right)
-            y.append(container.tanimoto_score)
-        return [np.array(X[0]), np.array(X[1])], np.asarray(y).astype('float32')
+            X = [X[0], create_metadata_matrix(spectrums_left, self.additional_metadata),
+                 X[1], create_metadata_matrix(spectrums_right, self.additional_metadata)]
+        return X, np.asarray(y).astype('float32')
 
     def _spectrum_pair_generator(self, batch_index: int) -> Iterator[SpectrumPair]:
         """
@@ -608,25 +597,15 @@ class DataGeneratorCherrypicked(DataGeneratorBase):
             np.random.shuffle(self.indexes)
 
 
-class Container:
-    """
-    Helper class for DataGenerator
-    """
-    def __init__(self, spectrum_pair, dim, _data_augmentation, additional_inputs=None):
-        self.spectrum_left = spectrum_pair[0]
-        self.spectrum_right = spectrum_pair[1]
-        self.spectrum_values_left = np.zeros((dim, ))
-        self.spectrum_values_right = np.zeros((dim, ))
-        self.idx_left, self.values_left = _data_augmentation(self.spectrum_left.binned_peaks)
-        self.idx_right, self.values_right = _data_augmentation(self.spectrum_right.binned_peaks)
-        self.spectrum_values_left[self.idx_left] = self.values_left
-        self.spectrum_values_right[self.idx_right] = self.values_right
-        self.additional_inputs_left = []
-        self.additional_inputs_right = []
-        for additional_input in additional_inputs:
-            self.additional_inputs_left.append([float(self.spectrum_left.get(additional_input))])
-            self.additional_inputs_right.append([float(self.spectrum_right.get(additional_input))])
-        self.tanimoto_score = spectrum_pair[2]
+def _augmented_peaks_to_matrix(peaks: List[Tuple[np.ndarray, np.ndarray]], dim: int) -> np.ndarray:
+    """Convert list of (peak positions, peak intensities) into a dense input matrix."""
+    indptr = np.zeros(len(peaks) + 1, dtype=np.int64)
+    np.cumsum([len(idx) for idx, _ in peaks], out=indptr[1:])
+    if len(peaks) == 0:
+        return peaks_to_matrix(indptr, np.zeros(0, dtype=np.int64), np.zeros(0), dim)
+    indices = np.concatenate([idx for idx, _ in peaks]).astype(np.int64)
+    values = np.concatenate([values for _, values in peaks])
+    return peaks_to_matrix(indptr, indices, values, dim)
 
 
 def _clean_reference_scores_df(reference_scores_df):
@@ -0,0 +1,112 @@
+"""Fast conversion of binned spectrums into model input matrices.
+
+All binned peaks of a collection of spectrums are collected in one pass and
+then scattered into a preallocated float32 array (or a CSR sparse matrix).
+"""
+from itertools import chain
+from typing import List, Optional, Sequence
+import numpy as np
+from scipy.sparse import csr_matrix
+from .typing import BinnedSpectrumType
+
+
+def create_input_matrix(binned_spectrums: List[BinnedSpectrumType],
+                        input_dim: int,
+                        sparse: bool = False,
+                        dtype=np.float32):
+    """Create the peaks input matrix for a list of binned spectrums.
+
+    For example:
+
+    .. code-block:: python
+
+        from ms2deepscore.input_matrices import create_input_matrix
+
+        binned_spectrums = spectrum_binner.transform(spectrums)
+        X = create_input_matrix(binned_spectrums, len(spectrum_binner.known_bins))
+
+    Parameters
+    ----------
+    binned_spectrums
+        List of BinnedSpectrum objects.
+    input_dim
+        Input dimension of the model (number of known bins).
+    sparse
+        Set to True to return a scipy CSR matrix instead of a dense numpy array.
+        Default is False.
+    dtype
+        Data type of the returned matrix. Default is np.float32.
+
+    Returns
+    -------
+    Matrix of shape (len(binned_spectrums), input_dim).
+    """
+    n_peaks = np.fromiter((len(s.binned_peaks) for s in binned_spectrums),
+                          dtype=np.int64, count=len(binned_spectrums))
+    indptr = np.zeros(len(binned_spectrums) + 1, dtype=np.int64)
+    np.cumsum(n_peaks, out=indptr[1:])
+    indices = np.fromiter(chain.from_iterable(map(int, s.binned_peaks.keys()) for s in binned_spectrums),
+                          dtype=np.int64, count=indptr[-1])
+    values = np.fromiter(chain.from_iterable(s.binned_peaks.values() for s in binned_spectrums),
+                         dtype=dtype, count=indptr[-1])
+    return peaks_to_matrix(indptr, indices, values, input_dim, sparse=sparse, dtype=dtype)
+
+
+def peaks_to_matrix(indptr: np.ndarray, indices: np.ndarray, values: np.ndarray,
+                    input_dim: int, sparse: bool = False, dtype=np.float32):
+    """Scatter peaks given in CSR layout into a dense array (or a CSR matrix).
+
+    Parameters
+    ----------
+    indptr
+        Row pointers, peaks of row i are found at indices[indptr[i]:indptr[i+1]].
+    indices
+        Bin (column) positions of all peaks.
+    values
+        Intensities of all peaks.
+    input_dim
+        Number of columns of the returned matrix.
+    sparse
+        Set to True to return a scipy CSR matrix. Default is False.
+    dtype
+        Data type of the returned matrix. Default is np.float32.
+    """
+    n_rows = indptr.shape[0] - 1
+    if sparse:
+        return csr_matrix((values.astype(dtype, copy=False), indices, indptr),
+                          shape=(n_rows, input_dim))
+    X = np.zeros((n_rows, input_dim), dtype=dtype)
+    rows = np.repeat(np.arange(n_rows), np.diff(indptr))
+    X[rows, indices] = values
+    return X
+
+
+def create_metadata_matrix(binned_spectrums: List[BinnedSpectrumType],
+                           feature_keys: Optional[Sequence[str]] = None,
+                           dtype=np.float32) -> np.ndarray:
+    """Create the additional (metadata) input matrix for a list of binned spectrums.
+
+    Parameters
+    ----------
+    binned_spectrums
+        List of BinnedSpectrum objects.
+    feature_keys
+        Metadata keys of the additional input features (json representations of the
+        MetadataFeatureGenerator instances of the SpectrumBinner). Default is None, in
+        which case all metadata entries except "inchikey" are used in stored order.
+    dtype
+        Data type of the returned matrix. Default is np.float32.
+
+    Returns
+    -------
+    Array of shape (len(binned_spectrums), number of features).
+    """
+    if feature_keys is None:
+        if len(binned_spectrums) == 0:
+            return np.zeros((0, 0), dtype=dtype)
+        feature_keys = [key for key in binned_spectrums[0].metadata.keys() if key != "inchikey"]
+    n_features = len(feature_keys)
+    values = np.fromiter(chain.from_iterable((float(s.get(key)) for key in feature_keys)
+                                             for s in binned_spectrums),
+                         dtype=dtype, count=len(binned_spectrums) * n_features)
+    return values.reshape(len(binned_spectrums), n_features)
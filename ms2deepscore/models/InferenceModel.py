@@ -0,0 +1,370 @@
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple, Union
+import numpy as np
+from ms2deepscore.SpectrumBinner import SpectrumBinner
+
+
+class DenseEmbeddingNetwork:
+    """NumPy implementation of the forward pass of the MS2DeepScore base network.
+
+    The base network consists of blocks of Dense (relu) -> BatchNormalization ->
+    Dropout layers followed by a Dense (relu) embedding layer. For inference, dropout
+    is inactive and every BatchNormalization is an affine transformation, which is
+    folded into the weights and biases of the subsequent Dense layer. The forward pass
+    then is a few float32 matrix multiplications (numpy BLAS) without any TensorFlow
+    overhead.
+
+    The original (unfolded) weights are kept and returned by :meth:`get_weights` in
+    the same order as ``keras.Model.get_weights()``, so that model fingerprints match
+    those of the Keras base network.
+    """
+    def __init__(self, kernels: Sequence[np.ndarray], biases: Sequence[np.ndarray],
+                 batch_norms: Sequence[Optional[Tuple[np.ndarray, ...]]],
+                 dropout_rates: Sequence[float],
+                 nr_of_additional_inputs: int = 0,
+                 epsilon: float = 1e-3,
+                 dtype=np.float32):
+        """
+
+        Parameters
+        ----------
+        kernels
+            Kernels of all Dense layers (the last one being the embedding layer).
+        biases
+            Biases of all Dense layers.
+        batch_norms
+            For every Dense layer a tuple (gamma, beta, moving_mean, moving_variance) of the
+            subsequent BatchNormalization layer, or None if there is none.
+        dropout_rates
+            For every Dense layer the rate of the subsequent Dropout layer (0 if there is none).
+        nr_of_additional_inputs
+            Number of additional (metadata) inputs, which are concatenated to the peaks input.
+            Default is 0.
+        epsilon
+            Epsilon of the BatchNormalization layers. Default is 1e-3 (Keras default).
+        dtype
+            Data type used for the forward pass. Default is np.float32.
+        """
+        # pylint: disable=too-many-arguments
+        assert len(kernels) == len(biases) == len(batch_norms) == len(dropout_rates), \
+            "Expected kernels, biases, batch_norms and dropout_rates for every Dense layer."
+        assert batch_norms[-1] is None, "Expected no BatchNormalization after the embedding layer."
+        self.kernels = [np.asarray(kernel) for kernel in kernels]
+        self.biases = [np.asarray(bias) for bias in biases]
+        self.batch_norms = [None if batch_norm is None else tuple(np.asarray(w) for w in batch_norm)
+                            for batch_norm in batch_norms]
+        self.dropout_rates = [float(rate) for rate in dropout_rates]
+        self.nr_of_additional_inputs = nr_of_additional_inputs
+        self.epsilon = epsilon
+        self.dtype = np.dtype(dtype)
+        self.folded_kernels, self.folded_biases = self._fold_batch_normalization()
+
+    @classmethod
+    def from_keras(cls, keras_base, dtype=np.float32) -> "DenseEmbeddingNetwork":
+        """Extract weights from a Keras base network (e.g. `SiameseModel.base`).
+
+        Parameters
+        ----------
+        keras_base
+            Keras base network with Dense, BatchNormalization and Dropout layers.
+        dtype
+            Data type used for the forward pass. Default is np.float32.
+        """
+        kernels, biases, batch_norms, dropout_rates = [], [], [], []
+        epsilon = 1e-3
+        nr_of_additional_inputs = 0
+        for layer in keras_base.layers:
+            layer_type = type(layer).__name__
+            if layer_type == "InputLayer" and layer.name == "additional_input":
+                shape = layer.get_config()["batch_input_shape"]
+                nr_of_additional_inputs = shape[-1]
+            elif layer_type == "Dense":
+                assert layer.get_config()["activation"] == "relu", "Expected Dense layers with relu activation."
+                kernel, bias = layer.get_weights()
+                kernels.append(kernel)
+                biases.append(bias)
+                batch_norms.append(None)
+                dropout_rates.append(0.0)
+            elif layer_type == "BatchNormalization":
+                config = layer.get_config()
+                assert config["center"] and config["scale"], "Expected BatchNormalization with center and scale."
+                batch_norms[-1] = tuple(layer.get_weights())
+                epsilon = config["epsilon"]
+            elif layer_type == "Dropout":
+                dropout_rates[-1] = layer.rate
+            elif layer_type not in ("InputLayer", "Concatenate"):
+                raise ValueError(f"Layer type {layer_type} is not supported.")
+        return cls(kernels, biases, batch_norms, dropout_rates,
+                   nr_of_additional_inputs=nr_of_additional_inputs, epsilon=epsilon, dtype=dtype)
+
+    @property
+    def input_dim(self) -> int:
+        """Dimension of the peaks input."""
+        return self.kernels[0].shape[0] - self.nr_of_additional_inputs
+
+    @property
+    def input_shape(self) -> Union[Tuple, List[Tuple]]:
+        """Input shape(s) as given by ``keras.Model.input_shape``."""
+        if self.nr_of_additional_inputs > 0:
+            return [(None, self.input_dim), (None, self.nr_of_additional_inputs)]
+        return (None, self.input_dim)
+
+    @property
+    def output_shape(self) -> Tuple:
+        """Output shape as given by ``keras.Model.output_shape``."""
+        return (None, self.kernels[-1].shape[1])
+
+    def get_weights(self) -> List[np.ndarray]:
+        """Return all (unfolded) weights in the same order as ``keras.Model.get_weights()``."""
+        weights = []
+        for kernel, bias, batch_norm in zip(self.kernels, self.biases, self.batch_norms):
+            weights += [kernel, bias]
+            if batch_norm is not None:
+                weights += list(batch_norm)
+        return weights
+
+    def batch_norm_scale_and_shift(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return BatchNormalization after Dense layer i as scale and shift (y * scale + shift)."""
+        gamma, beta, moving_mean, moving_variance = self.batch_norms[i]
+        scale = gamma / np.sqrt(moving_variance + self.epsilon)
+        return scale, beta - moving_mean * scale
+
+    def _fold_batch_normalization(self):
+        """Fold every BatchNormalization into the weights of the next Dense layer."""
+        folded_kernels = [kernel.astype(np.float64) for kernel in self.kernels]
+        folded_biases = [bias.astype(np.float64) for bias in self.biases]
+        for i, batch_norm in enumerate(self.batch_norms):
+            if batch_norm is None:
+                continue
+            scale, shift = self.batch_norm_scale_and_shift(i)
+            folded_biases[i + 1] = folded_biases[i + 1] + shift @ folded_kernels[i + 1]
+            folded_kernels[i + 1] = scale[:, np.newaxis] * folded_kernels[i + 1]
+        return ([np.ascontiguousarray(kernel, dtype=self.dtype) for kernel in folded_kernels],
+                [bias.astype(self.dtype) for bias in folded_biases])
+
+    def _prepare_input(self, X) -> np.ndarray:
+        if self.nr_of_additional_inputs > 0:
+            assert isinstance(X, (list, tuple)) and len(X) == 2, \
+                "Expected peaks input and additional input."
+            return np.hstack([np.asarray(X[0], dtype=self.dtype), np.asarray(X[1], dtype=self.dtype)])
+        if isinstance(X, (list, tuple)):
+            X = X[0]
+        return np.asarray(X, dtype=self.dtype)
+
+    def _forward(self, X: np.ndarray) -> np.ndarray:
+        for kernel, bias in zip(self.folded_kernels, self.folded_biases):
+            X = X @ kernel
+            X += bias
+            np.maximum(X, 0, out=X)
+        return X
+
+    def predict(self, X, batch_size: Optional[int] = None,
+                verbose=0) -> np.ndarray:  # pylint: disable=unused-argument
+        """Compute embeddings (mimics ``keras.Model.predict``).
+
+        Parameters
+        ----------
+        X
+            Input array (n_spectrums, input_dim) or, for models with additional inputs,
+            a list of the peaks input and the additional input array.
+        batch_size
+            Number of inputs processed together. Default is None (all at once).
+        verbose
+            Ignored, only for compatibility with Keras.
+        """
+        X = self._prepare_input(X)
+        if batch_size is None or batch_size >= X.shape[0]:
+            return self._forward(X)
+        embeddings = np.empty((X.shape[0], self.output_shape[1]), dtype=self.dtype)
+        for i in range(0, X.shape[0], batch_size):
+            embeddings[i:i + batch_size] = self._forward(X[i:i + batch_size])
+        return embeddings
+
+    def create_dropout_masks(self, n_ensembles: int,
+                             random_seed: Optional[int] = None) -> List[Optional[np.ndarray]]:
+        """Draw a fixed set of dropout masks for Monte Carlo dropout.
+
+        Parameters
+        ----------
+        n_ensembles
+            Number of ensemble members (one mask per member and Dropout layer).
+        random_seed
+            Seed for drawing the masks. Default is None (not reproducible).
+
+        Returns
+        -------
+        For every Dense layer an array (n_ensembles, units) with 0 for dropped units and
+        1 / (1 - dropout_rate) for kept units, or None if the layer has no dropout.
+        """
+        rng = np.random.default_rng(random_seed)
+        masks = []
+        for kernel, rate in zip(self.kernels, self.dropout_rates):
+            if rate == 0:
+                masks.append(None)
+                continue
+            keep = rng.random((n_ensembles, kernel.shape[1])) >= rate
+            masks.append((keep / (1 - rate)).astype(self.dtype))
+        assert any(mask is not None for mask in masks), "Expected base network with dropout layers."
+        return masks
+
+    def predict_ensemble(self, X, dropout_masks: List[Optional[np.ndarray]],
+                         batch_size: Optional[int] = None) -> np.ndarray:
+        """Compute Monte Carlo dropout embeddings with fixed dropout masks.
+
+        Every Dropout layer multiplies the output of ensemble member e with dropout_masks[e],
+        which makes the ensemble embeddings deterministic for a given set of masks.
+
+        Parameters
+        ----------
+        X
+            Input array (n_spectrums, input_dim) or, for models with additional inputs,
+            a list of the peaks input and the additional input array.
+        dropout_masks
+            Masks as created by :meth:`create_dropout_masks`.
+        batch_size
+            Number of spectrums processed together. Default is None (all at once).
+
+        Returns
+        -------
+        Array (n_spectrums * n_ensembles, embedding dimension) in which the ensemble
+        embeddings of every spectrum are consecutive rows.
+        """
+        X = self._prepare_input(X)
+        n_ensembles = next(mask.shape[0] for mask in dropout_masks if mask is not None)
+        if batch_size is None or batch_size >= X.shape[0]:
+            return self._forward_ensemble(X, dropout_masks, n_ensembles)
+        embeddings = np.empty((X.shape[0] * n_ensembles, self.output_shape[1]), dtype=self.dtype)
+        for i in range(0, X.shape[0], batch_size):
+            embeddings[i * n_ensembles:(i + batch_size) * n_ensembles] = \
+                self._forward_ensemble(X[i:i + batch_size], dropout_masks, n_ensembles)
+        return embeddings
+
+    def _forward_ensemble(self, X: np.ndarray, dropout_masks, n_ensembles: int) -> np.ndarray:
+        # Layers before the first Dropout are identical for all ensemble members and
+        # are computed once per spectrum (this includes the large first Dense layer)
+        expanded = False
+        for i, (kernel, bias) in enumerate(zip(self.kernels, self.biases)):
+            X = X @ kernel.astype(self.dtype, copy=False)
+            X += bias.astype(self.dtype, copy=False)
+            np.maximum(X, 0, out=X)
+            if self.batch_norms[i] is not None:
+                scale, shift = self.batch_norm_scale_and_shift(i)
+                X *= scale.astype(self.dtype)
+                X += shift.astype(self.dtype)
+            if dropout_masks[i] is None:
+                continue
+            if expanded:
+                X = (X.reshape(-1, n_ensembles, X.shape[1]) * dropout_masks[i]).reshape(-1, X.shape[1])
+            else:
+                X = (X[:, np.newaxis, :] * dropout_masks[i]).reshape(-1, X.shape[1])
+                expanded = True
+        return X if expanded else np.repeat(X, n_ensembles, axis=0)
+
+
+class InferenceModel:
+    """Light-weight MS2DeepScore model for inference only, which does not need TensorFlow.
+
+    It holds the spectrum binner and a :class:`DenseEmbeddingNetwork` as base network and
+    can be used in place of a :class:`~ms2deepscore.models.SiameseModel` in
+    :class:`~ms2deepscore.MS2DeepScore`.
+
+    For example:
+
+    .. code-block:: python
+
+        from ms2deepscore import MS2DeepScore
+        from ms2deepscore.models import InferenceModel, load_model
+
+        model = InferenceModel.from_siamese_model(load_model("model_file_123.hdf5"))
+        similarity_measure = MS2DeepScore(model)
+
+        # Export to a single .npz file which can be loaded quickly without TensorFlow
+        model.save("model_file_123.npz")
+        model = load_model("model_file_123.npz")
+
+    """
+    _format_version = 1
+
+    def __init__(self, spectrum_binner: SpectrumBinner, base: DenseEmbeddingNetwork):
+        """
+
+        Parameters
+        ----------
+        spectrum_binner
+            SpectrumBinner which was used to bin the spectra data for the model training.
+        base
+            Base network.
+        """
+        self.spectrum_binner = spectrum_binner
+        self.base = base
+        self.input_dim = len(spectrum_binner.known_bins)
+        self.nr_of_additional_inputs = len(spectrum_binner.additional_metadata)
+        assert base.input_dim == self.input_dim, "Expected base network input to match the spectrum binner."
+        assert base.nr_of_additional_inputs == self.nr_of_additional_inputs, \
+            "Expected base network additional inputs to match the spectrum binner."
+
+    @classmethod
+    def from_siamese_model(cls, model, dtype=np.float32) -> "InferenceModel":
+        """Create inference model from a (trained) SiameseModel.
+
+        Parameters
+        ----------
+        model
+            SiameseModel.
+        dtype
+            Data type used for the forward pass. Default is np.float32.
+        """
+        return cls(model.spectrum_binner, DenseEmbeddingNetwork.from_keras(model.base, dtype=dtype))
+
+    def save(self, filename: Union[str, Path]):
+        """Save model to a single (numpy .npz) file.
+
+        The file contains the (unfolded) weights of all layers, the layer layout and
+        the spectrum binner json. It can be loaded with :meth:`load` or
+        :func:`~ms2deepscore.models.load_model`.
+
+        Parameters
+        ----------
+        filename
+            Filename to specify where to store the model.
+        """
+        base = self.base
+        arrays = {"format_version": np.array(self._format_version),
+                  "spectrum_binner": np.array(self.spectrum_binner.to_json()),
+                  "dropout_rates": np.array(base.dropout_rates),
+                  "has_batch_norm": np.array([batch_norm is not None for batch_norm in base.batch_norms]),
+                  "nr_of_additional_inputs": np.array(base.nr_of_additional_inputs),
+                  "epsilon": np.array(base.epsilon)}
+        for i, (kernel, bias, batch_norm) in enumerate(zip(base.kernels, base.biases, base.batch_norms)):
+            arrays[f"kernel_{i}"] = kernel
+            arrays[f"bias_{i}"] = bias
+            if batch_norm is not None:
+                arrays[f"batch_norm_{i}"] = np.stack(batch_norm)
+        with open(filename, "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, filename: Union[str, Path], dtype=np.float32) -> "InferenceModel":
+        """Load model from file created by :meth:`save`.
+
+        Parameters
+        ----------
+        filename
+            Filename of the stored model.
+        dtype
+            Data type used for the forward pass. Default is np.float32.
+        """
+        with np.load(filename) as data:
+            assert int(data["format_version"]) <= cls._format_version, \
+                "Model file was created by a newer version of ms2deepscore."
+            has_batch_norm = data["has_batch_norm"]
+            n_layers = len(has_batch_norm)
+            base = DenseEmbeddingNetwork([data[f"kernel_{i}"] for i in range(n_layers)],
+                                         [data[f"bias_{i}"] for i in range(n_layers)],
+                                         [tuple(data[f"batch_norm_{i}"]) if has_batch_norm[i] else None
+                                          for i in range(n_layers)],
+                                         data["dropout_rates"].tolist(),
+                                         nr_of_additional_inputs=int(data["nr_of_additional_inputs"]),
+                                         epsilon=float(data["epsilon"]), dtype=dtype)
+            spectrum_binner = SpectrumBinner.from_json(str(data["spectrum_binner"]))
+        return cls(spectrum_binner, base)
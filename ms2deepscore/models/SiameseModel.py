@@ -1,9 +1,6 @@
 from pathlib import Path
 from typing import Tuple, Union
 import h5py
-from tensorflow import keras
-from tensorflow.keras.layers import (  # pylint: disable=import-error
-    BatchNormalization, Dense, Dropout, Input, concatenate)
 from ms2deepscore import SpectrumBinner
 
 
@@ -49,7 +46,7 @@ class SiameseModel:
                  dropout_in_first_layer: bool = False,
                  l1_reg: float = 1e-6,
                  l2_reg: float = 1e-6,
-                 keras_model: keras.Model = None):
+                 keras_model=None):
         """
         Construct SiameseModel
 
@@ -112,7 +109,7 @@ class SiameseModel:
                        dropout_in_first_layer: bool = False,
                        l1_reg: float = 1e-6,
                        l2_reg: float = 1e-6,
-                       dropout_always_on: bool = False) -> keras.Model:
+                       dropout_always_on: bool = False):
         """Create base model for Siamaese network.
 
         Parameters
@@ -136,7 +133,11 @@ class SiameseModel:
             dropout layers will always be on, which is used for ensembling via
             Monte Carlo dropout.
         """
-        # pylint: disable=too-many-arguments, disable=too-many-locals
+        # pylint: disable=too-many-arguments, disable=too-many-locals, disable=import-outside-toplevel
+        # TensorFlow is imported only when a model is built (it is slow to import)
+        from tensorflow import keras
+        from tensorflow.keras.layers import (  # pylint: disable=import-error
+            BatchNormalization, Dense, Dropout, Input, concatenate)
 
         dropout_starting_layer = 0 if dropout_in_first_layer else 1
         base_input = Input(shape=self.input_dim, name='base_input')
@@ -166,6 +167,9 @@ class SiameseModel:
         return keras.Model(inputs=[base_input], outputs=[embedding], name='base')
 
     def _get_head_model(self):
+        # pylint: disable=import-outside-toplevel, import-error
+        from tensorflow import keras
+        from tensorflow.keras.layers import Input
 
         input_a = Input(shape=self.input_dim, name="input_a")
         input_b = Input(shape=self.input_dim, name="input_b")
@@ -1,8 +1,11 @@
+from .InferenceModel import DenseEmbeddingNetwork, InferenceModel
 from .load_model import load_model
 from .SiameseModel import SiameseModel
 
 
 __all__ = [
+    "DenseEmbeddingNetwork",
+    "InferenceModel",
     "load_model",
     "SiameseModel",
 ]
@@ -1,14 +1,18 @@
 from pathlib import Path
 from typing import Union
 import h5py
-from tensorflow import keras
 from ms2deepscore.SpectrumBinner import SpectrumBinner
+from .InferenceModel import InferenceModel
 from .SiameseModel import SiameseModel
 
 
-def load_model(filename: Union[str, Path]) -> SiameseModel:
+def load_model(filename: Union[str, Path]) -> Union[SiameseModel, InferenceModel]:
     """
-    Load a MS2DeepScore model (SiameseModel) from file.
+    Load a MS2DeepScore model from file.
+
+    Keras (h5) files saved by `SiameseModel.save` are loaded as SiameseModel. Model files
+    saved by `InferenceModel.save` (npz) are loaded as InferenceModel, which does not
+    require TensorFlow.
 
     For example:
 
@@ -20,9 +24,17 @@ def load_model(filename: Union[str, Path]) -> SiameseModel:
     Parameters
     ----------
     filename
-        Filename. Expecting saved SiameseModel.
+        Filename. Expecting saved SiameseModel or InferenceModel.
 
     """
+    with open(filename, "rb") as f:
+        is_npz = f.read(2) == b"PK"
+    if is_npz:
+        return InferenceModel.load(filename)
+
+    # TensorFlow is only imported when a model is loaded
+    from tensorflow import keras  # pylint: disable=import-outside-toplevel
+
     with h5py.File(filename, mode='r') as f:
         binner_json = f.attrs['spectrum_binner']
         keras_model = keras.models.load_model(f)
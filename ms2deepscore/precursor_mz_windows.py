@@ -0,0 +1,76 @@
+"""Selection of reference/query pairs with matching precursor m/z.
+
+References are sorted by precursor m/z once, after which the candidate range of every
+query is found by binary search (np.searchsorted). This way only pairs within the
+precursor m/z window need to be scored instead of the full library per query.
+"""
+from typing import List, Tuple
+import numpy as np
+from matchms import Spectrum
+
+
+def get_precursor_mz(spectrums: List[Spectrum]) -> np.ndarray:
+    """Return precursor m/z of all spectrums as array (NaN where it is missing)."""
+    precursor_mz = [spectrum.get("precursor_mz") for spectrum in spectrums]
+    return np.array([np.nan if mz is None else mz for mz in precursor_mz], dtype=np.float64)
+
+
+def precursor_mz_candidates(reference_precursor_mz: np.ndarray, query_precursor_mz: np.ndarray,
+                            tolerance: float = 0.1, tolerance_type: str = "Dalton",
+                            mass_shift_range: Tuple[float, float] = (0.0, 0.0)
+                            ) -> Tuple[np.ndarray, np.ndarray]:
+    """Find all (reference, query) pairs for which the reference precursor m/z lies
+    within the window of the query precursor m/z.
+
+    The window of a query with precursor m/z `mz` is
+    [mz + mass_shift_range[0] - tol, mz + mass_shift_range[1] + tol], where tol is the
+    tolerance in Dalton or in ppm of the query precursor m/z. A mass_shift_range like
+    (-100, 100) can be used for analog search. Spectrums without precursor m/z are never
+    part of a pair.
+
+    For example:
+
+    .. code-block:: python
+
+        from ms2deepscore.precursor_mz_windows import get_precursor_mz, precursor_mz_candidates
+
+        rows, cols = precursor_mz_candidates(get_precursor_mz(references),
+                                             get_precursor_mz(queries), tolerance=10, tolerance_type="ppm")
+
+    Parameters
+    ----------
+    reference_precursor_mz
+        Precursor m/z of all references.
+    query_precursor_mz
+        Precursor m/z of all queries.
+    tolerance
+        Tolerance around the (shifted) query precursor m/z. Default is 0.1.
+    tolerance_type
+        "Dalton" or "ppm". Default is "Dalton".
+    mass_shift_range
+        Range (lower, upper) of allowed precursor m/z differences reference - query.
+        Default is (0.0, 0.0).
+
+    Returns
+    -------
+    rows, cols
+        Reference and query indices of all pairs, sorted by query and reference precursor m/z.
+    """
+    if tolerance_type not in ("Dalton", "ppm"):
+        raise ValueError("tolerance_type must be 'Dalton' or 'ppm'.")
+    assert mass_shift_range[0] <= mass_shift_range[1], "Expected mass_shift_range as (lower, upper)."
+    reference_precursor_mz = np.asarray(reference_precursor_mz, dtype=np.float64)
+    query_precursor_mz = np.asarray(query_precursor_mz, dtype=np.float64)
+    order = np.argsort(reference_precursor_mz, kind="stable")  # NaN values are sorted to the end
+    sorted_mz = reference_precursor_mz[order]
+    sorted_mz = sorted_mz[:np.count_nonzero(~np.isnan(sorted_mz))]
+
+    tolerances = tolerance if tolerance_type == "Dalton" else query_precursor_mz * tolerance * 1e-6
+    starts = np.searchsorted(sorted_mz, query_precursor_mz + mass_shift_range[0] - tolerances, side="left")
+    ends = np.searchsorted(sorted_mz, query_precursor_mz + mass_shift_range[1] + tolerances, side="right")
+    counts = np.maximum(ends - starts, 0)  # NaN queries have empty windows
+
+    cols = np.repeat(np.arange(query_precursor_mz.shape[0]), counts)
+    offsets = np.arange(cols.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)
+    rows = order[np.repeat(starts, counts) + offsets]
+    return rows, cols
@@ -1,3 +1,4 @@
+import hashlib
 import os
 import pickle
 
@@ -14,6 +15,32 @@ def create_peak_dict(peak_list):
     return peaks
 
 
+def get_model_fingerprint(model) -> str:
+    """Return hash identifying a model by its base network weights and spectrum binner.
+
+    Parameters
+    ----------
+    model
+        SiameseModel (or any object with `base.get_weights()` and `spectrum_binner`).
+    """
+    fingerprint = hashlib.sha256()
+    for weights in model.base.get_weights():
+        fingerprint.update(str(weights.shape).encode())
+        fingerprint.update(weights.tobytes())
+    fingerprint.update(model.spectrum_binner.to_json().encode())
+    return fingerprint.hexdigest()
+
+
+def get_spectrum_ids(spectrums, id_field: str = "spectrum_id", start: int = 0):
+    """Return IDs of spectrums as strings, taken from metadata field `id_field`.
+    Spectrums without this field get their running index (+start) as ID."""
+    spectrum_ids = []
+    for i, spectrum in enumerate(spectrums):
+        spectrum_id = spectrum.get(id_field)
+        spectrum_ids.append(str(start + i) if spectrum_id is None else str(spectrum_id))
+    return spectrum_ids
+
+
 def save_pickled_file(obj, filename: str):
     assert not os.path.exists(filename), "File already exists"
     with open(filename, "wb") as f:
@@ -1,11 +1,12 @@
 """Performance optimized vector operations. Same as found in Spec2Vec
 (https://github.com/iomega/spec2vec)."""
 
+from typing import Optional, Tuple
 import numba
 import numpy as np
 
 
-@numba.njit
+@numba.njit(cache=True)
 def cosine_similarity_matrix(vectors_1: np.ndarray, vectors_2: np.ndarray) -> np.ndarray:
     """Fast implementation of cosine similarity between two arrays of vectors.
 
@@ -44,7 +45,646 @@ def cosine_similarity_matrix(vectors_1: np.ndarray, vectors_2: np.ndarray) -> np
     return np.dot(vectors_1, vectors_2.T)
 
 
-@numba.njit
+def cosine_similarity_matrix_parallel(vectors_1: np.ndarray, vectors_2: np.ndarray,
+                                      out: Optional[np.ndarray] = None,
+                                      dtype=np.float32) -> np.ndarray:
+    """Cosine similarity between two arrays of vectors computed in `dtype` with BLAS.
+
+    Copies are only avoided for inputs that are C-contiguous arrays of `dtype` (float32
+    or float64), other inputs are cast (copied) once per call. The dot products are
+    computed with (multi-threaded) BLAS and written directly into `out` if it is a
+    C-contiguous array of `dtype`. The result is then scaled in place by the inverse
+    vector norms (numba, parallel). Vectors with norm 0 get scores of 0.
+
+    For example:
+
+    .. code-block:: python
+
+        from ms2deepscore.vector_operations import cosine_similarity_matrix_parallel
+
+        buffer = np.empty((1000, 1000), dtype=np.float32)
+        for i in range(0, vectors_1.shape[0], 1000):
+            scores = cosine_similarity_matrix_parallel(vectors_1[i:i + 1000], vectors_2, out=buffer)
+
+    Parameters
+    ----------
+    vectors_1
+        Numpy array of vectors (n_vectors_1, vector dimension).
+    vectors_2
+        Numpy array of vectors (n_vectors_2, vector dimension).
+    out
+        Optional array of shape (n_vectors_1, n_vectors_2) to write the scores into.
+        Default is None, in which case a new array is allocated.
+    dtype
+        Data type used for the computation and for a newly allocated output array.
+        Default is np.float32.
+    """
+    assert vectors_1.shape[1] == vectors_2.shape[1], "Input vectors must have same shape."
+    shape = (vectors_1.shape[0], vectors_2.shape[0])
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    assert out.shape == shape, f"Expected output array of shape {shape}."
+    return _cosine_similarity_tile(*_prepare_vectors(vectors_1, dtype), *_prepare_vectors(vectors_2, dtype), out)
+
+
+def _prepare_vectors(vectors: np.ndarray, dtype) -> Tuple[np.ndarray, np.ndarray]:
+    """Return vectors as C-contiguous dtype array (without copy if they already are)
+    and their inverse norms (0 for vectors with norm 0). Done once per call, not once
+    per tile."""
+    vectors = np.ascontiguousarray(vectors, dtype=dtype)
+    norms = np.sqrt(np.einsum("ij,ij->i", vectors, vectors))
+    inverse_norms = np.zeros_like(norms)
+    np.divide(1, norms, out=inverse_norms, where=(norms != 0))
+    return vectors, inverse_norms
+
+
+def _cosine_similarity_tile(vectors_1: np.ndarray, inverse_norms_1: np.ndarray,
+                            vectors_2: np.ndarray, inverse_norms_2: np.ndarray,
+                            out: np.ndarray) -> np.ndarray:
+    """Cosine similarities of prepared vectors (see :func:`_prepare_vectors`) written into out."""
+    if out.dtype == vectors_1.dtype and out.flags.c_contiguous:
+        np.dot(vectors_1, vectors_2.T, out=out)
+    else:
+        out[:] = np.dot(vectors_1, vectors_2.T)
+    _scale_by_inverse_norms(out, inverse_norms_1, inverse_norms_2)
+    return out
+
+
+@numba.njit(cache=True, parallel=True, fastmath=True)
+def _scale_by_inverse_norms(scores, inverse_norms_1, inverse_norms_2):
+    for i in numba.prange(scores.shape[0]):  # pylint: disable=not-an-iterable
+        for j in range(scores.shape[1]):
+            scores[i, j] *= inverse_norms_1[i] * inverse_norms_2[j]
+
+
+def _tile(buffer: np.ndarray, n_rows: int, n_cols: int) -> np.ndarray:
+    """C-contiguous (n_rows, n_cols) view into a reused flat buffer."""
+    return buffer[:n_rows * n_cols].reshape(n_rows, n_cols)
+
+
+def cosine_similarity_matrix_tiled(vectors_1: np.ndarray, vectors_2: np.ndarray,
+                                   block_size: int = 10_000,
+                                   out: Optional[np.ndarray] = None,
+                                   dtype=np.float32) -> np.ndarray:
+    """Block-wise cosine similarity between two arrays of vectors.
+
+    Scores are computed tile by tile (block_size x block_size) and written into
+    `out`, which can be a preallocated array or a disk-backed np.memmap. This
+    allows to compute similarity matrices that do not fit into memory.
+
+    For example:
+
+    .. code-block:: python
+
+        import numpy as np
+        from ms2deepscore.vector_operations import cosine_similarity_matrix_tiled
+
+        scores = np.memmap("scores.npy", dtype=np.float32, mode="w+",
+                           shape=(vectors_1.shape[0], vectors_2.shape[0]))
+        cosine_similarity_matrix_tiled(vectors_1, vectors_2, out=scores)
+        scores.flush()
+
+    Parameters
+    ----------
+    vectors_1
+        Numpy array of vectors. vectors_1.shape[0] is number of vectors, vectors_1.shape[1]
+        is vector dimension.
+    vectors_2
+        Numpy array of vectors. vectors_2.shape[0] is number of vectors, vectors_2.shape[1]
+        is vector dimension.
+    block_size
+        Number of vectors per row and column block. Default is 10000.
+    out
+        Optional array of shape (vectors_1.shape[0], vectors_2.shape[0]) to write the
+        scores into. Default is None, in which case a new array is allocated.
+    dtype
+        Data type used for the computation and for a newly allocated output array.
+        Ignored if `out` is given (then out.dtype is used). Default is np.float32.
+    """
+    assert vectors_1.shape[1] == vectors_2.shape[1], "Input vectors must have same shape."
+    shape = (vectors_1.shape[0], vectors_2.shape[0])
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    assert out.shape == shape, f"Expected output array of shape {shape}."
+    vectors_1, inverse_norms_1 = _prepare_vectors(vectors_1, out.dtype)
+    vectors_2, inverse_norms_2 = _prepare_vectors(vectors_2, out.dtype)
+    if shape[0] <= block_size and shape[1] <= block_size:
+        return _cosine_similarity_tile(vectors_1, inverse_norms_1, vectors_2, inverse_norms_2, out)
+    buffer = np.empty(min(block_size, shape[0]) * min(block_size, shape[1]), dtype=out.dtype)
+    for i in range(0, shape[0], block_size):
+        block_1 = vectors_1[i:i + block_size]
+        for j in range(0, shape[1], block_size):
+            block_2 = vectors_2[j:j + block_size]
+            out[i:i + block_size, j:j + block_size] = _cosine_similarity_tile(
+                block_1, inverse_norms_1[i:i + block_size], block_2, inverse_norms_2[j:j + block_size],
+                _tile(buffer, block_1.shape[0], block_2.shape[0]))
+    return out
+
+
+def cosine_similarity_matrix_symmetric(vectors: np.ndarray, block_size: int = 10_000,
+                                       out: Optional[np.ndarray] = None,
+                                       dtype=np.float32, packed: bool = False) -> np.ndarray:
+    """All-vs-all cosine similarity of vectors, computing only upper-triangle blocks.
+
+    Every block (i, j) with j >= i is computed once and mirrored into block (j, i),
+    which about halves the number of computed scores compared to the full computation
+    (the block size is reduced for this, see :func:`symmetric_block_size`).
+    With packed=True, only the upper triangle (including the diagonal) is returned
+    in row-major order as 1D array of length n * (n + 1) / 2, which also halves the
+    memory of the output.
+
+    Parameters
+    ----------
+    vectors
+        Numpy array of vectors. vectors.shape[0] is number of vectors, vectors.shape[1]
+        is vector dimension.
+    block_size
+        Maximum number of vectors per row and column block. Default is 10000.
+    out
+        Optional array to write the scores into, of shape (n, n) or, if packed=True,
+        (n * (n + 1) / 2,). Can also be a np.memmap. Default is None.
+    dtype
+        Data type used for the computation and for a newly allocated output array.
+        Ignored if `out` is given (then out.dtype is used). Default is np.float32.
+    packed
+        Set to True to return the packed upper triangle. Default is False.
+    """
+    n_vectors = vectors.shape[0]
+    shape = (n_vectors * (n_vectors + 1) // 2,) if packed else (n_vectors, n_vectors)
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    assert out.shape == shape, f"Expected output array of shape {shape}."
+    block_size = symmetric_block_size(n_vectors, block_size)
+    vectors, inverse_norms = _prepare_vectors(vectors, out.dtype)
+    buffer = np.empty(min(block_size, n_vectors) ** 2, dtype=out.dtype)
+    for i in range(0, n_vectors, block_size):
+        for j in range(i, n_vectors, block_size):
+            score_block = _cosine_similarity_tile(
+                vectors[i:i + block_size], inverse_norms[i:i + block_size],
+                vectors[j:j + block_size], inverse_norms[j:j + block_size],
+                _tile(buffer, min(block_size, n_vectors - i), min(block_size, n_vectors - j)))
+            if packed:
+                row, col = np.nonzero(np.arange(j, j + score_block.shape[1])
+                                      >= np.arange(i, i + score_block.shape[0])[:, np.newaxis])
+                out[packed_index(row + i, col + j, n_vectors)] = score_block[row, col]
+            else:
+                out[i:i + block_size, j:j + block_size] = score_block
+                out[j:j + block_size, i:i + block_size] = score_block.T
+    return out
+
+
+def symmetric_block_size(n_vectors: int, block_size: int, min_block_size: int = 256,
+                         n_block_rows: int = 8) -> int:
+    """Block size for all-vs-all scores that are computed for upper-triangle blocks only.
+
+    With b block rows, (b + 1) / (2b) of all scores are computed (b=1 is the full
+    matrix). The block size is therefore reduced to n_vectors / n_block_rows (but not
+    below min_block_size, to keep matrix multiplications efficient), so that only
+    slightly more than half of the scores is computed.
+
+    Parameters
+    ----------
+    n_vectors
+        Number of vectors (rows and columns of the score matrix).
+    block_size
+        Maximum block size.
+    min_block_size
+        Minimum block size. Default is 256.
+    n_block_rows
+        Targeted number of block rows. Default is 8.
+    """
+    return max(1, min(block_size, max(min_block_size, int(np.ceil(n_vectors / n_block_rows)))))
+
+
+def packed_index(row: np.ndarray, col: np.ndarray, n_vectors: int) -> np.ndarray:
+    """Position of entry (row, col) with col >= row in a row-major packed upper triangle."""
+    return row * n_vectors - row * (row - 1) // 2 + (col - row)
+
+
+def top_k_cosine_similarity(reference_vectors: np.ndarray, query_vectors: np.ndarray,
+                            k: int, block_size: int = 10_000,
+                            dtype=np.float32) -> Tuple[np.ndarray, np.ndarray]:
+    """Find the k most similar reference vectors for every query vector.
+
+    Scores are computed block-wise and only the running top-k per query are kept, so
+    that the full (references x queries) score matrix is never materialized.
+
+    For example:
+
+    .. code-block:: python
+
+        from ms2deepscore.vector_operations import top_k_cosine_similarity
+
+        indices, scores = top_k_cosine_similarity(reference_vectors, query_vectors, k=50)
+        best_reference_for_query_0 = indices[0, 0]
+
+    Parameters
+    ----------
+    reference_vectors
+        Numpy array of reference vectors (n_references, vector dimension).
+    query_vectors
+        Numpy array of query vectors (n_queries, vector dimension).
+    k
+        Number of best scoring references to return per query. Will be reduced to
+        the number of references if that is smaller.
+    block_size
+        Number of vectors per reference and query block. Default is 10000.
+    dtype
+        Data type used for the computation. Default is np.float32.
+
+    Returns
+    -------
+    indices, scores
+        Two arrays of shape (n_queries, k) with the reference indices and the cosine
+        scores, sorted from highest to lowest score for every query.
+    """
+    if k < 1:
+        raise ValueError(f"Expected k >= 1, got k={k}.")
+    assert reference_vectors.shape[1] == query_vectors.shape[1], "Input vectors must have same shape."
+    n_references = reference_vectors.shape[0]
+    n_queries = query_vectors.shape[0]
+    k = min(k, n_references)
+    top_indices = np.zeros((n_queries, k), dtype=np.int64)
+    top_scores = np.full((n_queries, k), -np.inf, dtype=dtype)
+    reference_vectors, reference_inverse_norms = _prepare_vectors(reference_vectors, dtype)
+    query_vectors, query_inverse_norms = _prepare_vectors(query_vectors, dtype)
+    buffer = np.empty(min(block_size, n_references) * min(block_size, n_queries), dtype=dtype)
+    for i in range(0, n_references, block_size):
+        reference_block = reference_vectors[i:i + block_size]
+        for j in range(0, n_queries, block_size):
+            query_block = query_vectors[j:j + block_size]
+            block_scores = _cosine_similarity_tile(
+                query_block, query_inverse_norms[j:j + block_size],
+                reference_block, reference_inverse_norms[i:i + block_size],
+                _tile(buffer, query_block.shape[0], reference_block.shape[0]))
+            update_top_k(top_indices[j:j + block_size], top_scores[j:j + block_size], block_scores, i)
+    return sort_top_k(top_indices, top_scores)
+
+
+def update_top_k(top_indices: np.ndarray, top_scores: np.ndarray,
+                 block_scores: np.ndarray, first_index: int,
+                 max_chunk_elements: int = 2**20):
+    """Merge a block of scores (n_queries, n_block) for the references starting at
+    `first_index` into the running top-k (top_indices, top_scores), in place.
+
+    The block is first reduced to its own top-k per query, which is then merged with
+    the running top-k. Rows are processed in chunks of at most max_chunk_elements
+    scores, so that temporary arrays stay small compared to the score block.
+    """
+    k = top_scores.shape[1]
+    assert k >= 1, "Expected top-k arrays with k >= 1."
+    n_block = block_scores.shape[1]
+    chunk_size = max(1, max_chunk_elements // max(n_block, 1))
+    for start in range(0, block_scores.shape[0], chunk_size):
+        chunk_scores = block_scores[start:start + chunk_size]
+        if n_block > k:
+            block_indices = np.argpartition(chunk_scores, n_block - k, axis=1)[:, n_block - k:]
+        else:
+            block_indices = np.broadcast_to(np.arange(n_block), chunk_scores.shape)
+        candidate_scores = np.hstack((top_scores[start:start + chunk_size],
+                                      np.take_along_axis(chunk_scores, block_indices, axis=1)))
+        candidate_indices = np.hstack((top_indices[start:start + chunk_size], block_indices + first_index))
+        selected = np.argpartition(candidate_scores, candidate_scores.shape[1] - k, axis=1)[:, -k:]
+        top_scores[start:start + chunk_size] = np.take_along_axis(candidate_scores, selected, axis=1)
+        top_indices[start:start + chunk_size] = np.take_along_axis(candidate_indices, selected, axis=1)
+
+
+def sort_top_k(top_indices: np.ndarray, top_scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sort top-k indices and scores of every row from highest to lowest score."""
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    return np.take_along_axis(top_indices, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def cosine_similarity_sparse(vectors_1: np.ndarray, vectors_2: np.ndarray,
+                             score_threshold: Optional[float] = None,
+                             max_per_row: Optional[int] = None,
+                             block_size: int = 10_000,
+                             dtype=np.float32) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Block-wise cosine similarity that only keeps scores >= score_threshold.
+
+    The full score matrix is never materialized, only one block of
+    (block_size x block_size) scores at a time.
+
+    Parameters
+    ----------
+    vectors_1
+        Numpy array of vectors (rows of the sparse score matrix).
+    vectors_2
+        Numpy array of vectors (columns of the sparse score matrix).
+    score_threshold
+        Only scores >= score_threshold are kept. Default is None (keep all scores).
+    max_per_row
+        If given, only the max_per_row highest scores of every row are kept.
+        Default is None.
+    block_size
+        Number of vectors per row and column block. Default is 10000.
+    dtype
+        Data type used for the computation. Default is np.float32.
+
+    Returns
+    -------
+    row, col, scores
+        Arrays with the row indices, column indices and scores of all kept entries.
+    """
+    # pylint: disable=too-many-arguments, too-many-locals
+    assert vectors_1.shape[1] == vectors_2.shape[1], "Input vectors must have same shape."
+    rows, cols, scores = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=dtype)]
+    vectors_1, inverse_norms_1 = _prepare_vectors(vectors_1, dtype)
+    vectors_2, inverse_norms_2 = _prepare_vectors(vectors_2, dtype)
+    buffer = np.empty(min(block_size, vectors_1.shape[0]) * min(block_size, vectors_2.shape[0]), dtype=dtype)
+    for i in range(0, vectors_1.shape[0], block_size):
+        block_1 = vectors_1[i:i + block_size]
+        block_rows, block_cols, block_scores = [], [], []
+        for j in range(0, vectors_2.shape[0], block_size):
+            block_2 = vectors_2[j:j + block_size]
+            score_block = _cosine_similarity_tile(block_1, inverse_norms_1[i:i + block_size],
+                                                  block_2, inverse_norms_2[j:j + block_size],
+                                                  _tile(buffer, block_1.shape[0], block_2.shape[0]))
+            row, col = select_entries(score_block, score_threshold)
+            block_rows.append(row + i)
+            block_cols.append(col + j)
+            block_scores.append(score_block[row, col])
+        row, col, block_scores = np.concatenate(block_rows), np.concatenate(block_cols), np.concatenate(block_scores)
+        selected = np.lexsort((col, row))
+        if max_per_row is not None:
+            selected = selected[top_entries_per_row(row[selected], block_scores[selected], max_per_row)]
+        row, col, block_scores = row[selected], col[selected], block_scores[selected]
+        rows.append(row)
+        cols.append(col)
+        scores.append(block_scores)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(scores)
+
+
+def cosine_similarity_sparse_symmetric(vectors: np.ndarray,
+                                       score_threshold: Optional[float] = None,
+                                       max_per_row: Optional[int] = None,
+                                       block_size: int = 10_000,
+                                       dtype=np.float32) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """All-vs-all version of :func:`cosine_similarity_sparse`, computing only upper-triangle
+    blocks and mirroring the kept entries.
+
+    Parameters
+    ----------
+    vectors
+        Numpy array of vectors.
+    score_threshold
+        Only scores >= score_threshold are kept. Default is None (keep all scores).
+    max_per_row
+        If given, only the max_per_row highest scores of every row are kept.
+        Default is None.
+    block_size
+        Maximum number of vectors per row and column block (see
+        :func:`symmetric_block_size`). Default is 10000.
+    dtype
+        Data type used for the computation. Default is np.float32.
+
+    Returns
+    -------
+    row, col, scores
+        Arrays with the row indices, column indices and scores of all kept entries
+        (sorted by row and column).
+    """
+    n_vectors = vectors.shape[0]
+    block_size = symmetric_block_size(n_vectors, block_size)
+    vectors, inverse_norms = _prepare_vectors(vectors, dtype)
+    rows, cols, scores = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=dtype)]
+    buffer = np.empty(min(block_size, n_vectors) ** 2, dtype=dtype)
+    for i in range(0, n_vectors, block_size):
+        for j in range(i, n_vectors, block_size):
+            score_block = _cosine_similarity_tile(
+                vectors[i:i + block_size], inverse_norms[i:i + block_size],
+                vectors[j:j + block_size], inverse_norms[j:j + block_size],
+                _tile(buffer, min(block_size, n_vectors - i), min(block_size, n_vectors - j)))
+            row, col = select_entries(score_block, score_threshold)
+            upper = (col + j) >= (row + i)
+            row, col = row[upper] + i, col[upper] + j
+            rows.append(row)
+            cols.append(col)
+            scores.append(score_block[row - i, col - j])
+    return mirror_upper_triangle(np.concatenate(rows), np.concatenate(cols), np.concatenate(scores),
+                                 max_per_row)
+
+
+def mirror_upper_triangle(row: np.ndarray, col: np.ndarray, scores: np.ndarray,
+                          max_per_row: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Add mirrored (col, row) entries for all off-diagonal upper-triangle entries,
+    sort by row and column, and optionally keep only the max_per_row highest scores per row."""
+    off_diagonal = row != col
+    row, col = np.concatenate((row, col[off_diagonal])), np.concatenate((col, row[off_diagonal]))
+    scores = np.concatenate((scores, scores[off_diagonal]))
+    selected = np.lexsort((col, row))
+    if max_per_row is not None:
+        selected = selected[top_entries_per_row(row[selected], scores[selected], max_per_row)]
+    return row[selected], col[selected], scores[selected]
+
+
+def select_entries(scores: np.ndarray, score_threshold: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Return row and column indices of all scores >= score_threshold (or all entries
+    if score_threshold is None)."""
+    if score_threshold is None:
+        row, col = np.indices(scores.shape)
+        return row.ravel(), col.ravel()
+    return np.nonzero(scores >= score_threshold)
+
+
+def top_entries_per_row(row: np.ndarray, scores: np.ndarray, max_per_row: int) -> np.ndarray:
+    """Return (sorted) positions of the max_per_row highest scores for every row index."""
+    order = np.lexsort((-scores, row))
+    sorted_rows = row[order]
+    row_starts = np.searchsorted(sorted_rows, sorted_rows, side="left")
+    rank_in_row = np.arange(len(sorted_rows)) - row_starts
+    return np.sort(order[rank_in_row < max_per_row])
+
+
+def normalize_vectors(vectors: np.ndarray, dtype=np.float32) -> np.ndarray:
+    """Return copy of vectors (of given dtype) scaled to unit length. Vectors with
+    norm 0 remain all zeros."""
+    vectors = np.array(vectors, dtype=dtype)
+    norms = np.sqrt(np.sum(vectors**2, axis=1))
+    norms[norms == 0] = 1
+    vectors /= norms[:, np.newaxis]
+    return vectors
+
+
+def pairs_from_embeddings(embeddings_1: np.ndarray, embeddings_2: np.ndarray,
+                          rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    """Cosine similarities for selected pairs (embeddings_1[rows[i]], embeddings_2[cols[i]]).
+
+    For example:
+
+    .. code-block:: python
+
+        from ms2deepscore.vector_operations import pairs_from_embeddings
+
+        scores = pairs_from_embeddings(reference_vectors, query_vectors,
+                                       rows=np.array([0, 5]), cols=np.array([3, 3]))
+
+    Parameters
+    ----------
+    embeddings_1
+        Numpy array of vectors (n_vectors_1, vector dimension).
+    embeddings_2
+        Numpy array of vectors (n_vectors_2, vector dimension).
+    rows
+        Indices into embeddings_1.
+    cols
+        Indices into embeddings_2 (same length as rows).
+
+    Returns
+    -------
+    Array with one cosine score per pair (0 for vectors with norm 0).
+    """
+    assert embeddings_1.shape[1] == embeddings_2.shape[1], "Input vectors must have same shape."
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    assert rows.shape == cols.shape, "Expected rows and cols of same shape."
+    embeddings_1 = np.asarray(embeddings_1, dtype=np.float32)
+    embeddings_2 = np.asarray(embeddings_2, dtype=np.float32)
+    return _gathered_cosine_similarity(embeddings_1, embeddings_2,
+                                       np.sqrt(np.sum(embeddings_1**2, axis=1)),
+                                       np.sqrt(np.sum(embeddings_2**2, axis=1)), rows, cols)
+
+
+@numba.njit(cache=True, parallel=True, fastmath=True)
+def _gathered_cosine_similarity(embeddings_1, embeddings_2, norms_1, norms_2, rows, cols):
+    scores = np.zeros(rows.shape[0], dtype=np.float32)
+    for i in numba.prange(rows.shape[0]):  # pylint: disable=not-an-iterable
+        norm = norms_1[rows[i]] * norms_2[cols[i]]
+        if norm == 0:
+            continue
+        dot_product = np.float32(0)
+        for d in range(embeddings_1.shape[1]):
+            dot_product += embeddings_1[rows[i], d] * embeddings_2[cols[i], d]
+        scores[i] = dot_product / norm
+    return scores
+
+
+def quantize_vectors(vectors: np.ndarray, dtype=np.int8) -> Tuple[np.ndarray, np.ndarray]:
+    """Normalize vectors and store them with reduced precision.
+
+    For np.float16, vectors are normalized and cast. For np.int8, every normalized vector
+    is scaled individually such that its largest absolute entry maps to 127, and the
+    scales are returned to map the int8 values back (vector ~ quantized * scale).
+
+    Parameters
+    ----------
+    vectors
+        Numpy array of vectors (n_vectors, vector dimension).
+    dtype
+        np.int8 or np.float16. Default is np.int8.
+
+    Returns
+    -------
+    quantized, scales
+        Quantized vectors and the per-vector scales (all ones for np.float16).
+    """
+    dtype = np.dtype(dtype)
+    assert dtype in (np.int8, np.float16), "Expected dtype np.int8 or np.float16."
+    vectors = normalize_vectors(vectors, np.float32)
+    if dtype == np.float16:
+        return vectors.astype(np.float16), np.ones(vectors.shape[0], dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1, initial=0) / 127
+    quantized = np.rint(vectors / np.where(scales == 0, 1, scales)[:, np.newaxis]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+# Number of reference vectors per tile of the quantized dot product kernels (compile-time constant)
+_QUANTIZED_TILE_SIZE = 32
+
+
+@numba.njit(cache=True, parallel=True, fastmath=True)
+def int8_dot_product_matrix(vectors_1: np.ndarray, vectors_2: np.ndarray) -> np.ndarray:
+    """Dot products between all int8 vectors_1 and vectors_2 (accumulated in int32).
+
+    vectors_2 is processed in small transposed tiles, so that the products with blocks of
+    4 vectors_1 are accumulated contiguously over the tile (which vectorizes well).
+    """
+    # pylint: disable=too-many-locals
+    assert vectors_1.shape[1] == vectors_2.shape[1], "Input vectors must have same shape."
+    n_vectors_1, n_vectors_2, dim = vectors_1.shape[0], vectors_2.shape[0], vectors_1.shape[1]
+    dot_products = np.empty((n_vectors_1, n_vectors_2), dtype=np.int32)
+    n_tiles = (n_vectors_2 + _QUANTIZED_TILE_SIZE - 1) // _QUANTIZED_TILE_SIZE
+    for tile in numba.prange(n_tiles):  # pylint: disable=not-an-iterable
+        start = tile * _QUANTIZED_TILE_SIZE
+        n_tile = min(_QUANTIZED_TILE_SIZE, n_vectors_2 - start)
+        tile_vectors = np.zeros((dim, _QUANTIZED_TILE_SIZE), dtype=np.int32)
+        for j in range(n_tile):
+            for d in range(dim):
+                tile_vectors[d, j] = vectors_2[start + j, d]
+        sums = np.empty((4, _QUANTIZED_TILE_SIZE), dtype=np.int32)
+        for i in range(0, n_vectors_1, 4):
+            n_rows = min(4, n_vectors_1 - i)
+            sums[:] = 0
+            for d in range(dim):
+                # Missing rows of the last block repeat row i (and are not written)
+                value_0 = np.int32(vectors_1[i, d])
+                value_1 = np.int32(vectors_1[i + 1 if n_rows > 1 else i, d])
+                value_2 = np.int32(vectors_1[i + 2 if n_rows > 2 else i, d])
+                value_3 = np.int32(vectors_1[i + 3 if n_rows > 3 else i, d])
+                for j in range(_QUANTIZED_TILE_SIZE):
+                    # Cast back to int32 to keep numba from accumulating in int64
+                    sums[0, j] = np.int32(sums[0, j] + value_0 * tile_vectors[d, j])
+                    sums[1, j] = np.int32(sums[1, j] + value_1 * tile_vectors[d, j])
+                    sums[2, j] = np.int32(sums[2, j] + value_2 * tile_vectors[d, j])
+                    sums[3, j] = np.int32(sums[3, j] + value_3 * tile_vectors[d, j])
+            for row in range(n_rows):
+                for j in range(n_tile):
+                    dot_products[i + row, start + j] = sums[row, j]
+    return dot_products
+
+
+def float16_dot_product_matrix(vectors_1: np.ndarray, vectors_2: np.ndarray) -> np.ndarray:
+    """Dot products (float32) between all vectors_1 and all float16 vectors_2.
+
+    vectors_2 is converted to float32 tile by tile (instead of creating a float32 copy
+    of all vectors_2). Infinite and NaN values are not supported.
+    """
+    assert vectors_2.dtype == np.float16, "Expected float16 vectors_2."
+    return _float16_dot_product_matrix(np.ascontiguousarray(vectors_1, dtype=np.float32),
+                                       vectors_2.view(np.uint16))
+
+
+@numba.njit(cache=True, parallel=True, fastmath=True)
+def _float16_dot_product_matrix(vectors_1, bits_2):
+    # numba does not support float16, so vectors_2 are passed (and converted) as raw bits.
+    # pylint: disable=too-many-locals
+    assert vectors_1.shape[1] == bits_2.shape[1], "Input vectors must have same shape."
+    n_vectors_1, n_vectors_2, dim = vectors_1.shape[0], bits_2.shape[0], vectors_1.shape[1]
+    dot_products = np.empty((n_vectors_1, n_vectors_2), dtype=np.float32)
+    n_tiles = (n_vectors_2 + _QUANTIZED_TILE_SIZE - 1) // _QUANTIZED_TILE_SIZE
+    for tile in numba.prange(n_tiles):  # pylint: disable=not-an-iterable
+        start = tile * _QUANTIZED_TILE_SIZE
+        n_tile = min(_QUANTIZED_TILE_SIZE, n_vectors_2 - start)
+        tile_bits = np.zeros((dim, _QUANTIZED_TILE_SIZE), dtype=np.uint32)
+        for j in range(n_tile):
+            for d in range(dim):
+                # Move sign, exponent and mantissa to their float32 positions; multiplying
+                # by 2**112 then corrects the exponent bias (also for subnormal numbers).
+                half = np.uint32(bits_2[start + j, d])
+                tile_bits[d, j] = ((half & np.uint32(0x8000)) << np.uint32(16)) \
+                    | ((half & np.uint32(0x7fff)) << np.uint32(13))
+        tile_vectors = tile_bits.view(np.float32) * np.float32(2.0 ** 112)
+        sums = np.empty((4, _QUANTIZED_TILE_SIZE), dtype=np.float32)
+        for i in range(0, n_vectors_1, 4):
+            n_rows = min(4, n_vectors_1 - i)
+            sums[:] = 0
+            for d in range(dim):
+                value_0 = vectors_1[i, d]
+                value_1 = vectors_1[i + 1 if n_rows > 1 else i, d]
+                value_2 = vectors_1[i + 2 if n_rows > 2 else i, d]
+                value_3 = vectors_1[i + 3 if n_rows > 3 else i, d]
+                for j in range(_QUANTIZED_TILE_SIZE):
+                    sums[0, j] += value_0 * tile_vectors[d, j]
+                    sums[1, j] += value_1 * tile_vectors[d, j]
+                    sums[2, j] += value_2 * tile_vectors[d, j]
+                    sums[3, j] += value_3 * tile_vectors[d, j]
+            for row in range(n_rows):
+                for j in range(n_tile):
+                    dot_products[i + row, start + j] = sums[row, j]
+    return dot_products
+
+
+@numba.njit(cache=True)
 def cosine_similarity(vector1: np.ndarray, vector2: np.ndarray) -> np.float64:
     """Calculate cosine similarity between two input vectors.
 
@@ -86,59 +726,358 @@ def cosine_similarity(vector1: np.ndarray, vector2: np.ndarray) -> np.float64:
     return np.float64(cosine_score)
 
 
-@numba.njit(fastmath=True)
+def ensemble_cosine_similarity_pooled(vectors_1: np.ndarray, vectors_2: np.ndarray,
+                                      n_ensembles: int, use_median: bool = True,
+                                      block_size: int = 100,
+                                      out: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+                                      dtype=np.float32) -> Tuple[np.ndarray, np.ndarray]:
+    """Pooled cosine similarities between ensembles of vectors, computed tile by tile.
+
+    Every spectrum is represented by n_ensembles consecutive vectors. For each tile of
+    block_size x block_size spectra, the ensemble scores are computed and directly
+    pooled (see :func:`ensemble_pooling`), so that only one tile of
+    (block_size * n_ensembles)^2 ensemble scores exists at any time instead of the full
+    (n_1 * n_ensembles) x (n_2 * n_ensembles) matrix.
+
+    Parameters
+    ----------
+    vectors_1
+        Ensemble vectors (n_1 * n_ensembles, vector dimension).
+    vectors_2
+        Ensemble vectors (n_2 * n_ensembles, vector dimension).
+    n_ensembles
+        Number of ensemble vectors per spectrum.
+    use_median
+        If True, return median and IQR, otherwise mean and standard deviation. Default is True.
+    block_size
+        Number of spectra per tile. Default is 100.
+    out
+        Optional tuple of two preallocated arrays (n_1, n_2) to write average scores and
+        uncertainties into. Default is None.
+    dtype
+        Data type used for the cosine similarities. Default is np.float32.
+
+    Returns
+    -------
+    average_scores, uncertainties
+        Arrays of shape (n_1, n_2).
+    """
+    # pylint: disable=too-many-arguments
+    assert vectors_1.shape[1] == vectors_2.shape[1], "Input vectors must have same shape."
+    n_ens = n_ensembles
+    n_1 = vectors_1.shape[0] // n_ens
+    n_2 = vectors_2.shape[0] // n_ens
+    if out is None:
+        out = (np.empty((n_1, n_2)), np.empty((n_1, n_2)))
+    average_scores, uncertainties = out
+    assert average_scores.shape == uncertainties.shape == (n_1, n_2), "Expected output arrays of shape (n_1, n_2)."
+    vectors_1, inverse_norms_1 = _prepare_vectors(vectors_1, dtype)
+    vectors_2, inverse_norms_2 = _prepare_vectors(vectors_2, dtype)
+    buffer = np.empty(min(block_size, n_1) * min(block_size, n_2) * n_ens ** 2, dtype=dtype)
+    for i in range(0, n_1, block_size):
+        rows_1 = slice(i * n_ens, (i + block_size) * n_ens)
+        for j in range(0, n_2, block_size):
+            rows_2 = slice(j * n_ens, (j + block_size) * n_ens)
+            tile_scores = _cosine_similarity_tile(
+                vectors_1[rows_1], inverse_norms_1[rows_1], vectors_2[rows_2], inverse_norms_2[rows_2],
+                _tile(buffer, vectors_1[rows_1].shape[0], vectors_2[rows_2].shape[0]))
+            average_scores[i:i + block_size, j:j + block_size], uncertainties[i:i + block_size, j:j + block_size] = \
+                ensemble_pooling(tile_scores, n_ens, use_median)
+    return average_scores, uncertainties
+
+
+def adaptive_ensemble_cosine_similarity_pooled(vectors_1: np.ndarray, vectors_2: np.ndarray,
+                                               n_ensembles: int, tolerance: float,
+                                               min_ensembles: int = 2, use_median: bool = True,
+                                               block_size: int = 100,
+                                               out: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+                                               dtype=np.float32) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Pooled cosine similarities between ensembles of vectors, using only as many
+    ensemble members per pair as needed.
+
+    All pairs are first scored with the first min_ensembles ensemble vectors of both
+    spectra. The ensemble size is then doubled (up to n_ensembles) only for the pairs
+    whose estimated standard error of the pooled score is still above `tolerance`.
+    The standard error is estimated from the current uncertainty as std / sqrt(n)
+    (mean pooling) or 1.2533 * IQR / 1.349 / sqrt(n) (median pooling), with n the current
+    ensemble size. Pairs with a small spread, which are most (dissimilar) library pairs,
+    are thereby scored with min_ensembles^2 instead of n_ensembles^2 ensemble scores.
+
+    Parameters
+    ----------
+    vectors_1
+        Ensemble vectors (n_1 * n_ensembles, vector dimension).
+    vectors_2
+        Ensemble vectors (n_2 * n_ensembles, vector dimension).
+    n_ensembles
+        Number of ensemble vectors per spectrum (maximum ensemble size).
+    tolerance
+        Pairs are considered converged once the estimated standard error of their
+        pooled score is <= tolerance.
+    min_ensembles
+        Ensemble size used for all pairs in the first pass. Default is 2.
+    use_median
+        If True, return median and IQR, otherwise mean and standard deviation. Default is True.
+    block_size
+        Number of spectra per tile in the first pass. Default is 100.
+    out
+        Optional tuple of two preallocated arrays (n_1, n_2) to write average scores and
+        uncertainties into. Default is None.
+    dtype
+        Data type used for the cosine similarities. Default is np.float32.
+
+    Returns
+    -------
+    average_scores, uncertainties, ensemble_sizes
+        Arrays of shape (n_1, n_2), ensemble_sizes holds the ensemble size used per pair.
+    """
+    # pylint: disable=too-many-arguments, too-many-locals
+    assert 1 <= min_ensembles <= n_ensembles, "Expected 1 <= min_ensembles <= n_ensembles."
+    dim = vectors_1.shape[1]
+    vectors_1 = normalize_vectors(vectors_1, dtype)
+    vectors_2 = normalize_vectors(vectors_2, dtype)
+    n_used = min_ensembles
+    average_scores, uncertainties = ensemble_cosine_similarity_pooled(
+        vectors_1.reshape(-1, n_ensembles, dim)[:, :n_used].reshape(-1, dim),
+        vectors_2.reshape(-1, n_ensembles, dim)[:, :n_used].reshape(-1, dim),
+        n_used, use_median, block_size, out, dtype)
+    ensemble_sizes = np.full(average_scores.shape, n_used, dtype=np.int32)
+    rows, cols = np.nonzero(_standard_error(uncertainties, n_used, use_median) > tolerance)
+    while n_used < n_ensembles and rows.shape[0] > 0:
+        n_used = min(2 * n_used, n_ensembles)
+        pair_scores, pair_uncertainties = _ensemble_pairs_pooling(vectors_1, vectors_2, rows, cols,
+                                                                  n_ensembles, n_used, use_median)
+        average_scores[rows, cols] = pair_scores
+        uncertainties[rows, cols] = pair_uncertainties
+        ensemble_sizes[rows, cols] = n_used
+        unconverged = _standard_error(pair_uncertainties, n_used, use_median) > tolerance
+        rows, cols = rows[unconverged], cols[unconverged]
+    return average_scores, uncertainties, ensemble_sizes
+
+
+def ensemble_cosine_similarity_pairs(vectors_1: np.ndarray, vectors_2: np.ndarray,
+                                     rows: np.ndarray, cols: np.ndarray, n_ensembles: int,
+                                     use_median: bool = True,
+                                     dtype=np.float32) -> Tuple[np.ndarray, np.ndarray]:
+    """Pooled cosine similarities between ensembles of vectors for selected pairs of
+    spectra (rows[i], cols[i]) only.
+
+    Parameters
+    ----------
+    vectors_1
+        Ensemble vectors (n_1 * n_ensembles, vector dimension).
+    vectors_2
+        Ensemble vectors (n_2 * n_ensembles, vector dimension).
+    rows
+        Spectrum indices into vectors_1.
+    cols
+        Spectrum indices into vectors_2 (same length as rows).
+    n_ensembles
+        Number of ensemble vectors per spectrum.
+    use_median
+        If True, return median and IQR, otherwise mean and standard deviation. Default is True.
+    dtype
+        Data type used for the cosine similarities. Default is np.float32.
+
+    Returns
+    -------
+    average_scores, uncertainties
+        Arrays with one value per pair.
+    """
+    # pylint: disable=too-many-arguments
+    assert vectors_1.shape[1] == vectors_2.shape[1], "Input vectors must have same shape."
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    assert rows.shape == cols.shape, "Expected rows and cols of same shape."
+    return _ensemble_pairs_pooling(normalize_vectors(vectors_1, dtype), normalize_vectors(vectors_2, dtype),
+                                   rows, cols, n_ensembles, n_ensembles, use_median)
+
+
+def _standard_error(uncertainties: np.ndarray, n_used: int, use_median: bool) -> np.ndarray:
+    """Approximate standard error of the pooled score (mean or median)."""
+    if use_median:
+        return 1.2533 * uncertainties / 1.349 / np.sqrt(n_used)
+    return uncertainties / np.sqrt(n_used)
+
+
+@numba.njit(cache=True, parallel=True, fastmath=True)
+def _ensemble_pairs_pooling(vectors_1, vectors_2, rows, cols, n_ensembles, n_used, use_median):
+    """Pooled scores of the first n_used (normalized) ensemble vectors of selected pairs."""
+    average_scores = np.zeros(rows.shape[0])
+    uncertainties = np.zeros(rows.shape[0])
+    for p in numba.prange(rows.shape[0]):  # pylint: disable=not-an-iterable
+        buffer = np.empty(n_used * n_used)
+        position = 0
+        for member_1 in range(rows[p] * n_ensembles, rows[p] * n_ensembles + n_used):
+            for member_2 in range(cols[p] * n_ensembles, cols[p] * n_ensembles + n_used):
+                dot_product = 0.0
+                for d in range(vectors_1.shape[1]):
+                    dot_product += vectors_1[member_1, d] * vectors_2[member_2, d]
+                buffer[position] = dot_product
+                position += 1
+        if use_median:
+            average_scores[p] = _quantile(buffer, 0.5)
+            uncertainties[p] = _quantile(buffer, 0.75) - _quantile(buffer, 0.25)
+        else:
+            average_scores[p] = np.mean(buffer)
+            uncertainties[p] = np.sqrt(np.mean((buffer - average_scores[p]) ** 2))
+    return average_scores, uncertainties
+
+
+@numba.njit(cache=True, parallel=True, fastmath=True)
 def mean_pooling(scores_ensemble: np.ndarray, n_ensembles: int) -> np.ndarray:
     """Do mean pooling on an ensemble of scores."""
     dim_0 = int(scores_ensemble.shape[0]/n_ensembles)
     dim_1 = int(scores_ensemble.shape[1]/n_ensembles)
     scores_pooled = np.zeros((dim_0, dim_1))
 
-    for i in range(dim_0):
+    for i in numba.prange(dim_0):  # pylint: disable=not-an-iterable
         for j in range(dim_1):
-            scores_pooled[i, j] = np.mean(scores_ensemble[i*n_ensembles:(i+1)*n_ensembles,
-                                                          j*n_ensembles:(j+1)*n_ensembles])
+            scores_pooled[i, j] = _block_mean(scores_ensemble, i, j, n_ensembles)
     return scores_pooled
 
 
-@numba.njit(fastmath=True)
+@numba.njit(cache=True, parallel=True, fastmath=True)
 def median_pooling(scores_ensemble: np.ndarray, n_ensembles: int) -> np.ndarray:
     """Do median pooling on an ensemble of scores."""
     dim_0 = int(scores_ensemble.shape[0]/n_ensembles)
     dim_1 = int(scores_ensemble.shape[1]/n_ensembles)
     scores_pooled = np.zeros((dim_0, dim_1))
 
-    for i in range(dim_0):
+    for i in numba.prange(dim_0):  # pylint: disable=not-an-iterable
+        buffer = np.empty(n_ensembles * n_ensembles)
         for j in range(dim_1):
-            scores_pooled[i, j] = np.median(scores_ensemble[i*n_ensembles:(i+1)*n_ensembles,
-                                                            j*n_ensembles:(j+1)*n_ensembles])
+            _copy_block(scores_ensemble, i, j, n_ensembles, buffer)
+            scores_pooled[i, j] = _quantile(buffer, 0.5)
     return scores_pooled
 
 
-@numba.njit(fastmath=True)
+@numba.njit(cache=True, parallel=True, fastmath=True)
 def std_pooling(scores_ensemble: np.ndarray, n_ensembles: int) -> np.ndarray:
     """Do standard deviation pooling on an ensemble of scores."""
     dim_0 = int(scores_ensemble.shape[0]/n_ensembles)
     dim_1 = int(scores_ensemble.shape[1]/n_ensembles)
     scores_pooled = np.zeros((dim_0, dim_1))
 
-    for i in range(dim_0):
+    for i in numba.prange(dim_0):  # pylint: disable=not-an-iterable
         for j in range(dim_1):
-            scores_pooled[i, j] = np.std(scores_ensemble[i*n_ensembles:(i+1)*n_ensembles,
-                                                         j*n_ensembles:(j+1)*n_ensembles])
+            mean = _block_mean(scores_ensemble, i, j, n_ensembles)
+            scores_pooled[i, j] = _block_std(scores_ensemble, i, j, n_ensembles, mean)
     return scores_pooled
 
 
-@numba.njit(fastmath=True)
+@numba.njit(cache=True, parallel=True, fastmath=True)
 def iqr_pooling(scores_ensemble: np.ndarray, n_ensembles: int) -> np.ndarray:
     """Do interquartile range (IQR) pooling on an ensemble of scores."""
     dim_0 = int(scores_ensemble.shape[0]/n_ensembles)
     dim_1 = int(scores_ensemble.shape[1]/n_ensembles)
     scores_pooled = np.zeros((dim_0, dim_1))
 
-    for i in range(dim_0):
+    for i in numba.prange(dim_0):  # pylint: disable=not-an-iterable
+        buffer = np.empty(n_ensembles * n_ensembles)
         for j in range(dim_1):
-            q75, q25 = np.percentile(scores_ensemble[i*n_ensembles:(i+1)*n_ensembles,
-                                                     j*n_ensembles:(j+1)*n_ensembles],
-                                     [75 ,25])
-            scores_pooled[i, j] = q75 - q25
+            _copy_block(scores_ensemble, i, j, n_ensembles, buffer)
+            scores_pooled[i, j] = _quantile(buffer, 0.75) - _quantile(buffer, 0.25)
     return scores_pooled
+
+
+@numba.njit(cache=True, parallel=True, fastmath=True)
+def ensemble_pooling(scores_ensemble: np.ndarray, n_ensembles: int,
+                     use_median: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """Pool an ensemble of scores into average scores and uncertainties in one pass.
+
+    Parameters
+    ----------
+    scores_ensemble
+        Scores between all ensemble embeddings, every (n_ensembles x n_ensembles) block
+        belongs to one pair of spectra.
+    n_ensembles
+        Number of ensemble embeddings per spectrum.
+    use_median
+        If True, return median and interquartile range (IQR), otherwise return mean
+        and standard deviation. Default is True.
+    """
+    dim_0 = int(scores_ensemble.shape[0]/n_ensembles)
+    dim_1 = int(scores_ensemble.shape[1]/n_ensembles)
+    average_scores = np.zeros((dim_0, dim_1))
+    uncertainties = np.zeros((dim_0, dim_1))
+
+    for i in numba.prange(dim_0):  # pylint: disable=not-an-iterable
+        buffer = np.empty(n_ensembles * n_ensembles)
+        for j in range(dim_1):
+            if use_median:
+                _copy_block(scores_ensemble, i, j, n_ensembles, buffer)
+                average_scores[i, j] = _quantile(buffer, 0.5)
+                uncertainties[i, j] = _quantile(buffer, 0.75) - _quantile(buffer, 0.25)
+            else:
+                average_scores[i, j] = _block_mean(scores_ensemble, i, j, n_ensembles)
+                uncertainties[i, j] = _block_std(scores_ensemble, i, j, n_ensembles, average_scores[i, j])
+    return average_scores, uncertainties
+
+
+@numba.njit(cache=True, fastmath=True)
+def _block_mean(scores_ensemble, i, j, n_ensembles):
+    total = 0.0
+    for row in range(i * n_ensembles, (i + 1) * n_ensembles):
+        for column in range(j * n_ensembles, (j + 1) * n_ensembles):
+            total += scores_ensemble[row, column]
+    return total / (n_ensembles * n_ensembles)
+
+
+@numba.njit(cache=True, fastmath=True)
+def _block_std(scores_ensemble, i, j, n_ensembles, mean):
+    total = 0.0
+    for row in range(i * n_ensembles, (i + 1) * n_ensembles):
+        for column in range(j * n_ensembles, (j + 1) * n_ensembles):
+            total += (scores_ensemble[row, column] - mean) ** 2
+    return np.sqrt(total / (n_ensembles * n_ensembles))
+
+
+@numba.njit(cache=True)
+def _copy_block(scores_ensemble, i, j, n_ensembles, buffer):
+    """Copy block (i, j) of the ensemble scores into the (reused) buffer."""
+    position = 0
+    for row in range(i * n_ensembles, (i + 1) * n_ensembles):
+        for column in range(j * n_ensembles, (j + 1) * n_ensembles):
+            buffer[position] = scores_ensemble[row, column]
+            position += 1
+
+
+@numba.njit(cache=True)
+def _select(values, k):
+    """Partially reorder values in place (quickselect), so that values[k] is the
+    k-th smallest value, with smaller values before and larger values after it."""
+    low, high = 0, values.shape[0] - 1
+    while low < high:
+        pivot = values[(low + high) // 2]
+        i, j = low, high
+        while i <= j:
+            while values[i] < pivot:
+                i += 1
+            while values[j] > pivot:
+                j -= 1
+            if i <= j:
+                values[i], values[j] = values[j], values[i]
+                i += 1
+                j -= 1
+        if k <= j:
+            high = j
+        elif k >= i:
+            low = i
+        else:
+            break
+    return values[k]
+
+
+@numba.njit(cache=True)
+def _quantile(values, q):
+    """Quantile with linear interpolation (as np.percentile) using selection
+    instead of sorting. Reorders values in place."""
+    position = q * (values.shape[0] - 1)
+    k = int(np.floor(position))
+    lower = _select(values, k)
+    fraction = position - k
+    if fraction == 0:
+        return lower
+    upper = np.min(values[k + 1:])
+    return lower + fraction * (upper - lower)
@@ -0,0 +1,76 @@
+from pathlib import Path
+import numpy as np
+from matchms import Spectrum
+from ms2deepscore import EmbeddingCache, MS2DeepScore
+from ms2deepscore.EmbeddingCache import spectrum_embedding_key
+from ms2deepscore.models import load_model
+from tests.test_user_worfklow import load_processed_spectrums
+
+
+TEST_RESOURCES_PATH = Path(__file__).parent / 'resources'
+
+
+def test_embedding_cache_lru_eviction_by_entries():
+    cache = EmbeddingCache(max_entries=2)
+    cache.put("a", np.zeros(3))
+    cache.put("b", np.ones(3))
+    assert cache.get("a") is not None  # "a" is now most recently used
+    cache.put("c", np.ones(3))
+    assert "b" not in cache, "Expected least recently used entry to be evicted"
+    assert "a" in cache and "c" in cache
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (1, 1), "Expected different hit/miss counts"
+
+
+def test_embedding_cache_lru_eviction_by_bytes():
+    cache = EmbeddingCache(max_bytes=2 * 8 * 10)
+    for key in ["a", "b", "c"]:
+        cache.put(key, np.zeros(10, dtype=np.float64))
+    assert len(cache) == 2, "Expected one entry to be evicted"
+    assert cache.nbytes == 160, "Expected different cache size"
+    assert "a" not in cache
+
+
+def test_embedding_cache_disk_tier(tmp_path):
+    cache = EmbeddingCache(max_entries=1, cache_directory=tmp_path / "cache")
+    cache.put("a", np.arange(3.0))
+    cache.put("b", np.ones(3))
+    assert "a" not in cache, "Expected entry to be evicted from memory"
+    assert np.array_equal(cache.get("a"), np.arange(3.0)), "Expected entry to be loaded from disk"
+    assert cache.hits == 1
+
+    new_cache = EmbeddingCache(cache_directory=tmp_path / "cache")
+    assert np.array_equal(new_cache.get("b"), np.ones(3)), "Expected entry to persist on disk"
+
+
+def test_spectrum_embedding_key():
+    spectrum = Spectrum(mz=np.array([100.0, 200.0]), intensities=np.array([0.5, 1.0]),
+                        metadata={"precursor_mz": 300.0, "compound_name": "A"})
+    other_spectrum = Spectrum(mz=np.array([100.0, 200.0]), intensities=np.array([0.5, 1.0]),
+                              metadata={"precursor_mz": 300.0, "compound_name": "B"})
+    key = spectrum_embedding_key(spectrum, "model_1", ["precursor_mz"])
+    assert key == spectrum_embedding_key(other_spectrum, "model_1", ["precursor_mz"]), \
+        "Expected unused metadata to be ignored"
+    assert key != spectrum_embedding_key(spectrum, "model_2", ["precursor_mz"]), \
+        "Expected different key for different model"
+    other_spectrum.set("precursor_mz", 301.0)
+    assert key != spectrum_embedding_key(other_spectrum, "model_1", ["precursor_mz"]), \
+        "Expected different key for different additional input"
+
+
+def test_ms2deepscore_with_embedding_cache():
+    spectrums = load_processed_spectrums()
+    model = load_model(TEST_RESOURCES_PATH / "testmodel.hdf5")
+    cache = EmbeddingCache(max_entries=100)
+    similarity_measure = MS2DeepScore(model, embedding_cache=cache)
+
+    embeddings = similarity_measure.calculate_vectors(spectrums[:5] + spectrums[:2])
+    assert (cache.hits, cache.misses) == (0, 5), "Expected only misses for new spectra"
+    assert len(cache) == 5
+    assert np.allclose(embeddings[5:], embeddings[:2]), "Expected duplicates to get the same embedding"
+
+    scores = similarity_measure.matrix(spectrums[:4], spectrums[:3])
+    assert cache.hits == 7, "Expected all spectra to be found in cache"
+    expected_scores = MS2DeepScore(model).matrix(spectrums[:4], spectrums[:3])
+    assert np.allclose(scores, expected_scores, atol=1e-6), "Expected same scores with cache"
+    assert np.allclose(similarity_measure.pair(spectrums[0], spectrums[1]), 0.92501721, atol=1e-6)
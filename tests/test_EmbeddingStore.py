@@ -0,0 +1,47 @@
+from pathlib import Path
+import numpy as np
+import pytest
+from ms2deepscore import EmbeddingStore, MS2DeepScore
+from ms2deepscore.models import load_model
+from tests.test_user_worfklow import load_processed_spectrums
+
+
+TEST_RESOURCES_PATH = Path(__file__).parent / 'resources'
+
+
+def test_embedding_store_write_and_read(tmp_path):
+    embeddings = np.random.default_rng(0).random((5, 3))
+    filename = tmp_path / "store.ms2ds"
+    EmbeddingStore.write(filename, embeddings, ["a", "b", "c", "d", "e"], "abc123")
+
+    store = EmbeddingStore(filename)
+    assert len(store) == 5
+    assert store.embeddings.dtype == np.float32, "Expected float32 embeddings by default"
+    assert np.allclose(store.embeddings, embeddings, atol=1e-7), "Expected different embeddings"
+    assert store.spectrum_ids == ["a", "b", "c", "d", "e"], "Expected different spectrum IDs"
+    assert store.model_fingerprint == "abc123", "Expected different model fingerprint"
+
+
+def test_embedding_store_wrong_number_of_ids(tmp_path):
+    with pytest.raises(AssertionError, match="Expected one spectrum ID per embedding."):
+        EmbeddingStore.write(tmp_path / "store.ms2ds", np.zeros((5, 3)), ["a"], "abc123")
+
+
+def test_embedding_store_in_ms2deepscore(tmp_path):
+    spectrums = load_processed_spectrums()
+    model = load_model(TEST_RESOURCES_PATH / "testmodel.hdf5")
+    similarity_measure = MS2DeepScore(model, progress_bar=False)
+
+    store = EmbeddingStore.from_spectrums(tmp_path / "library.ms2ds", similarity_measure,
+                                          spectrums[:10], chunk_size=3)
+    assert store.spectrum_ids[0] == spectrums[0].get("spectrum_id"), "Expected different spectrum ID"
+    assert np.allclose(store.embeddings, similarity_measure.calculate_vectors(spectrums[:10]), atol=1e-6)
+
+    scores_from_store = similarity_measure.matrix(store, spectrums[:3])
+    scores = similarity_measure.matrix(spectrums[:10], spectrums[:3])
+    assert np.allclose(scores_from_store, scores, atol=1e-6), "Expected same scores using the store"
+
+    other_store = EmbeddingStore.write(tmp_path / "other.ms2ds", store.embeddings,
+                                       store.spectrum_ids, "other_model")
+    with pytest.raises(AssertionError, match="different model"):
+        similarity_measure.matrix(other_store, spectrums[:3])
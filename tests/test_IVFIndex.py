@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from ms2deepscore import IVFIndex
+from ms2deepscore.benchmarks import benchmark_ivf_index
+from ms2deepscore.vector_operations import top_k_cosine_similarity
+
+
+def create_test_vectors(n_vectors, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.random((n_vectors, dim)) - 0.5
+
+
+def test_ivf_index_build():
+    vectors = create_test_vectors(200)
+    index = IVFIndex.build(vectors, n_clusters=10)
+    assert index.centroids.shape == (10, 16), "Expected different centroids shape"
+    assert index.cluster_offsets[-1] == 200, "Expected all vectors to be indexed"
+    assert np.array_equal(np.sort(index.vector_ids), np.arange(200)), "Expected every vector once"
+
+
+def test_ivf_index_query_all_clusters_is_exact():
+    vectors = create_test_vectors(200)
+    queries = create_test_vectors(7, seed=1)
+    index = IVFIndex.build(vectors, n_clusters=10)
+    indices, scores = index.query(queries, k=5, n_probe=10)
+    expected_indices, expected_scores = top_k_cosine_similarity(vectors, queries, 5)
+    assert np.array_equal(indices, expected_indices), "Expected exact result when probing all clusters"
+    assert np.allclose(scores, expected_scores, atol=1e-6), "Expected different scores"
+
+
+def test_ivf_index_query_fewer_candidates_than_k():
+    vectors = create_test_vectors(20)
+    index = IVFIndex.build(vectors, n_clusters=10)
+    indices, scores = index.query(vectors[:2], k=25, n_probe=1)
+    assert indices[0, 0] == 0 and indices[1, 0] == 1, "Expected vectors to find themselves first"
+    assert np.all(indices[:, -1] == -1), "Expected missing entries to be -1"
+    assert np.all(np.isinf(scores[:, -1])), "Expected missing scores to be -inf"
+
+
+def test_ivf_index_save_and_load(tmp_path):
+    vectors = create_test_vectors(100)
+    index = IVFIndex.build(vectors, n_clusters=5)
+    index.save(tmp_path / "index.npz")
+    loaded_index = IVFIndex.load(tmp_path / "index.npz")
+    assert np.array_equal(loaded_index.vectors, index.vectors), "Expected same vectors"
+    assert np.array_equal(loaded_index.query(vectors[:3], 4)[0], index.query(vectors[:3], 4)[0]), \
+        "Expected same query result"
+
+
+def test_ivf_index_too_many_clusters():
+    with pytest.raises(AssertionError, match="n_clusters"):
+        IVFIndex.build(create_test_vectors(5), n_clusters=10)
+
+
+def test_benchmark_ivf_index():
+    vectors = create_test_vectors(300)
+    queries = create_test_vectors(10, seed=1)
+    index = IVFIndex.build(vectors, n_clusters=10)
+    results = benchmark_ivf_index(index, vectors, queries, k=5, n_probes=(1, 10))
+    assert [r["n_probe"] for r in results] == [1, 10]
+    assert results[0]["recall"] <= results[1]["recall"] == 1.0, "Expected recall to grow to 1.0"
@@ -0,0 +1,116 @@
+from pathlib import Path
+import numpy as np
+import pytest
+from ms2deepscore import MS2DeepScore
+from ms2deepscore.models import (DenseEmbeddingNetwork, InferenceModel,
+                                 load_model)
+from ms2deepscore.utils import get_model_fingerprint
+from tests.test_user_worfklow import load_processed_spectrums
+
+
+TEST_RESOURCES_PATH = Path(__file__).parent / 'resources'
+
+
+def randomize_batch_normalization(keras_base):
+    """Set non-trivial BatchNormalization weights to make sure folding is tested."""
+    rng = np.random.default_rng(0)
+    for layer in keras_base.layers:
+        if type(layer).__name__ == "BatchNormalization":
+            gamma, beta, mean, variance = layer.get_weights()
+            layer.set_weights([rng.normal(1, 0.5, gamma.shape), rng.normal(0, 0.5, beta.shape),
+                               rng.normal(0, 0.5, mean.shape), rng.uniform(0.1, 2, variance.shape)])
+
+
+@pytest.mark.parametrize("model_file", ["testmodel.hdf5", "testmodel_additional_input.hdf5"])
+def test_dense_embedding_network_matches_keras(model_file):
+    model = load_model(TEST_RESOURCES_PATH / model_file)
+    randomize_batch_normalization(model.base)
+    network = DenseEmbeddingNetwork.from_keras(model.base)
+    assert network.input_shape == model.base.input_shape, "Expected same input shape as keras"
+    assert network.output_shape == model.base.output_shape, "Expected same output shape as keras"
+
+    rng = np.random.default_rng(1)
+    X = rng.random((25, network.input_dim)).astype(np.float32)
+    if network.nr_of_additional_inputs > 0:
+        X = [X, rng.random((25, network.nr_of_additional_inputs)).astype(np.float32)]
+    expected = model.base.predict(X, verbose=0)
+    embeddings = network.predict(X, batch_size=10)
+    assert embeddings.dtype == np.float32, "Expected float32 embeddings"
+    assert np.allclose(embeddings, expected, rtol=1e-4, atol=1e-5), "Expected same embeddings as keras"
+
+
+def test_dense_embedding_network_weights():
+    model = load_model(TEST_RESOURCES_PATH / "testmodel.hdf5")
+    network = DenseEmbeddingNetwork.from_keras(model.base)
+    assert network.dropout_rates == [0.2, 0.2, 0.2, 0.0]
+    for weights, expected_weights in zip(network.get_weights(), model.base.get_weights()):
+        assert np.array_equal(weights, expected_weights), "Expected same (unfolded) weights as keras"
+
+
+def test_inference_model_in_ms2deepscore():
+    spectrums = load_processed_spectrums()[:10]
+    model = load_model(TEST_RESOURCES_PATH / "testmodel.hdf5")
+    inference_model = InferenceModel.from_siamese_model(model)
+    assert get_model_fingerprint(inference_model) == get_model_fingerprint(model), \
+        "Expected same fingerprint as the SiameseModel"
+
+    scores = MS2DeepScore(inference_model, progress_bar=False).matrix(spectrums, spectrums)
+    expected_scores = MS2DeepScore(model, progress_bar=False).matrix(spectrums, spectrums)
+    assert np.allclose(scores, expected_scores, atol=1e-5), "Expected same scores as with keras model"
+
+
+@pytest.mark.parametrize("model_file", ["testmodel.hdf5", "testmodel_additional_input.hdf5"])
+def test_save_and_load_inference_model(tmp_path, model_file):
+    model = load_model(TEST_RESOURCES_PATH / model_file)
+    inference_model = InferenceModel.from_siamese_model(model)
+    filename = tmp_path / "model.npz"
+    inference_model.save(filename)
+
+    loaded_model = load_model(filename)
+    assert isinstance(loaded_model, InferenceModel), "Expected InferenceModel"
+    assert loaded_model.spectrum_binner.to_json() == model.spectrum_binner.to_json(), \
+        "Expected same spectrum binner"
+    assert loaded_model.base.dropout_rates == inference_model.base.dropout_rates
+    assert get_model_fingerprint(loaded_model) == get_model_fingerprint(model), "Expected same fingerprint"
+
+    spectrums = load_processed_spectrums()[:5]
+    assert np.allclose(MS2DeepScore(loaded_model, progress_bar=False).calculate_vectors(spectrums),
+                       MS2DeepScore(model, progress_bar=False).calculate_vectors(spectrums), atol=1e-5), \
+        "Expected same embeddings as with keras model"
+
+
+def test_predict_ensemble():
+    model = load_model(TEST_RESOURCES_PATH / "testmodel.hdf5")
+    network = DenseEmbeddingNetwork.from_keras(model.base)
+    masks = network.create_dropout_masks(n_ensembles=500, random_seed=0)
+    assert [mask is None for mask in masks] == [False, False, False, True]
+    assert np.all(np.isin(masks[0], [0, 1 / 0.8])), "Expected masks scaled by 1 / (1 - rate)"
+    assert np.isclose(np.mean(masks[0] > 0), 0.8, atol=0.01), "Expected about 80% kept units"
+    assert np.array_equal(masks[1], network.create_dropout_masks(500, random_seed=0)[1]), \
+        "Expected same masks for same seed"
+
+    X = np.random.default_rng(1).random((3, network.input_dim)).astype(np.float32)
+    ones = [None if mask is None else np.ones((2, mask.shape[1]), dtype=np.float32) for mask in masks]
+    assert np.allclose(network.predict_ensemble(X, ones), np.repeat(network.predict(X), 2, axis=0), atol=1e-5), \
+        "Expected deterministic embeddings without dropped units"
+    embeddings = network.predict_ensemble(X, masks, batch_size=2)
+    assert embeddings.shape == (1500, 200), "Expected n_ensembles consecutive embeddings per spectrum"
+    assert np.allclose(embeddings[500:1000], network.predict_ensemble(X[1:2], masks), atol=1e-6)
+
+
+def test_predict_ensemble_shared_first_layers():
+    model = load_model(TEST_RESOURCES_PATH / "testmodel.hdf5")
+    network = DenseEmbeddingNetwork.from_keras(model.base)
+    masks = network.create_dropout_masks(n_ensembles=3, random_seed=0)
+    X = np.random.default_rng(1).random((4, network.input_dim)).astype(np.float32)
+    masks_without_first = [None] + masks[1:]
+    embeddings = network.predict_ensemble(X, masks_without_first)
+    for i in range(4):
+        embeddings_member_0 = network.predict_ensemble(X[i:i + 1], [None] + [None if mask is None else mask[:1]
+                                                                            for mask in masks[1:]])
+        assert np.allclose(embeddings[i * 3], embeddings_member_0[0], atol=1e-6), \
+            "Expected same embedding for ensemble member computed alone"
+    no_dropout = [None] * len(masks)
+    no_dropout[2] = np.ones((3, masks[2].shape[1]), dtype=np.float32)
+    assert np.allclose(network.predict_ensemble(X, no_dropout), np.repeat(network.predict(X), 3, axis=0),
+                       atol=1e-5), "Expected deterministic embeddings when only the last mask keeps all units"
@@ -0,0 +1,68 @@
+import importlib
+import numpy as np
+import pytest
+from ms2deepscore import QuantizedEmbeddings
+from ms2deepscore.benchmarks import benchmark_quantized_search
+from ms2deepscore.vector_operations import top_k_cosine_similarity
+
+
+def create_test_vectors(n_vectors, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.random((n_vectors, dim))
+
+
+@pytest.mark.parametrize("dtype, expected_nbytes", [(np.int8, 500 * 32 + 500 * 4), (np.float16, 500 * 32 * 2 + 500 * 4)])
+def test_quantized_embeddings_from_embeddings(dtype, expected_nbytes):
+    quantized = QuantizedEmbeddings.from_embeddings(create_test_vectors(500), dtype=dtype, block_size=128)
+    assert quantized.vectors.dtype == dtype, "Expected different dtype"
+    assert len(quantized) == 500
+    assert quantized.nbytes == expected_nbytes, "Expected different memory size"
+
+
+@pytest.mark.parametrize("dtype", [np.int8, np.float16])
+def test_quantized_embeddings_search_with_exact_rerank(dtype):
+    vectors = create_test_vectors(500)
+    queries = create_test_vectors(10, seed=1)
+    quantized = QuantizedEmbeddings.from_embeddings(vectors, dtype=dtype)
+    indices, scores = quantized.search(queries, k=5, reference_vectors=vectors, n_candidates=50, block_size=128)
+    expected_indices, expected_scores = top_k_cosine_similarity(vectors, queries, 5)
+    assert np.array_equal(indices, expected_indices), "Expected same top-k as exact search"
+    assert np.allclose(scores, expected_scores, atol=1e-6), "Expected exact scores after re-ranking"
+
+
+def test_quantized_embeddings_approximate_scores():
+    vectors = create_test_vectors(100)
+    queries = create_test_vectors(3, seed=1)
+    quantized = QuantizedEmbeddings.from_embeddings(vectors, dtype=np.int8)
+    _, expected_scores = top_k_cosine_similarity(vectors, queries, 100)
+    _, scores = quantized.search(queries, k=100)
+    assert np.allclose(scores, expected_scores, atol=0.01), "Expected approximately the same scores"
+
+
+def test_quantized_embeddings_search_quantizes_queries_once(monkeypatch):
+    # The module is shadowed by the class of the same name in the ms2deepscore namespace
+    quantized_embeddings_module = importlib.import_module("ms2deepscore.QuantizedEmbeddings")
+    quantized = QuantizedEmbeddings.from_embeddings(create_test_vectors(500))
+    calls = []
+    quantize_vectors = quantized_embeddings_module.quantize_vectors
+    monkeypatch.setattr(quantized_embeddings_module, "quantize_vectors",
+                        lambda *args: calls.append(args) or quantize_vectors(*args))
+    quantized.search(create_test_vectors(10, seed=1), k=5, block_size=64)
+    assert len(calls) == 1, "Expected queries to be quantized once and not once per block"
+
+
+def test_benchmark_quantized_search():
+    vectors = create_test_vectors(300)
+    queries = create_test_vectors(10, seed=1)
+    results = benchmark_quantized_search(vectors, queries, k=5, n_candidates=50, n_repeats=1)
+    assert [r["dtype"] for r in results] == ["int8", "float16"]
+    assert all(r["recall"] == 1.0 for r in results), "Expected exact top-k after re-ranking"
+    assert all(r["speedup"] > 0 for r in results)
+
+
+def test_quantized_embeddings_save_and_load(tmp_path):
+    quantized = QuantizedEmbeddings.from_embeddings(create_test_vectors(50))
+    quantized.save(tmp_path / "quantized.npz")
+    loaded = QuantizedEmbeddings.load(tmp_path / "quantized.npz")
+    assert np.array_equal(loaded.vectors, quantized.vectors)
+    assert np.array_equal(loaded.scales, quantized.scales)
@@ -0,0 +1,75 @@
+import os
+from pathlib import Path
+import numpy as np
+import pytest
+from ms2deepscore import EmbeddingStore, MS2DeepScore
+from ms2deepscore import ScoringPool as scoring_pool
+from ms2deepscore.models import load_model
+from tests.test_user_worfklow import load_processed_spectrums
+
+
+TEST_RESOURCES_PATH = Path(__file__).parent / 'resources'
+
+
+def test_ms2deepscore_with_worker_processes(tmp_path):
+    """Test if sharded scoring in worker processes gives the same results as one process."""
+    spectrums = load_processed_spectrums()
+    model = load_model(TEST_RESOURCES_PATH / "testmodel.hdf5")
+    similarity_measure = MS2DeepScore(model, progress_bar=False)
+    parallel_similarity_measure = MS2DeepScore(model, progress_bar=False, n_jobs=2)
+    references, queries = spectrums[:20], spectrums[20:45]
+    try:
+        pool = parallel_similarity_measure.scoring_pool
+        assert np.allclose(pool.calculate_vectors(references, shard_size=7),
+                           similarity_measure.calculate_vectors(references), atol=1e-6), \
+            "Expected same embeddings"
+
+        expected_scores = similarity_measure.matrix(references, queries)
+        assert np.allclose(parallel_similarity_measure.matrix(references, queries), expected_scores, atol=1e-6), \
+            "Expected same dense scores"
+
+        out = np.memmap(tmp_path / "scores.dat", dtype=np.float32, mode="w+", shape=(20, 25))
+        scores = parallel_similarity_measure.matrix(references, queries, out=out)
+        assert scores is out
+        assert np.allclose(out, expected_scores, atol=1e-6), "Expected same scores in memmap"
+
+        # A slice of a memmap can't be written by the workers directly (wrong offset in the file)
+        large_out = np.memmap(tmp_path / "large_scores.dat", dtype=np.float32, mode="w+", shape=(25, 25))
+        scores = parallel_similarity_measure.matrix(references, queries, out=large_out[5:])
+        assert np.allclose(scores, expected_scores, atol=1e-6), "Expected same scores in memmap slice"
+        assert np.allclose(large_out[5:], expected_scores, atol=1e-6), "Expected scores written into the slice"
+        assert not large_out[:5].any(), "Expected rows outside the slice to be untouched"
+        store = pool.create_embedding_store(references, parallel_similarity_measure.model_fingerprint)
+        with pytest.raises(AssertionError, match="shape"):
+            pool.matrix(store, queries, out=np.zeros((25, 25)))
+        pool.release_embedding_store(store)
+
+        sparse_scores = parallel_similarity_measure.matrix(references, queries, array_type="sparse",
+                                                           score_threshold=0.8, max_per_row=3)
+        expected_sparse_scores = similarity_measure.matrix(references, queries, array_type="sparse",
+                                                           score_threshold=0.8, max_per_row=3)
+        assert np.array_equal(sparse_scores.row, expected_sparse_scores.row), "Expected same rows"
+        assert np.array_equal(sparse_scores.col, expected_sparse_scores.col), "Expected same columns"
+
+        indices, _ = parallel_similarity_measure.search(references, queries, k=3, block_size=4)
+        assert np.array_equal(indices, similarity_measure.search(references, queries, k=3)[0]), \
+            "Expected same top-k results"
+        assert np.allclose(parallel_similarity_measure.matrix(references, queries, block_size=4),
+                           expected_scores, atol=1e-6), "Expected same scores with small blocks"
+        assert not [f for f in os.listdir(pool.temp_dir) if f.startswith("references_")], \
+            "Expected temporary embedding stores to be deleted after scoring"
+    finally:
+        parallel_similarity_measure.close()
+    assert not os.path.exists(pool.temp_dir), "Expected temporary directory to be removed"
+
+
+def test_worker_drops_deleted_stores(tmp_path, monkeypatch):
+    """Test if workers evict stores from their cache once the store file was deleted."""
+    filenames = [str(tmp_path / f"references_{i}.ms2ds") for i in range(2)]
+    for filename in filenames:
+        EmbeddingStore.write(filename, np.random.random((5, 3)), [str(i) for i in range(5)], "fingerprint")
+    monkeypatch.setattr(scoring_pool, "_worker", {"stores": {}})
+    scoring_pool._get_reference_vectors(filenames[0])
+    os.remove(filenames[0])
+    assert scoring_pool._get_reference_vectors(filenames[1]).shape == (5, 3)
+    assert list(scoring_pool._worker["stores"]) == [filenames[1]], "Expected deleted store to be evicted"
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
+from ms2deepscore import BinnedSpectrum
+from ms2deepscore.input_matrices import (create_input_matrix,
+                                         create_metadata_matrix)
+
+
+def create_test_binned_spectrums():
+    return [BinnedSpectrum(binned_peaks={0: 0.5, 3: 1.0}, metadata={"inchikey": "A", "feature_a": 0.1}),
+            BinnedSpectrum(binned_peaks={}, metadata={"inchikey": "B", "feature_a": 0.2}),
+            BinnedSpectrum(binned_peaks={"4": 0.3, 1: 0.7}, metadata={"inchikey": "C", "feature_a": 0.3})]
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_create_input_matrix(sparse):
+    binned_spectrums = create_test_binned_spectrums()
+    X = create_input_matrix(binned_spectrums, 5, sparse=sparse)
+    expected_X = np.array([[0.5, 0, 0, 1.0, 0],
+                           [0, 0, 0, 0, 0],
+                           [0, 0.7, 0, 0, 0.3]], dtype=np.float32)
+    if sparse:
+        assert isinstance(X, csr_matrix), "Expected CSR matrix"
+        X = X.toarray()
+    assert X.dtype == np.float32, "Expected float32 input matrix"
+    assert np.array_equal(X, expected_X), "Expected different input matrix"
+
+
+def test_create_input_matrix_empty_list():
+    X = create_input_matrix([], 5)
+    assert X.shape == (0, 5), "Expected different shape"
+
+
+def test_create_metadata_matrix():
+    binned_spectrums = create_test_binned_spectrums()
+    metadata = create_metadata_matrix(binned_spectrums)
+    assert metadata.shape == (3, 1), "Expected different shape"
+    assert np.allclose(metadata[:, 0], [0.1, 0.2, 0.3]), "Expected different metadata values"
+    assert np.array_equal(create_metadata_matrix(binned_spectrums, feature_keys=["feature_a"]), metadata)
@@ -51,6 +51,55 @@ def test_MS2DeepScore_score_matrix():
     assert np.allclose(expected_scores, scores, atol=1e-6), "Expected different scores."
 
 
+def test_MS2DeepScore_score_matrix_into_memmap(tmp_path):
+    """Test score calculation using *.matrix* method writing into disk-backed array."""
+    spectrums, _, similarity_measure = get_test_ms2_deep_score_instance()
+    out = np.memmap(tmp_path / "scores.dat", dtype=np.float32, mode="w+", shape=(4, 3))
+    scores = similarity_measure.matrix(spectrums[:4], spectrums[:3], out=out, block_size=2)
+    expected_scores = similarity_measure.matrix(spectrums[:4], spectrums[:3])
+    assert scores is out, "Expected scores to be written into given array"
+    assert np.allclose(expected_scores, out, atol=1e-6), "Expected different scores."
+
+
+def test_MS2DeepScore_search():
+    """Test top-k search using *.search* method."""
+    spectrums, _, similarity_measure = get_test_ms2_deep_score_instance()
+    indices, scores = similarity_measure.search(spectrums[:4], spectrums[:3], k=2, block_size=3)
+    assert np.array_equal(indices, np.array([[0, 1], [1, 0], [2, 0]])), "Expected different top-k references"
+    assert np.allclose(scores, np.array([[1., 0.92501721], [1., 0.92501721], [1., 0.8663899]]), atol=1e-6), \
+        "Expected different scores."
+
+
+def test_MS2DeepScore_search_invalid_k():
+    spectrums, _, similarity_measure = get_test_ms2_deep_score_instance()
+    with pytest.raises(ValueError, match="Expected k >= 1"):
+        similarity_measure.search(spectrums[:4], spectrums[:3], k=0)
+
+
+def test_MS2DeepScore_score_matrix_sparse():
+    """Test sparse score calculation using *.matrix* method."""
+    spectrums, _, similarity_measure = get_test_ms2_deep_score_instance()
+    scores = similarity_measure.matrix(spectrums[:4], spectrums[:3], array_type="sparse",
+                                       score_threshold=0.9, block_size=2)
+    assert scores.shape == (4, 3, 1), "Expected different shape"
+    assert np.array_equal(scores.row, [0, 0, 1, 1, 2, 3]), "Expected different rows"
+    assert np.array_equal(scores.col, [0, 1, 0, 1, 2, 0]), "Expected different columns"
+    assert np.allclose(scores.to_array(), [[1., 0.92501721, 0.],
+                                           [0.92501721, 1., 0.],
+                                           [0., 0., 1.],
+                                           [0.91697757, 0., 0.]], atol=1e-6), "Expected different scores."
+
+    scores = similarity_measure.matrix(spectrums[:4], spectrums[:3], array_type="sparse",
+                                       score_threshold=0.9, max_per_row=1)
+    assert np.array_equal(scores.col, [0, 1, 2, 0]), "Expected only best score per row"
+
+
+def test_MS2DeepScore_score_matrix_wrong_array_type():
+    spectrums, _, similarity_measure = get_test_ms2_deep_score_instance()
+    with pytest.raises(ValueError, match="array_type must be 'numpy' or 'sparse'."):
+        similarity_measure.matrix(spectrums[:4], spectrums[:3], array_type="list")
+
+
 def test_MS2DeepScore_score_matrix_symmetric():
     """Test score calculation using *.matrix* method."""
     spectrums, _, similarity_measure = get_test_ms2_deep_score_instance()
@@ -62,6 +111,18 @@ def test_MS2DeepScore_score_matrix_symmetric():
     assert np.allclose(expected_scores, scores, atol=1e-6), "Expected different scores."
 
 
+def test_MS2DeepScore_score_matrix_symmetric_sparse():
+    """Test sparse all-vs-all score calculation using *.matrix* method."""
+    spectrums, _, similarity_measure = get_test_ms2_deep_score_instance()
+    scores = similarity_measure.matrix(spectrums[:4], spectrums[:4], array_type="sparse",
+                                       is_symmetric=True, score_threshold=0.9, block_size=3)
+    expected_scores = similarity_measure.matrix(spectrums[:4], spectrums[:4], array_type="sparse",
+                                                score_threshold=0.9)
+    assert np.array_equal(scores.row, expected_scores.row), "Expected different rows"
+    assert np.array_equal(scores.col, expected_scores.col), "Expected different columns"
+    assert np.allclose(scores.to_array(), expected_scores.to_array(), atol=1e-6), "Expected different scores"
+
+
 def test_MS2DeepScore_score_matrix_symmetric_wrong_use():
     """Test if *.matrix* method gives correct exception."""
     spectrums, _, similarity_measure = get_test_ms2_deep_score_instance()
@@ -96,3 +157,75 @@ def test_MS2DeepScore_score_additional_input_feature():
     assert isinstance(inputs[0], np.ndarray), "Expected vector to be numpy array"
     assert inputs[0][0, 92] == 0.0, "Expected different entries"
     assert similarity_measure.multi_inputs
+
+
+@pytest.mark.parametrize("model_file", ["testmodel.hdf5", "testmodel_additional_input.hdf5"])
+@pytest.mark.parametrize("batch_size", [1, 3, 100])
+def test_MS2DeepScore_calculate_vectors_batched(model_file, batch_size):
+    """Test if batched embedding gives the same vectors as embedding every spectrum separately."""
+    spectrums = load_processed_spectrums()[:7]
+    model = load_model(TEST_RESOURCES_PATH / model_file)
+    similarity_measure = MS2DeepScore(model, batch_size=batch_size)
+    embeddings = similarity_measure.calculate_vectors(spectrums)
+
+    binned_spectrums = model.spectrum_binner.transform(spectrums)
+    expected_embeddings = np.vstack([model.base.predict(similarity_measure._create_input_vector(s), verbose=0)
+                                     for s in binned_spectrums])
+    assert embeddings.shape == (7, similarity_measure.output_vector_dim), "Expected different shape"
+    assert np.allclose(embeddings, expected_embeddings, atol=1e-6), "Expected different embeddings"
+
+
+def test_MS2DeepScore_iter_vectors():
+    """Test if streamed embeddings of a generator equal embeddings of the full list."""
+    spectrums, _, similarity_measure = get_test_ms2_deep_score_instance()
+    spectrums = spectrums[:7]
+    chunks = list(similarity_measure.iter_vectors((s for s in spectrums), chunk_size=3))
+    assert [len(ids) for ids, _ in chunks] == [3, 3, 1], "Expected different chunks"
+    assert [ids for ids, _ in chunks][0] == [s.get("spectrum_id", str(i)) for i, s in enumerate(spectrums[:3])]
+    embeddings = np.vstack([embeddings for _, embeddings in chunks])
+    assert np.allclose(embeddings, similarity_measure.calculate_vectors(spectrums)), \
+        "Expected same embeddings as with calculate_vectors"
+    assert list(similarity_measure.iter_vectors([])) == [], "Expected no chunks for empty input"
+
+
+def test_MS2DeepScore_pairs():
+    spectrums, _, similarity_measure = get_test_ms2_deep_score_instance()
+    spectrum_pairs = [(spectrums[0], spectrums[1]), (spectrums[1], spectrums[0]), (spectrums[2], spectrums[0])]
+    scores = similarity_measure.pairs(spectrum_pairs)
+    expected_scores = [similarity_measure.pair(reference, query) for reference, query in spectrum_pairs]
+    assert np.allclose(scores, expected_scores, atol=1e-6), "Expected same scores as with pair()"
+    assert similarity_measure.pairs([]).shape == (0,)
+
+
+@pytest.mark.parametrize("is_symmetric", [False, True])
+def test_MS2DeepScore_sparse_array(is_symmetric):
+    spectrums, _, similarity_measure = get_test_ms2_deep_score_instance()
+    references = spectrums[:10]
+    queries = references if is_symmetric else spectrums[10:20]
+    idx_row = np.array([0, 3, 3, 9])
+    idx_col = np.array([1, 1, 7, 9])
+    scores = similarity_measure.sparse_array(references, queries, idx_row, idx_col, is_symmetric=is_symmetric)
+    expected_scores = similarity_measure.matrix(references, queries)[idx_row, idx_col]
+    assert np.allclose(scores, expected_scores, atol=1e-6), "Expected same scores as with matrix()"
+
+
+def test_MS2DeepScore_precursor_window_matrix_and_search():
+    spectrums, _, similarity_measure = get_test_ms2_deep_score_instance()
+    references, queries = spectrums[:50], spectrums[50:]
+    reference_mz = np.array([s.get("precursor_mz") for s in references])
+    query_mz = np.array([s.get("precursor_mz") for s in queries])
+    in_window = np.abs(reference_mz[:, np.newaxis] - query_mz[np.newaxis, :]) <= 50
+    expected_scores = similarity_measure.matrix(references, queries)
+
+    scores = similarity_measure.precursor_window_matrix(references, queries, tolerance=50)
+    assert scores.shape[:2] == (50, len(queries))
+    assert len(scores.row) == in_window.sum(), "Expected all pairs within the window"
+    assert np.all(in_window[scores.row, scores.col]), "Expected only pairs within the window"
+    assert np.allclose(scores.to_array()[in_window], expected_scores[in_window], atol=1e-6)
+
+    indices, top_scores = similarity_measure.precursor_window_search(references, queries, k=3, tolerance=50)
+    for j in range(len(queries)):
+        candidates = np.where(in_window[:, j])[0]
+        expected = candidates[np.argsort(-expected_scores[candidates, j], kind="stable")][:3]
+        assert np.array_equal(indices[j, :len(expected)], expected), "Expected best references in window"
+        assert np.all(indices[j, len(expected):] == -1), "Expected padding with -1"
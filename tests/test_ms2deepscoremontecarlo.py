@@ -1,7 +1,7 @@
 from pathlib import Path
 import numpy as np
 import pytest
-from ms2deepscore import MS2DeepScoreMonteCarlo
+from ms2deepscore import EmbeddingStore, MS2DeepScore, MS2DeepScoreMonteCarlo
 from ms2deepscore.models import load_model
 from tests.test_user_worfklow import load_processed_spectrums
 
@@ -65,6 +65,35 @@ def test_MS2DeepScoreMonteCarlo_score_matrix(average_type):
     assert np.max(scores['score']) > 0.5, "Expected higher scores"
 
 
+@pytest.mark.parametrize("average_type", ['median', 'mean'])
+def test_MS2DeepScoreMonteCarlo_score_matrix_sparse(average_type):
+    """Test sparse score calculation using *.matrix* method."""
+    spectrums, _, similarity_measure = get_test_ms2_deep_score_instance(n_ensembles=5,
+                                                                        average_type=average_type)
+    scores = similarity_measure.matrix(spectrums[:4], spectrums[:3], array_type="sparse",
+                                       score_threshold=0.72, max_per_row=2, block_size=2)
+    assert scores.shape == (4, 3, 2), "Expected different shape"
+    assert scores.score_names == ("score", "uncertainty"), "Expected different score names"
+    assert np.all(scores.to_array("score")[scores.row, scores.col] >= 0.72), "Expected only high scores"
+    assert np.all(np.bincount(scores.row) <= 2), "Expected at most 2 scores per row"
+    assert np.all(np.diff(scores.row) >= 0), "Expected entries sorted by row"
+    assert len(scores.row) > 0, "Expected some scores above threshold"
+
+
+@pytest.mark.parametrize("array_type", ['numpy', 'sparse'])
+def test_MS2DeepScoreMonteCarlo_score_matrix_symmetric(array_type):
+    """Test all-vs-all score calculation using *.matrix* method."""
+    spectrums, _, similarity_measure = get_test_ms2_deep_score_instance(n_ensembles=5)
+    scores = similarity_measure.matrix(spectrums[:5], spectrums[:5], array_type=array_type,
+                                       is_symmetric=True, block_size=2)
+    if array_type == "sparse":
+        scores = scores.to_array()
+    assert scores.shape == (5, 5), "Expected different shape"
+    assert np.allclose(scores['score'], scores['score'].T), "Expected symmetric scores"
+    assert np.allclose(scores['uncertainty'], scores['uncertainty'].T), "Expected symmetric uncertainties"
+    assert np.all(np.diag(scores["score"]) > 0.6), "Expected high scores for identical spectra"
+
+
 def test_MS2DeepScoreMonteCarlo_score_matrix_symmetric_wrong_use():
     """Test if *.matrix* method gives correct exception."""
     spectrums, _, similarity_measure = get_test_ms2_deep_score_instance(n_ensembles=2)
@@ -74,3 +103,157 @@ def test_MS2DeepScoreMonteCarlo_score_matrix_symmetric_wrong_use():
                                       [spectrums[i] for i in [1,2,3,0]],
                                       is_symmetric=True)
     assert expected_msg in str(msg), "Expected different exception message"
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 100])
+def test_MS2DeepScoreMonteCarlo_calculate_vectors_batched(batch_size):
+    """Test that every spectrum gets n_ensembles different embeddings in consecutive rows."""
+    spectrums = load_processed_spectrums()[:7]
+    model = load_model(TEST_RESOURCES_PATH / "testmodel.hdf5")
+    similarity_measure = MS2DeepScoreMonteCarlo(model, n_ensembles=4, batch_size=batch_size, progress_bar=False)
+    embeddings = similarity_measure.calculate_vectors(spectrums)
+    assert embeddings.shape == (28, 200), "Expected different embeddings array shape"
+    assert not np.allclose(embeddings[0], embeddings[1]), "Expected different ensemble embeddings"
+
+    mean_embeddings = embeddings.reshape(7, 4, 200).mean(axis=1)
+    deterministic_embeddings = model.base.predict(similarity_measure._create_input_vectors(
+        model.spectrum_binner.transform(spectrums)), verbose=0)
+    similarity = np.sum(mean_embeddings * deterministic_embeddings, axis=1) / \
+        (np.linalg.norm(mean_embeddings, axis=1) * np.linalg.norm(deterministic_embeddings, axis=1))
+    assert np.all(similarity > 0.9), "Expected ensemble mean close to the deterministic embedding"
+
+
+def test_MS2DeepScoreMonteCarlo_additional_input_model():
+    spectrums = load_processed_spectrums()[:4]
+    model = load_model(TEST_RESOURCES_PATH / "testmodel_additional_input.hdf5")
+    similarity_measure = MS2DeepScoreMonteCarlo(model, n_ensembles=3, progress_bar=False)
+    assert similarity_measure.multi_inputs
+    binned_spectrum = model.spectrum_binner.transform([spectrums[0]])[0]
+    inputs = similarity_measure._create_input_vector(binned_spectrum)
+    assert inputs[1].shape == (1, model.nr_of_additional_inputs), "Expected different shape for additional_input"
+    scores = similarity_measure.matrix(spectrums, spectrums[:2])
+    assert scores.shape == (4, 2), "Expected different shape"
+    assert np.all(np.isfinite(scores["score"])), "Expected valid scores"
+
+
+@pytest.mark.parametrize("model_file", ["testmodel.hdf5", "testmodel_additional_input.hdf5"])
+def test_MS2DeepScoreMonteCarlo_random_seed_reproducible(model_file):
+    spectrums = load_processed_spectrums()[:5]
+    model = load_model(TEST_RESOURCES_PATH / model_file)
+    embeddings = MS2DeepScoreMonteCarlo(model, n_ensembles=4, random_seed=42, batch_size=2,
+                                        progress_bar=False).calculate_vectors(spectrums)
+    embeddings_same_seed = MS2DeepScoreMonteCarlo(model, n_ensembles=4, random_seed=42,
+                                                  progress_bar=False).calculate_vectors(spectrums)
+    embeddings_other_seed = MS2DeepScoreMonteCarlo(model, n_ensembles=4, random_seed=1,
+                                                   progress_bar=False).calculate_vectors(spectrums)
+    assert embeddings.shape == (20, 200), "Expected different embeddings array shape"
+    assert np.allclose(embeddings, embeddings_same_seed, atol=1e-6), "Expected identical embeddings for same seed"
+    assert not np.allclose(embeddings, embeddings_other_seed), "Expected different embeddings for other seed"
+    assert not np.allclose(embeddings[0], embeddings[1]), "Expected different ensemble embeddings"
+
+
+def test_MS2DeepScoreMonteCarlo_random_seed_embedding_store(tmp_path):
+    spectrums = load_processed_spectrums()[:6]
+    model = load_model(TEST_RESOURCES_PATH / "testmodel.hdf5")
+    similarity_measure = MS2DeepScoreMonteCarlo(model, n_ensembles=3, random_seed=0, progress_bar=False)
+    store = EmbeddingStore.from_spectrums(tmp_path / "library.ms2ds", similarity_measure, spectrums, chunk_size=4)
+    assert store.embeddings.shape == (6, 600), "Expected all ensemble embeddings of a spectrum in one row"
+
+    scores = similarity_measure.matrix(store, spectrums[:2])
+    expected_scores = similarity_measure.matrix(spectrums, spectrums[:2])
+    assert np.allclose(scores["score"], expected_scores["score"], atol=1e-6), "Expected same scores as without store"
+    assert np.allclose(scores["uncertainty"], expected_scores["uncertainty"], atol=1e-6)
+
+    symmetric_scores = similarity_measure.matrix(store, store, is_symmetric=True)
+    expected_scores = similarity_measure.matrix(spectrums, spectrums)
+    assert np.allclose(symmetric_scores["score"], expected_scores["score"], atol=1e-6), \
+        "Expected same symmetric scores as without store"
+    assert np.allclose(symmetric_scores["uncertainty"], expected_scores["uncertainty"], atol=1e-6)
+
+    other_measure = MS2DeepScoreMonteCarlo(model, n_ensembles=3, random_seed=1, progress_bar=False)
+    with pytest.raises(AssertionError) as msg:
+        other_measure.matrix(store, spectrums[:2])
+    assert "different model" in str(msg.value), "Expected different exception message"
+
+
+def test_MS2DeepScoreMonteCarlo_adaptive_ensembles():
+    spectrums = load_processed_spectrums()[:6]
+    model = load_model(TEST_RESOURCES_PATH / "testmodel.hdf5")
+    expected_scores = MS2DeepScoreMonteCarlo(model, n_ensembles=4, random_seed=0,
+                                             progress_bar=False).matrix(spectrums, spectrums)
+    scores = MS2DeepScoreMonteCarlo(model, n_ensembles=4, random_seed=0, adaptive_tolerance=0,
+                                    progress_bar=False).matrix(spectrums, spectrums)
+    assert np.allclose(scores["score"], expected_scores["score"], atol=1e-6), "Expected same scores for tolerance 0"
+    assert np.allclose(scores["uncertainty"], expected_scores["uncertainty"], atol=1e-6)
+
+    similarity_measure = MS2DeepScoreMonteCarlo(model, n_ensembles=4, random_seed=0, adaptive_tolerance=1.0,
+                                                min_ensembles=2, progress_bar=False)
+    scores = similarity_measure.matrix(spectrums, spectrums, array_type="sparse")
+    assert scores.shape[:2] == (6, 6), "Expected different shape"
+    assert np.all(np.abs(scores.to_array("score")) <= 1), "Expected valid scores"
+    assert np.all(scores.to_array("uncertainty") >= 0), "Expected valid uncertainties"
+
+
+@pytest.mark.parametrize("k, score_threshold", [(3, None), (None, 0.5), (3, 0.5)])
+def test_MS2DeepScoreMonteCarlo_screen_and_rescore(k, score_threshold):
+    spectrums = load_processed_spectrums()[:10]
+    model = load_model(TEST_RESOURCES_PATH / "testmodel.hdf5")
+    similarity_measure = MS2DeepScoreMonteCarlo(model, n_ensembles=4, random_seed=0, progress_bar=False)
+    scores = similarity_measure.screen_and_rescore(spectrums, spectrums[:4], k=k, score_threshold=score_threshold)
+    assert scores.shape[:2] == (10, 4), "Expected different shape"
+
+    deterministic_scores = MS2DeepScore(model, progress_bar=False).matrix(spectrums, spectrums[:4])
+    expected_candidates = np.ones((10, 4), dtype=bool)
+    if k is not None:
+        expected_candidates &= deterministic_scores >= np.sort(deterministic_scores, axis=0)[-k]
+    if score_threshold is not None:
+        expected_candidates &= deterministic_scores >= score_threshold
+    assert np.array_equal(scores.to_array("score") != 0, expected_candidates), "Expected different candidates"
+
+    expected_scores = similarity_measure.matrix(spectrums, spectrums[:4])
+    row, col = scores.row, scores.col
+    assert np.allclose(scores.data["score"], expected_scores["score"][row, col], atol=1e-6), \
+        "Expected same Monte-Carlo scores as for all pairs"
+    assert np.allclose(scores.data["uncertainty"], expected_scores["uncertainty"][row, col], atol=1e-6)
+
+
+def test_MS2DeepScoreMonteCarlo_screen_and_rescore_wrong_use():
+    model = load_model(TEST_RESOURCES_PATH / "testmodel.hdf5")
+    similarity_measure = MS2DeepScoreMonteCarlo(model, n_ensembles=2, progress_bar=False)
+    with pytest.raises(ValueError) as msg:
+        similarity_measure.screen_and_rescore([], [], k=None)
+    assert "Expected k and/or score_threshold" in str(msg.value), "Expected different exception message"
+
+
+def test_MS2DeepScoreMonteCarlo_shared_first_layer():
+    spectrums = load_processed_spectrums()[:3]
+    model = load_model(TEST_RESOURCES_PATH / "testmodel.hdf5")
+    similarity_measure = MS2DeepScoreMonteCarlo(model, n_ensembles=4, progress_bar=False)
+    input_vectors = similarity_measure._create_input_vectors(model.spectrum_binner.transform(spectrums))
+    shared_output = similarity_measure.shared_model.predict(input_vectors, verbose=0)
+    assert shared_output.shape == (3, model.base.get_layer("dense1").units), "Expected output of first layer"
+    embeddings = similarity_measure.ensemble_model.predict(np.repeat(shared_output, 4, axis=0), verbose=0)
+    assert embeddings.shape == (12, 200), "Expected different embeddings array shape"
+    assert not np.allclose(embeddings[0], embeddings[1]), "Expected dropout in ensemble layers"
+
+
+@pytest.mark.parametrize("array_type", ["numpy", "sparse"])
+def test_MS2DeepScoreMonteCarlo_symmetric_computes_about_half_of_the_scores(monkeypatch, array_type):
+    model = load_model(TEST_RESOURCES_PATH / "testmodel.hdf5")
+    similarity_measure = MS2DeepScoreMonteCarlo(model, n_ensembles=2, progress_bar=False)
+    n_pairs = []
+    pooled_scores = similarity_measure._pooled_scores
+
+    def counting_pooled_scores(reference_vectors, query_vectors, out=None):
+        n_pairs.append(reference_vectors.shape[0] * query_vectors.shape[0] // 4)
+        return pooled_scores(reference_vectors, query_vectors, out)
+
+    monkeypatch.setattr(similarity_measure, "_pooled_scores", counting_pooled_scores)
+    vectors = np.random.default_rng(0).random((400 * 2, 200)).astype(np.float32)
+    if array_type == "numpy":
+        scores = similarity_measure._symmetric_matrix(vectors, block_size=1000)
+        expected_scores = pooled_scores(vectors, vectors)[0]
+        assert np.allclose(scores["score"], expected_scores, atol=1e-6), "Expected same scores as full computation"
+    else:
+        similarity_measure._sparse_matrix(vectors, vectors, None, None, 1000, is_symmetric=True)
+    assert sum(n_pairs) < 0.6 * 400 ** 2, "Expected only about half of the pairs to be scored"
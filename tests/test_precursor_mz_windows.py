@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from matchms import Spectrum
+from ms2deepscore.precursor_mz_windows import (get_precursor_mz,
+                                               precursor_mz_candidates)
+
+
+def brute_force_candidates(reference_mz, query_mz, lower, upper):
+    return {(i, j) for j, q_mz in enumerate(query_mz) for i, r_mz in enumerate(reference_mz)
+            if q_mz + lower <= r_mz <= q_mz + upper}
+
+
+def test_get_precursor_mz():
+    spectrums = [Spectrum(mz=np.array([100.]), intensities=np.array([1.]), metadata={"precursor_mz": 150.}),
+                 Spectrum(mz=np.array([100.]), intensities=np.array([1.]), metadata={})]
+    precursor_mz = get_precursor_mz(spectrums)
+    assert precursor_mz[0] == 150.
+    assert np.isnan(precursor_mz[1])
+
+
+@pytest.mark.parametrize("tolerance, mass_shift_range", [(0.5, (0., 0.)), (2., (0., 0.)), (0.1, (-5., 3.))])
+def test_precursor_mz_candidates_dalton(tolerance, mass_shift_range):
+    rng = np.random.default_rng(0)
+    reference_mz = rng.uniform(100, 120, 200)
+    query_mz = rng.uniform(100, 120, 20)
+    rows, cols = precursor_mz_candidates(reference_mz, query_mz, tolerance, "Dalton", mass_shift_range)
+    expected = brute_force_candidates(reference_mz, query_mz, mass_shift_range[0] - tolerance,
+                                      mass_shift_range[1] + tolerance)
+    assert set(zip(rows, cols)) == expected, "Expected same pairs as brute force selection"
+    assert len(rows) == len(expected), "Expected every pair once"
+    assert np.all(np.diff(cols) >= 0), "Expected pairs sorted by query"
+
+
+def test_precursor_mz_candidates_ppm_and_missing_values():
+    reference_mz = np.array([500.0, np.nan, 500.004, 500.006, 499.9])
+    query_mz = np.array([500.0, np.nan])
+    rows, cols = precursor_mz_candidates(reference_mz, query_mz, 10, "ppm")
+    assert rows.tolist() == [0, 2], "Expected references within 10 ppm (5 mDa)"
+    assert cols.tolist() == [0, 0]
+
+
+def test_precursor_mz_candidates_wrong_tolerance_type():
+    with pytest.raises(ValueError):
+        precursor_mz_candidates(np.array([1.]), np.array([1.]), 1, "Da")
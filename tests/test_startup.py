@@ -0,0 +1,21 @@
+import subprocess
+import sys
+from pathlib import Path
+from ms2deepscore.benchmarks import benchmark_startup
+
+
+TEST_RESOURCES_PATH = Path(__file__).parent / 'resources'
+
+
+def test_import_does_not_import_tensorflow():
+    code = "import sys, ms2deepscore; from ms2deepscore.models import load_model; print('tensorflow' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert output.strip().splitlines()[-1] == "False", "Expected TensorFlow not to be imported"
+
+
+def test_benchmark_startup():
+    results = benchmark_startup(TEST_RESOURCES_PATH / "testmodel.hdf5",
+                                TEST_RESOURCES_PATH / "pesticides_processed.mgf", n_repeats=1)
+    assert len(results) == 1
+    assert set(results[0].keys()) == {"import_time", "model_load_time", "first_score_time"}
+    assert all(value > 0 for value in results[0].values())
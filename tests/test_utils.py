@@ -37,3 +37,9 @@ def test_return_non_existing_file_name(tmpdir):
     # Create the first duplicate and test again
     open(first_duplicate, "w").close()
     assert utils.return_non_existing_file_name(base_filename) == tmpdir.join("test_file(2).txt")
+
+
+def test_get_spectrum_ids():
+    spectrums = [{"spectrum_id": "abc"}, {}, {"spectrum_id": 12}]
+    assert utils.get_spectrum_ids(spectrums) == ["abc", "1", "12"]
+    assert utils.get_spectrum_ids(spectrums, start=10) == ["abc", "11", "12"]
@@ -1,9 +1,16 @@
+import tracemalloc
 import numpy as np
 import pytest
-from ms2deepscore.vector_operations import (cosine_similarity,
-                                            cosine_similarity_matrix,
-                                            iqr_pooling, mean_pooling,
-                                            median_pooling, std_pooling)
+from ms2deepscore import vector_operations
+from ms2deepscore.vector_operations import (
+    adaptive_ensemble_cosine_similarity_pooled, cosine_similarity,
+    cosine_similarity_matrix, cosine_similarity_matrix_parallel,
+    cosine_similarity_matrix_symmetric, cosine_similarity_matrix_tiled,
+    cosine_similarity_sparse, cosine_similarity_sparse_symmetric,
+    ensemble_cosine_similarity_pairs, ensemble_cosine_similarity_pooled,
+    ensemble_pooling, float16_dot_product_matrix, int8_dot_product_matrix,
+    iqr_pooling, mean_pooling, median_pooling, pairs_from_embeddings,
+    quantize_vectors, std_pooling, top_k_cosine_similarity, update_top_k)
 
 
 @pytest.mark.parametrize("numba_compiled", [True, False])
@@ -95,6 +102,120 @@ def test_cosine_similarity_matrix_input_cloned(numba_compiled):
                                               [2, 0, 2, 2]])), "Expected unchanged input."
 
 
+@pytest.mark.parametrize("block_size", [1, 2, 3, 100])
+def test_cosine_similarity_matrix_tiled(block_size):
+    """Test if tiled cosine similarity gives same scores as the full computation."""
+    rng = np.random.default_rng(0)
+    vectors1 = rng.random((7, 5))
+    vectors2 = rng.random((4, 5))
+    scores = cosine_similarity_matrix_tiled(vectors1, vectors2, block_size=block_size)
+    assert scores.dtype == np.float32, "Expected float32 scores by default"
+    assert np.allclose(scores, cosine_similarity_matrix(vectors1, vectors2), atol=1e-6), \
+        "Expected different scores."
+
+
+def test_cosine_similarity_matrix_tiled_memmap_output(tmp_path):
+    """Test writing tiled cosine similarity scores into a memory-mapped array."""
+    rng = np.random.default_rng(0)
+    vectors1 = rng.random((5, 3))
+    vectors2 = rng.random((6, 3))
+    vectors2[2, :] = 0
+    out = np.memmap(tmp_path / "scores.dat", dtype=np.float64, mode="w+", shape=(5, 6))
+    scores = cosine_similarity_matrix_tiled(vectors1, vectors2, block_size=2, out=out)
+    assert scores is out, "Expected scores to be written into given array"
+    expected_scores = cosine_similarity_matrix(vectors1, vectors2)
+    expected_scores[:, 2] = 0
+    assert np.allclose(np.array(out), expected_scores, atol=1e-12), "Expected different scores."
+
+
+@pytest.mark.parametrize("block_size, k", [[1, 3], [4, 3], [100, 3], [3, 20]])
+def test_top_k_cosine_similarity(block_size, k):
+    """Test if block-wise top-k selection gives the best scores of the full matrix."""
+    rng = np.random.default_rng(1)
+    references = rng.random((11, 4)) - 0.5
+    queries = rng.random((5, 4)) - 0.5
+    indices, scores = top_k_cosine_similarity(references, queries, k, block_size=block_size)
+    expected_scores = cosine_similarity_matrix(references, queries).T
+    expected_indices = np.argsort(-expected_scores, axis=1)[:, :min(k, 11)]
+    assert indices.shape == scores.shape == (5, min(k, 11)), "Expected different shape"
+    assert np.array_equal(indices, expected_indices), "Expected different top-k indices"
+    assert np.allclose(scores, np.take_along_axis(expected_scores, expected_indices, axis=1), atol=1e-6), \
+        "Expected different top-k scores"
+
+
+@pytest.mark.parametrize("k", [0, -1])
+def test_top_k_cosine_similarity_invalid_k(k):
+    vectors = np.random.default_rng(1).random((5, 4))
+    with pytest.raises(ValueError, match="Expected k >= 1"):
+        top_k_cosine_similarity(vectors, vectors, k)
+
+
+def test_update_top_k_small_temporaries():
+    """Test that merging a large score block only needs small temporary arrays."""
+    rng = np.random.default_rng(3)
+    block_scores = rng.random((4000, 5000)).astype(np.float32)
+    top_indices = np.zeros((4000, 10), dtype=np.int64)
+    top_scores = np.full((4000, 10), -np.inf, dtype=np.float32)
+    tracemalloc.start()
+    update_top_k(top_indices, top_scores, block_scores[:, :2500], 0)
+    update_top_k(top_indices, top_scores, block_scores[:, 2500:], 2500)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak_memory < block_scores.nbytes / 4, "Expected temporaries much smaller than the score block"
+    expected_indices = np.argsort(-block_scores, axis=1)[:, :10]
+    assert np.array_equal(np.sort(top_indices, axis=1), np.sort(expected_indices, axis=1)), \
+        "Expected different top-k indices"
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 100])
+@pytest.mark.parametrize("score_threshold, max_per_row", [[None, None], [0.3, None], [0.3, 2], [None, 1]])
+def test_cosine_similarity_sparse(block_size, score_threshold, max_per_row):
+    """Test if sparse cosine similarity keeps the expected entries of the full matrix."""
+    rng = np.random.default_rng(2)
+    vectors1 = rng.random((7, 4)) - 0.5
+    vectors2 = rng.random((5, 4)) - 0.5
+    row, col, scores = cosine_similarity_sparse(vectors1, vectors2, score_threshold=score_threshold,
+                                                max_per_row=max_per_row, block_size=block_size)
+    expected_scores = cosine_similarity_matrix(vectors1, vectors2)
+    expected_mask = np.ones(expected_scores.shape, dtype=bool)
+    if score_threshold is not None:
+        expected_mask = expected_scores >= score_threshold
+    if max_per_row is not None:
+        ranks = np.argsort(np.argsort(-expected_scores, axis=1), axis=1)
+        expected_mask &= ranks < max_per_row
+    assert np.array_equal(np.sort(row * 5 + col), np.flatnonzero(expected_mask)), "Expected different entries"
+    assert np.allclose(scores, expected_scores[row, col], atol=1e-6), "Expected different scores"
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 100])
+def test_cosine_similarity_matrix_symmetric(block_size):
+    """Test if symmetric computation gives the full all-vs-all score matrix."""
+    vectors = np.random.default_rng(3).random((7, 4))
+    expected_scores = cosine_similarity_matrix(vectors, vectors)
+    scores = cosine_similarity_matrix_symmetric(vectors, block_size=block_size)
+    assert np.allclose(scores, expected_scores, atol=1e-6), "Expected different scores."
+
+    packed_scores = cosine_similarity_matrix_symmetric(vectors, block_size=block_size, packed=True)
+    assert packed_scores.shape == (28,), "Expected packed upper triangle"
+    assert np.allclose(packed_scores, expected_scores[np.triu_indices(7)], atol=1e-6), \
+        "Expected different packed scores."
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 100])
+@pytest.mark.parametrize("score_threshold, max_per_row", [[None, None], [0.8, None], [0.8, 2]])
+def test_cosine_similarity_sparse_symmetric(block_size, score_threshold, max_per_row):
+    """Test if symmetric sparse computation gives the same as the non-symmetric one."""
+    vectors = np.random.default_rng(4).random((7, 4))
+    row, col, scores = cosine_similarity_sparse_symmetric(vectors, score_threshold=score_threshold,
+                                                          max_per_row=max_per_row, block_size=block_size)
+    expected_row, expected_col, expected_scores = cosine_similarity_sparse(vectors, vectors,
+                                                                           score_threshold=score_threshold,
+                                                                           max_per_row=max_per_row)
+    assert np.array_equal(row, expected_row), "Expected different rows"
+    assert np.array_equal(col, expected_col), "Expected different columns"
+    assert np.allclose(scores, expected_scores, atol=1e-6), "Expected different scores"
+
+
 def test_different_input_vector_lengths():
     """Test if correct error is raised."""
     vector1 = np.array([0, 0, 0, 0])
@@ -172,3 +293,201 @@ def test_iqr_pooling(numba_compiled):
                              [3.5, 6. ]])
     assert np.allclose(scores_iqr, iqr_expected, atol=1e-8), \
         "Expected different pooled interquantile ranges"
+
+
+def test_quantize_vectors_int8():
+    vectors = np.array([[1., 2., -4.], [0., 0., 0.]])
+    quantized, scales = quantize_vectors(vectors, np.int8)
+    assert quantized.dtype == np.int8
+    assert np.array_equal(quantized[0], [32, 64, -127]), "Expected different quantized values"
+    assert np.array_equal(quantized[1], [0, 0, 0]), "Expected zero vector to stay zero"
+    assert np.allclose(quantized[0] * scales[0], vectors[0] / np.sqrt(21), atol=0.01), \
+        "Expected scales to map back to the normalized vector"
+
+
+@pytest.mark.parametrize("n_vectors_1, n_vectors_2", [(5, 3), (9, 70), (1, 33)])
+def test_int8_dot_product_matrix(n_vectors_1, n_vectors_2):
+    rng = np.random.default_rng(0)
+    vectors_1 = rng.integers(-127, 128, (n_vectors_1, 40)).astype(np.int8)
+    vectors_2 = rng.integers(-127, 128, (n_vectors_2, 40)).astype(np.int8)
+    expected = vectors_1.astype(np.int64) @ vectors_2.astype(np.int64).T
+    assert np.array_equal(int8_dot_product_matrix(vectors_1, vectors_2), expected), "Expected exact dot products"
+
+
+@pytest.mark.parametrize("n_vectors_1, n_vectors_2", [(5, 3), (9, 70), (1, 33)])
+def test_float16_dot_product_matrix(n_vectors_1, n_vectors_2):
+    rng = np.random.default_rng(0)
+    vectors_1 = rng.random((n_vectors_1, 40)) - 0.5
+    vectors_2 = (rng.random((n_vectors_2, 40)) - 0.5).astype(np.float16)
+    vectors_2[0, :4] = [1e-7, -3e-6, 0., -0.]  # subnormal numbers and signed zeros
+    expected = vectors_1.astype(np.float32) @ vectors_2.astype(np.float32).T
+    dot_products = float16_dot_product_matrix(vectors_1, vectors_2)
+    assert dot_products.dtype == np.float32
+    assert np.allclose(dot_products, expected, atol=1e-5), "Expected same dot products as float32"
+
+
+def test_pairs_from_embeddings():
+    rng = np.random.default_rng(0)
+    vectors_1 = rng.random((6, 8))
+    vectors_2 = rng.random((4, 8))
+    vectors_2[3] = 0
+    rows = np.array([0, 5, 5, 2])
+    cols = np.array([1, 0, 3, 2])
+    scores = pairs_from_embeddings(vectors_1, vectors_2, rows, cols)
+    expected_scores = cosine_similarity_matrix(vectors_1, vectors_2)[rows, cols]
+    expected_scores[2] = 0
+    assert np.allclose(scores, expected_scores, atol=1e-6), "Expected different scores"
+
+
+@pytest.mark.parametrize("numba_compiled", [True, False])
+@pytest.mark.parametrize("n_ensembles", [1, 2, 5])
+def test_ensemble_pooling(numba_compiled, n_ensembles):
+    """Test if one-pass pooling gives the same results as numpy per block."""
+    scores = np.random.default_rng(0).random((3 * n_ensembles, 4 * n_ensembles))
+    scores[:n_ensembles, :n_ensembles] = 0.5  # ties
+    pooling = ensemble_pooling if numba_compiled else ensemble_pooling.py_func
+    blocks = [[scores[i * n_ensembles:(i + 1) * n_ensembles, j * n_ensembles:(j + 1) * n_ensembles]
+               for j in range(4)] for i in range(3)]
+
+    median_scores, iqr_scores = pooling(scores, n_ensembles, True)
+    assert np.allclose(median_scores, [[np.median(b) for b in row] for row in blocks], atol=1e-8)
+    assert np.allclose(iqr_scores, [[np.subtract(*np.percentile(b, [75, 25])) for b in row] for row in blocks],
+                       atol=1e-8)
+    mean_scores, std_scores = pooling(scores, n_ensembles, False)
+    assert np.allclose(mean_scores, [[np.mean(b) for b in row] for row in blocks], atol=1e-8)
+    assert np.allclose(std_scores, [[np.std(b) for b in row] for row in blocks], atol=1e-8)
+
+
+@pytest.mark.parametrize("use_median", [True, False])
+@pytest.mark.parametrize("block_size", [1, 3, 100])
+def test_ensemble_cosine_similarity_pooled(use_median, block_size):
+    """Test if tiled pooled scores equal pooling of the full ensemble score matrix."""
+    rng = np.random.default_rng(0)
+    vectors_1 = rng.random((7 * 4, 10))
+    vectors_2 = rng.random((5 * 4, 10))
+    expected_average, expected_uncertainty = ensemble_pooling(cosine_similarity_matrix(vectors_1, vectors_2),
+                                                              4, use_median)
+    out = (np.zeros((7, 5)), np.zeros((7, 5)))
+    average, uncertainty = ensemble_cosine_similarity_pooled(vectors_1, vectors_2, 4, use_median,
+                                                             block_size=block_size, out=out)
+    assert average is out[0] and uncertainty is out[1], "Expected results in given output arrays"
+    assert np.allclose(average, expected_average, atol=1e-6), "Expected different average scores"
+    assert np.allclose(uncertainty, expected_uncertainty, atol=1e-6), "Expected different uncertainties"
+
+
+@pytest.mark.parametrize("use_median", [True, False])
+def test_adaptive_ensemble_cosine_similarity_pooled(use_median):
+    rng = np.random.default_rng(0)
+    vectors_1 = np.repeat(rng.normal(size=(6, 10)), 8, axis=0) + rng.normal(scale=0.3, size=(48, 10))
+    vectors_2 = np.repeat(rng.normal(size=(5, 10)), 8, axis=0) + rng.normal(scale=0.3, size=(40, 10))
+    expected_average, expected_uncertainty = ensemble_cosine_similarity_pooled(vectors_1, vectors_2, 8, use_median)
+
+    average, uncertainty, ensemble_sizes = adaptive_ensemble_cosine_similarity_pooled(
+        vectors_1, vectors_2, 8, tolerance=0, use_median=use_median)
+    assert np.all(ensemble_sizes == 8), "Expected full ensembles for tolerance 0"
+    assert np.allclose(average, expected_average, atol=1e-6), "Expected different average scores"
+    assert np.allclose(uncertainty, expected_uncertainty, atol=1e-6), "Expected different uncertainties"
+
+    average, uncertainty, ensemble_sizes = adaptive_ensemble_cosine_similarity_pooled(
+        vectors_1, vectors_2, 8, tolerance=np.inf, min_ensembles=3, use_median=use_median)
+    expected_average, expected_uncertainty = ensemble_cosine_similarity_pooled(
+        vectors_1.reshape(6, 8, 10)[:, :3].reshape(-1, 10), vectors_2.reshape(5, 8, 10)[:, :3].reshape(-1, 10),
+        3, use_median)
+    assert np.all(ensemble_sizes == 3), "Expected min_ensembles for all pairs"
+    assert np.allclose(average, expected_average, atol=1e-6), "Expected scores of first ensemble members"
+    assert np.allclose(uncertainty, expected_uncertainty, atol=1e-6), "Expected different uncertainties"
+
+    _, _, ensemble_sizes = adaptive_ensemble_cosine_similarity_pooled(
+        vectors_1, vectors_2, 8, tolerance=0.02, use_median=use_median)
+    assert set(np.unique(ensemble_sizes)) <= {2, 4, 8}, "Expected doubling ensemble sizes"
+    assert 0 < np.sum(ensemble_sizes < 8) < ensemble_sizes.size, "Expected only some pairs to converge early"
+
+
+@pytest.mark.parametrize("use_median", [True, False])
+def test_ensemble_cosine_similarity_pairs(use_median):
+    rng = np.random.default_rng(0)
+    vectors_1 = rng.random((7 * 4, 10))
+    vectors_2 = rng.random((5 * 4, 10))
+    expected_average, expected_uncertainty = ensemble_cosine_similarity_pooled(vectors_1, vectors_2, 4, use_median)
+    rows, cols = np.array([0, 6, 3, 3]), np.array([4, 0, 2, 2])
+    average, uncertainty = ensemble_cosine_similarity_pairs(vectors_1, vectors_2, rows, cols, 4, use_median)
+    assert np.allclose(average, expected_average[rows, cols], atol=1e-6), "Expected different average scores"
+    assert np.allclose(uncertainty, expected_uncertainty[rows, cols], atol=1e-6), "Expected different uncertainties"
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_cosine_similarity_matrix_parallel(dtype):
+    rng = np.random.default_rng(0)
+    vectors_1 = rng.random((7, 10)).astype(dtype)
+    vectors_2 = rng.random((5, 10))
+    vectors_2[3] = 0
+    scores = cosine_similarity_matrix_parallel(vectors_1, vectors_2, dtype=dtype)
+    assert scores.dtype == dtype, "Expected scores of given dtype"
+    assert np.allclose(scores[:, [0, 1, 2, 4]], cosine_similarity_matrix(vectors_1, vectors_2[[0, 1, 2, 4]]),
+                       atol=1e-6), "Expected different scores"
+    assert np.all(scores[:, 3] == 0), "Expected score 0 for vector with norm 0"
+
+    out = np.empty((7, 5), dtype=dtype)
+    assert cosine_similarity_matrix_parallel(vectors_1, vectors_2, out=out, dtype=dtype) is out, \
+        "Expected scores in given output array"
+    assert np.array_equal(out, scores), "Expected same scores"
+    out = np.zeros((10, 10))
+    cosine_similarity_matrix_parallel(vectors_1, vectors_2, out=out[2:9, 1:6], dtype=dtype)
+    assert np.allclose(out[2:9, 1:6], scores, atol=1e-6), "Expected scores in non-contiguous output"
+    assert np.all(out[:2] == 0) and np.all(out[:, 6:] == 0), "Expected only selected part to be written"
+
+
+@pytest.mark.parametrize("function, arguments", [
+    (top_k_cosine_similarity, {"k": 2}),
+    (cosine_similarity_matrix_tiled, {}),
+    (cosine_similarity_sparse, {}),
+])
+def test_vectors_prepared_once_per_call(monkeypatch, function, arguments):
+    """Test that vectors are cast and their norms computed once per call, not once per tile."""
+    calls = []
+    prepare_vectors = vector_operations._prepare_vectors
+
+    def counting_prepare_vectors(vectors, dtype):
+        calls.append(vectors.shape[0])
+        return prepare_vectors(vectors, dtype)
+
+    monkeypatch.setattr(vector_operations, "_prepare_vectors", counting_prepare_vectors)
+    rng = np.random.default_rng(4)
+    function(rng.random((11, 4)).astype(np.float32), rng.random((9, 4)), block_size=3, **arguments)
+    assert sorted(calls) == [9, 11], "Expected vectors to be prepared once per call"
+
+
+@pytest.mark.parametrize("function", [cosine_similarity_matrix_symmetric, cosine_similarity_sparse_symmetric])
+def test_symmetric_vectors_prepared_once(monkeypatch, function):
+    calls = []
+    prepare_vectors = vector_operations._prepare_vectors
+    monkeypatch.setattr(vector_operations, "_prepare_vectors",
+                        lambda vectors, dtype: calls.append(vectors.shape[0]) or prepare_vectors(vectors, dtype))
+    function(np.random.default_rng(5).random((10, 4)), block_size=3)
+    assert calls == [10], "Expected vectors to be prepared once per call"
+
+
+def test_prepare_vectors_without_copy():
+    vectors = np.random.default_rng(6).random((5, 4)).astype(np.float32)
+    vectors[2] = 0
+    prepared_vectors, inverse_norms = vector_operations._prepare_vectors(vectors, np.float32)
+    assert prepared_vectors is vectors, "Expected no copy of float32 vectors"
+    assert inverse_norms[2] == 0, "Expected inverse norm 0 for vector with norm 0"
+    assert np.allclose(inverse_norms[[0, 1, 3, 4]], 1 / np.linalg.norm(vectors[[0, 1, 3, 4]], axis=1))
+
+
+@pytest.mark.parametrize("function", [cosine_similarity_matrix_symmetric, cosine_similarity_sparse_symmetric])
+def test_symmetric_computes_about_half_of_the_scores(monkeypatch, function):
+    """Test that the symmetric paths compute only about half of all scores, also when
+    all vectors fit into one block."""
+    n_scores = []
+    cosine_similarity_tile = vector_operations._cosine_similarity_tile
+
+    def counting_cosine_similarity_tile(vectors_1, inverse_norms_1, vectors_2, inverse_norms_2, out):
+        n_scores.append(vectors_1.shape[0] * vectors_2.shape[0])
+        return cosine_similarity_tile(vectors_1, inverse_norms_1, vectors_2, inverse_norms_2, out)
+
+    monkeypatch.setattr(vector_operations, "_cosine_similarity_tile", counting_cosine_similarity_tile)
+    vectors = np.random.default_rng(7).random((4000, 4)) - 0.5
+    function(vectors, block_size=10_000)
+    assert sum(n_scores) < 0.6 * 4000 ** 2, "Expected only about half of the scores to be computed"